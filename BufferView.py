@@ -38,7 +38,7 @@ class BufferView(wx.Frame, Module):
         buffer = None
         if pipe is not None:
             try:
-                buffer = pipe._buffer + pipe._queue
+                buffer = b''.join([f[0] for f in list(pipe._frames)]) + bytes(pipe._buffer) + bytes(pipe._queue)
             except AttributeError:
                 buffer = None
         if buffer is None:
@@ -1,3 +1,6 @@
+import time
+from array import array
+
 import usb.core
 import usb.util
 from CH341DriverBase import *
@@ -26,6 +29,32 @@ mCH341A_DELAY_MS = 0x5E
 mCH341A_GET_VER = 0x5F
 
 
+class UsbTiming:
+    """
+    Count and durations of a driver call. The minimum is the round trip floor of the USB.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = float('inf')
+        self.maximum = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds < self.minimum:
+            self.minimum = seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+
+    def __str__(self):
+        if self.count == 0:
+            return "0 calls"
+        return "%d calls, mean %.3fms, min %.3fms, max %.3fms" % \
+               (self.count, self.total * 1000.0 / self.count, self.minimum * 1000.0, self.maximum * 1000.0)
+
+
 class CH341LibusbDriver:
     """
     Libusb driver for the CH341 chip. The CH341x is a USB interface chip that can emulate UART, parallel port,
@@ -45,13 +74,23 @@ class CH341LibusbDriver:
     All the commands during the opening phase will raise a ConnectionRefusedError.
     All commands during read and write raise ConnectionErrors
     All commands during close don't care about errors, if it broke it's likely already closed.
+
+    Writes and status reads reuse preallocated transfer buffers, and each is timed. Where the bulk endpoint packets
+    are 32 bytes, all the EPP packets of a write are issued as a single bulk transfer, the USB splits them on the same
+    packet boundaries as separate writes would.
     """
 
     def __init__(self, state_listener=None):
         self.devices = {}
         self.interface = {}
+        self.packet_size = {}  # Max packet size of the bulk write endpoint.
+        self.found = None  # Cached enumeration of the matching devices.
         self.state_listener = state_listener
         self.state = None
+        self._write_buffer = bytearray(2 * mCH341_PACKET_LENGTH)
+        self._status_command = array('B', [mCH341_PARA_CMD_STS])
+        self._status_buffer = array('B', bytes(6))
+        self.timing = {'write': UsbTiming(), 'status': UsbTiming(), 'write_status': UsbTiming()}
 
     def set_status(self, code):
         self.state_listener(code)
@@ -59,21 +98,28 @@ class CH341LibusbDriver:
             self.state = code
 
     def connect_find(self, index=0):
-        self.set_status(STATE_DRIVER_LIBUSB)
-        self.set_status(STATE_DRIVER_FINDING_DEVICES)
-        try:
-            devices = usb.core.find(idVendor=USB_LOCK_VENDOR, idProduct=USB_LOCK_PRODUCT, find_all=True)
-        except usb.core.USBError:
-            raise ConnectionRefusedError
-        devices = [d for d in devices]
-        if len(devices) == 0:
-            self.set_status(STATE_DEVICE_NOT_FOUND)
-            raise ConnectionRefusedError
-        for d in devices:
-            self.set_status(STATE_DEVICE_FOUND)
-            string = str(d)
-            string = string.replace('\n', '\n\t')
-            self.set_status(string)
+        """
+        Finds the device at the index. The enumeration is cached, so trying each index in turn enumerates the USB
+        once. The cache is dropped whenever a device fails to open or is reset.
+        """
+        devices = self.found
+        if devices is None or index >= len(devices):
+            self.set_status(STATE_DRIVER_LIBUSB)
+            self.set_status(STATE_DRIVER_FINDING_DEVICES)
+            try:
+                devices = usb.core.find(idVendor=USB_LOCK_VENDOR, idProduct=USB_LOCK_PRODUCT, find_all=True)
+            except usb.core.USBError:
+                raise ConnectionRefusedError
+            devices = [d for d in devices]
+            if len(devices) == 0:
+                self.set_status(STATE_DEVICE_NOT_FOUND)
+                raise ConnectionRefusedError
+            for d in devices:
+                self.set_status(STATE_DEVICE_FOUND)
+                string = str(d)
+                string = string.replace('\n', '\n\t')
+                self.set_status(string)
+            self.found = devices
         try:
             device = devices[index]
         except IndexError:
@@ -166,6 +212,8 @@ class CH341LibusbDriver:
             self.devices[index] = device
             interface = self.connect_interface(device)
             self.interface[index] = interface
+            endpoint = usb.util.find_descriptor(interface, bEndpointAddress=BULK_WRITE_ENDPOINT)
+            self.packet_size[index] = endpoint.wMaxPacketSize if endpoint is not None else 0
 
             self.connect_detach(device, interface)
             try:
@@ -180,9 +228,34 @@ class CH341LibusbDriver:
             self.set_status(STATE_DRIVER_NO_BACKEND)
             return -1
         except ConnectionRefusedError:
+            self.found = None
             self.set_status(STATE_CONNECTION_FAILED)
             return -1
 
+    def CH341ReclaimDevice(self, index=0):
+        """
+        Reclaims the interface of an opened device, after a connection error. The cached device handle and interface
+        are reused, the USB is not enumerated or reset.
+
+        Raises ConnectionRefusedError if the device must be opened again.
+        """
+        try:
+            device = self.devices[index]
+            interface = self.interface[index]
+        except KeyError:
+            raise ConnectionRefusedError
+        if device is None:
+            raise ConnectionRefusedError
+        self.set_status(STATE_CONNECTING)
+        try:
+            self.disconnect_interface(device, interface)
+            self.connect_detach(device, interface)
+            self.connect_claim(device, interface)
+        except usb.core.USBError:
+            # Device handle is stale.
+            raise ConnectionRefusedError
+        self.set_status(STATE_USB_CONNECTED)
+
     def CH341CloseDevice(self, index=0):
         """Closes device."""
         device = self.devices[index]
@@ -197,6 +270,7 @@ class CH341LibusbDriver:
                 self.set_status(STATE_USB_DISCONNECTED)
             except ConnectionError:
                 pass
+        self.found = None  # The reset device enumerates again.
 
     def CH341InitParallel(self, index=0, mode=CH341_PARA_MODE_EPP19):  # Mode 1, we need EPP 1.9
         """Permits setting a mode, but our mode is only 1 since the device is using
@@ -231,20 +305,70 @@ class CH341LibusbDriver:
         except usb.core.USBError:
             raise ConnectionError
 
+    def epp_packets(self, buffer, pipe=0):
+        """
+        Lays out the data as EPP write packets, each a command byte and up to 31 data bytes, within the preallocated
+        write buffer.
+
+        :return: memoryview of the packets.
+        """
+        command = mCH341_PARA_CMD_W0 if pipe == 0 else mCH341_PARA_CMD_W1
+        length = len(buffer)
+        count = (length + 30) // 31
+        size = length + count
+        if len(self._write_buffer) < size:
+            self._write_buffer = bytearray(count * mCH341_PACKET_LENGTH)
+        packets = self._write_buffer
+        for i in range(count):
+            position = i * mCH341_PACKET_LENGTH
+            data = buffer[i * 31:i * 31 + 31]
+            packets[position] = command
+            packets[position + 1:position + 1 + len(data)] = data
+        return memoryview(packets)[:size]
+
+    def epp_write(self, index, buffer, pipe=0):
+        device = self.devices[index]
+        packets = self.epp_packets(buffer, pipe)
+        try:
+            if self.packet_size.get(index) == mCH341_PACKET_LENGTH:
+                device.write(BULK_WRITE_ENDPOINT, packets, 200)
+            else:
+                for i in range(0, len(packets), mCH341_PACKET_LENGTH):
+                    device.write(BULK_WRITE_ENDPOINT, packets[i:i + mCH341_PACKET_LENGTH], 200)
+        except usb.core.USBError:
+            raise ConnectionError
+
+    def status_read(self, index):
+        device = self.devices[index]
+        try:
+            device.write(BULK_WRITE_ENDPOINT, self._status_command, 200)
+            device.read(BULK_READ_ENDPOINT, self._status_buffer, 200)
+        except usb.core.USBError:
+            raise ConnectionError
+        return self._status_buffer.tolist()
+
     def CH341EppWrite(self, index=0, buffer=None, length=0, pipe=0):
         if buffer is not None:
-            device = self.devices[index]
-            data = convert_to_list_bytes(buffer)
-            while len(data) > 0:
-                if pipe == 0:
-                    packet = [mCH341_PARA_CMD_W0] + data[:31]
-                else:
-                    packet = [mCH341_PARA_CMD_W1] + data[:31]
-                data = data[31:]
-                try:
-                    device.write(BULK_WRITE_ENDPOINT, packet, 200)
-                except usb.core.USBError:
-                    raise ConnectionError
+            start = time.perf_counter()
+            self.epp_write(index, buffer, pipe)
+            self.timing['write'].add(time.perf_counter() - start)
+
+    def CH341EppWriteStatus(self, index=0, buffer=None, length=0, pipe=0):
+        """
+        Writes the data and reads the status that follows it, in one call. A failed write raises ConnectionError. A
+        failed status read does not, since the data was already written.
+
+        :return: status bytes, or None if the status could not be read.
+        """
+        start = time.perf_counter()
+        if buffer is not None:
+            self.epp_write(index, buffer, pipe)
+        try:
+            status = self.status_read(index)
+        except ConnectionError:
+            status = None
+        self.timing['write_status'].add(time.perf_counter() - start)
+        return status
 
     def CH341EppRead(self, index=0, buffer=None, length=0, pipe=0):
         try:
@@ -252,15 +376,12 @@ class CH341LibusbDriver:
         except usb.core.USBError:
             raise ConnectionError
 
-    def CH341GetStatus(self, index=0, status=[0]):
+    def CH341GetStatus(self, index=0):
         """D7-0, 8: err, 9: pEmp, 10: Int, 11: SLCT, 12: SDA, 13: Busy, 14: datas, 15: addrs"""
-        device = self.devices[index]
-        try:
-            device.write(BULK_WRITE_ENDPOINT, [mCH341_PARA_CMD_STS], 200)
-            status[0] = device.read(BULK_READ_ENDPOINT, 6, 200)
-        except usb.core.USBError:
-            raise ConnectionError
-        return status[0]
+        start = time.perf_counter()
+        status = self.status_read(index)
+        self.timing['status'].add(time.perf_counter() - start)
+        return status
         # 48, reads 0xc0, 95, 0, 0 (30,00? = 48)
 
     def CH341GetVerIC(self, index=0):
@@ -339,7 +460,7 @@ class CH341Driver:
                 self.driver_value = val
                 return -1
         if self.address != -1:
-            address = self.driver.devices[val].bus
+            address = self.driver.devices[val].address
             if self.address != address:
                 # Rejected
                 self.set_status(STATE_DEVICE_REJECTED)
@@ -375,13 +496,42 @@ class CH341Driver:
                 raise ConnectionRefusedError
             self.set_status(STATE_CONNECTED)
 
+    def reconnect(self):
+        """
+        Fast reconnect after a connection error. The cached device is reclaimed and put back into EPP 1.9 mode,
+        without enumerating or resetting the USB.
+
+        Raises ConnectionRefusedError if the device must be closed and opened again.
+        """
+        if self.driver_value is None:
+            raise ConnectionRefusedError
+        self.driver.CH341ReclaimDevice(self.driver_index)
+        self.set_status(STATE_CH341_PARAMODE)
+        try:
+            self.driver.CH341InitParallel(self.driver_index, 1)  # 0x40, 177, 0x8800, 0, 0
+            self.set_status(STATE_CH341_PARAMODE_SUCCESS)
+        except ConnectionError:
+            self.set_status(STATE_CH341_PARAMODE_FAIL)
+            raise ConnectionRefusedError
+        self.set_status(STATE_CONNECTED)
+
     def close(self):
         self.driver.CH341CloseDevice(self.driver_index)
         self.driver_value = None
 
+    @property
+    def timing(self):
+        return self.driver.timing
+
     def write(self, packet):
         self.driver.CH341EppWriteData(self.driver_index, packet, len(packet))
 
+    def write_status(self, packet):
+        """
+        Writes the packet and reads the status following it.
+        """
+        return self.driver.CH341EppWriteStatus(self.driver_index, packet, len(packet))
+
     def get_status(self):
         return self.driver.CH341GetStatus(self.driver_index)
 
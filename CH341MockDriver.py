@@ -0,0 +1,267 @@
+import time
+from collections import deque
+from random import random
+
+from CH341DriverBase import *
+from LaserSpeed import LaserSpeed
+from LhystudiosDevice import STATUS_OK, STATUS_ERROR, STATUS_FINISH, STATUS_BUSY, onewire_crc_lookup
+
+"""
+Simulated Lhystudios board, driven through the same API as the CH341 drivers.
+
+The board parses the LHYMICRO-GL data it is sent, and models its internal packet buffer and the time needed for the
+motion within each packet. Status reads answer OK, BUSY, ERROR and FINISH as the hardware would, so the controller can
+be exercised and its throughput measured without a laser attached.
+"""
+
+MODE_RAPID = 0
+MODE_PROGRAM = 1
+
+STEPS_PER_MM = 1000.0 / 25.4
+
+
+class LhystudioBoard:
+    """
+    Timing model of a Lhystudios board.
+
+    Packets are accepted into a buffer of buffer_size packets. Each accepted packet is parsed and given a motion time
+    from the distances it contains and the current speed, with speed codes decoded by LaserSpeed. Packets execute in
+    order, and a packet written while the buffer is full is held, reporting BUSY, until the board makes room for it.
+    """
+
+    def __init__(self, board='M2', buffer_size=16, rapid_speed=100.0, mode_change_time=0.02,
+                 status_latency=0.0005, write_latency=0.0005, error_rate=0.0):
+        self.board = board
+        self.buffer_size = buffer_size
+        self.rapid_speed = rapid_speed
+        self.mode_change_time = mode_change_time
+        self.status_latency = status_latency
+        self.write_latency = write_latency
+        self.error_rate = error_rate
+
+        self.packets_accepted = 0
+        self.packets_rejected = 0
+        self.steps = 0
+        self.motion_time = 0.0
+
+        self._starts = deque()  # Start times of buffered packets not yet executing.
+        self._busy_until = 0.0
+        self._pending = None
+        self._error = False
+        self._finish = False
+        self._moved = False
+
+        self._mode = MODE_RAPID
+        self._speed = rapid_speed
+        self._raster_step = 0
+        self._speed_code = None
+        self._command = None
+        self._distance = 0
+        self._number = 0
+        self._digits = 0
+        self._bar = False
+        self._packet_time = 0.0
+
+    def write(self, frame):
+        """
+        Receives a USB frame of b'\\x00' + 30 byte packet + crc.
+        """
+        if self.write_latency:
+            time.sleep(self.write_latency)
+        now = time.perf_counter()
+        self._advance(now)
+        self._finish = False
+        packet = frame[1:31]
+        if len(frame) != 32 or onewire_crc_lookup(packet) != frame[31] or \
+                (self.error_rate and random() < self.error_rate):
+            self.packets_rejected += 1
+            self._error = True
+            return
+        self._error = False
+        if len(self._starts) >= self.buffer_size:
+            self._pending = packet
+        else:
+            self._accept(packet, now)
+
+    def status(self):
+        if self.status_latency:
+            time.sleep(self.status_latency)
+        self._advance(time.perf_counter())
+        if self._error:
+            return STATUS_ERROR
+        if self._pending is not None:
+            return STATUS_BUSY
+        if self._finish:
+            return STATUS_FINISH  # Reported until the next packet arrives.
+        return STATUS_OK
+
+    def is_running(self):
+        self._advance(time.perf_counter())
+        return self._pending is not None or time.perf_counter() < self._busy_until
+
+    def _advance(self, now):
+        starts = self._starts
+        freed = now
+        while len(starts) and starts[0] <= now:
+            freed = starts.popleft()
+        if self._pending is not None and len(starts) < self.buffer_size:
+            # The held packet entered the buffer when the board made room for it.
+            packet = self._pending
+            self._pending = None
+            self._accept(packet, freed)
+        if self._moved and now >= self._busy_until and self._pending is None:
+            self._moved = False
+            self._finish = True
+
+    def _accept(self, packet, now):
+        self.packets_accepted += 1
+        duration = self.parse(packet)
+        start = max(now, self._busy_until)
+        self._busy_until = start + duration
+        self._starts.append(start)
+        self._moved = True
+        self._finish = False
+
+    def parse(self, packet):
+        """
+        Parses the LHYMICRO-GL packet, continuing the state of previous packets.
+
+        :return: motion time of the packet in seconds.
+        """
+        self._packet_time = 0.0
+        for value in packet:
+            if ord('0') <= value <= ord('9'):
+                if self._speed_code is not None:
+                    self._speed_code += chr(value)
+                    continue
+                self._number = self._number * 10 + value - ord('0')
+                self._digits += 1
+                if self._digits == 3:
+                    self._distance += self._number
+                    self._number = 0
+                    self._digits = 0
+            elif ord('a') <= value <= ord('y'):
+                self._distance += value - ord('a') + 1
+                if self._bar:
+                    self._distance += 25  # '|' prefix, '|a' is 26.
+                    self._bar = False
+            elif value == ord('z'):
+                if self._bar:
+                    self._distance += 51  # '|z' is 51.
+                    self._bar = False
+                else:
+                    self._distance += 255
+            elif value == ord('|'):
+                self._bar = True
+            else:
+                self._command_end()
+                number = self._number
+                self._number = 0
+                self._digits = 0
+                self._bar = False
+                self._command_start(chr(value), number)
+        self._command_end()
+        duration = self._packet_time
+        self.motion_time += duration
+        return duration
+
+    def _command_start(self, command, number=0):
+        if self._speed_code is not None:
+            if command in 'CVG':
+                self._speed_code += command
+                return
+            if command == 'N':
+                try:
+                    laser_speed = LaserSpeed(self.board, self._speed_code)
+                    self._speed = laser_speed.speed
+                    self._raster_step = laser_speed.raster_step
+                except (ValueError, IndexError):
+                    pass
+            self._speed_code = None
+        if command in 'CV' and self._mode != MODE_PROGRAM:
+            self._speed_code = command
+            return
+        if command == 'E' and self._command == 'S' and number == 1:
+            # S1E, enters the program mode at the current speed.
+            self._mode = MODE_PROGRAM
+            self._packet_time += self.mode_change_time
+        elif self._mode == MODE_PROGRAM and (command == '@' or (command == 'N' and self._command == 'F')):
+            # @NSE or FNSE leave the program mode. A lone F is packet padding.
+            self._mode = MODE_RAPID
+            self._packet_time += self.mode_change_time
+        elif command == 'I':
+            self._mode = MODE_RAPID
+        self._command = command
+
+    def _command_end(self):
+        distance = self._distance
+        if distance == 0 or self._command not in ('B', 'T', 'L', 'R', 'M'):
+            self._distance = 0
+            return
+        self._distance = 0
+        self.steps += distance
+        speed = self._speed if self._mode == MODE_PROGRAM else self.rapid_speed
+        if speed <= 0:
+            speed = self.rapid_speed
+        self._packet_time += distance / (speed * STEPS_PER_MM)
+
+
+class CH341Driver:
+    """
+    Driver for the simulated board, with the API of the CH341 drivers.
+    """
+
+    def __init__(self, index=-1, bus=-1, address=-1, serial=-1, chipv=-1, state_listener=None, board=None):
+        if state_listener is None:
+            self.state_listener = lambda code: None
+        else:
+            self.state_listener = state_listener
+        self.index = index
+        self.bus = bus
+        self.address = address
+        self.serial = serial
+        self.chipv = chipv
+        if board is None:
+            board = LhystudioBoard()
+        elif isinstance(board, str):
+            board = LhystudioBoard(board=board)
+        self.board = board
+        self.is_open = False
+        self.state = None
+
+    def set_status(self, code):
+        self.state_listener(code)
+        self.state = code
+
+    def open(self):
+        if self.is_open:
+            return
+        self.set_status(STATE_DRIVER_MOCK)
+        self.set_status(STATE_USB_CONNECTED)
+        self.set_status(STATE_CONNECTED)
+        self.is_open = True
+
+    def reconnect(self):
+        self.is_open = False
+        self.open()
+
+    def close(self):
+        self.is_open = False
+        self.set_status(STATE_USB_DISCONNECTED)
+
+    def write(self, packet):
+        if not self.is_open:
+            raise ConnectionError
+        self.board.write(packet)
+
+    def write_status(self, packet):
+        self.write(packet)
+        return self.get_status()
+
+    def get_status(self):
+        if not self.is_open:
+            raise ConnectionError
+        return [255, self.board.status(), 0, 0, 0, 1]
+
+    def get_chip_version(self):
+        return 48
@@ -83,6 +83,31 @@ class CH341Driver:
             # self.driver.CH341SetExclusive(self.driver_index, 1)
             self.set_status(STATE_CONNECTED)
 
+    def reconnect(self):
+        """
+        Fast reconnect after a connection error. The device at the matched index is reopened and put back into
+        EPP 1.9 mode, without trying the other indexes.
+
+        Raises ConnectionRefusedError if the device must be closed and opened again.
+        """
+        if self.driver_value is None:
+            raise ConnectionRefusedError
+        self.driver.CH341CloseDevice(self.driver_index)
+        self.set_status(STATE_CONNECTING)
+        if self.driver.CH341OpenDevice(self.driver_index) == -1:
+            self.driver_value = None
+            self.set_status(STATE_CONNECTION_FAILED)
+            raise ConnectionRefusedError
+        self.set_status(STATE_USB_CONNECTED)
+        self.set_status(STATE_CH341_PARAMODE)
+        try:
+            self.driver.CH341InitParallel(self.driver_index, 1)  # 0x40, 177, 0x8800, 0, 0
+            self.set_status(STATE_CH341_PARAMODE_SUCCESS)
+        except ConnectionError:
+            self.set_status(STATE_CH341_PARAMODE_FAIL)
+            raise ConnectionRefusedError
+        self.set_status(STATE_CONNECTED)
+
     def close(self):
         """
         Closes the driver for the stated device index.
@@ -0,0 +1,162 @@
+from collections import deque
+from itertools import islice
+
+"""
+ChunkedBuffer is a byte queue for the controller pipes.
+
+The bytes are stored as a deque of chunks with an offset into the head chunk. Appending data coalesces small writes
+into the tail chunk and consuming data only advances the head offset or drops spent chunks, so neither operation
+depends on how many bytes are queued. Peeking returns a copy of only the requested head bytes.
+"""
+
+CHUNK_SIZE = 4096
+
+
+class ChunkedBuffer:
+    """
+    FIFO byte buffer with O(1) append, consume and bounded-size peek at the head.
+    """
+
+    def __init__(self, data=None, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self._chunks = deque()
+        self._offset = 0  # Position of the first unconsumed byte within the head chunk.
+        self._length = 0
+        if data:
+            self.append(data)
+
+    def __len__(self):
+        return self._length
+
+    def __bytes__(self):
+        if self._length == 0:
+            return b''
+        data = b''.join(self._chunks)
+        return data[self._offset:]
+
+    def __repr__(self):
+        return "ChunkedBuffer(%d bytes, %d chunks)" % (self._length, len(self._chunks))
+
+    def __iadd__(self, other):
+        if isinstance(other, ChunkedBuffer):
+            self.extend(other)
+        else:
+            self.append(other)
+        return self
+
+    def decode(self, *args):
+        return bytes(self).decode(*args)
+
+    def append(self, data):
+        """
+        Appends data to the end of the buffer.
+
+        Small writes are coalesced into the tail chunk, larger writes are kept as their own chunk.
+
+        :param data: bytes-like data to add.
+        """
+        size = len(data)
+        if size == 0:
+            return
+        chunks = self._chunks
+        if len(chunks):
+            tail = chunks[-1]
+            if isinstance(tail, bytearray) and len(tail) + size <= self.chunk_size:
+                tail += data
+                self._length += size
+                return
+        if size < self.chunk_size:
+            chunks.append(bytearray(data))
+        else:
+            chunks.append(bytes(data))
+        self._length += size
+
+    def prepend(self, data):
+        """
+        Places data at the start of the buffer, ahead of everything currently queued.
+
+        :param data: bytes-like data to add.
+        """
+        size = len(data)
+        if size == 0:
+            return
+        chunks = self._chunks
+        if self._offset != 0:
+            chunks[0] = chunks[0][self._offset:]
+            self._offset = 0
+        chunks.appendleft(bytes(data))
+        self._length += size
+
+    def extend(self, other):
+        """
+        Moves all the data out of another ChunkedBuffer onto the end of this buffer, leaving the other empty.
+
+        The chunks themselves are transferred so no byte data is copied.
+
+        :param other: ChunkedBuffer to drain.
+        """
+        if len(other) == 0:
+            return
+        chunks = other._chunks
+        if other._offset != 0:
+            chunks[0] = chunks[0][other._offset:]
+        self._chunks.extend(chunks)
+        self._length += other._length
+        other.clear()
+
+    def peek(self, length):
+        """
+        Returns up to length bytes from the head of the buffer without consuming them.
+
+        :param length: maximum number of bytes to return.
+        :return: bytes
+        """
+        if length <= 0 or self._length == 0:
+            return b''
+        chunks = self._chunks
+        offset = self._offset
+        head = chunks[0]
+        end = offset + length
+        if end <= len(head):
+            return bytes(head[offset:end])
+        parts = [head[offset:]]
+        remaining = length - (len(head) - offset)
+        for chunk in islice(chunks, 1, None):
+            if remaining <= 0:
+                break
+            parts.append(chunk[:remaining])
+            remaining -= len(chunk)
+        return b''.join(parts)
+
+    def consume(self, length):
+        """
+        Removes up to length bytes from the head of the buffer.
+
+        :param length: number of bytes to remove.
+        """
+        chunks = self._chunks
+        length = min(length, self._length)
+        self._length -= length
+        offset = self._offset + length
+        while len(chunks):
+            head_length = len(chunks[0])
+            if offset < head_length:
+                break
+            offset -= head_length
+            chunks.popleft()
+        self._offset = offset if len(chunks) else 0
+
+    def find(self, sub, start=0, end=None):
+        """
+        Finds sub within the head bytes of the buffer, as bytes.find does.
+
+        Only the bytes up to end are examined so end should be kept small.
+        """
+        if end is None:
+            end = self._length
+        return self.peek(end).find(sub, start, end)
+
+    def clear(self):
+        self._chunks = deque()
+        self._offset = 0
+        self._length = 0
@@ -0,0 +1,75 @@
+from array import array
+
+"""
+CommandBuffer is a compact sequence of spooled commands.
+
+Generators yield each command as a tuple, which is allocated and unpacked again for every command. A CommandBuffer
+stores the commands in flat arrays instead: numeric arguments are kept in typed arrays and only commands carrying
+objects, such as the path of a COMMAND_PLOT, keep their values as a tuple. A generator may fill a buffer in bulk and
+yield the whole buffer, the interpreter then performs the buffered commands in order as if they had been yielded one
+by one.
+"""
+
+KIND_FLOAT = 0  # Arguments are floats, stored in floats.
+KIND_INT = 1  # Arguments are ints, stored in ints.
+KIND_OBJECT = 2  # Arguments are stored as a tuple in objects.
+
+ENTRY_SIZE = 4  # command, kind, offset, count
+
+
+class CommandBuffer:
+    """
+    Array backed sequence of commands with their values.
+
+    Each entry is the command, the kind of its arguments, their offset within the storage of that kind and their count.
+    """
+
+    def __init__(self):
+        self.entries = array('i')
+        self.floats = array('d')
+        self.ints = array('q')
+        self.objects = []
+
+    def __len__(self):
+        return len(self.entries) // ENTRY_SIZE
+
+    def __iter__(self):
+        for index in range(len(self)):
+            command, values = self.get(index)
+            yield (command,) + tuple(values)
+
+    def __repr__(self):
+        return "CommandBuffer(%d commands)" % len(self)
+
+    def append(self, command, *values):
+        types = set(type(v) for v in values)
+        if len(types) == 1 and float in types:
+            storage, kind = self.floats, KIND_FLOAT
+        elif len(types) == 1 and int in types:
+            storage, kind = self.ints, KIND_INT
+        elif len(values) == 0:
+            storage, kind = self.ints, KIND_INT
+        else:
+            self.entries.extend((command, KIND_OBJECT, len(self.objects), len(values)))
+            self.objects.append(values)
+            return
+        self.entries.extend((command, kind, len(storage), len(values)))
+        storage.extend(values)
+
+    def get(self, index):
+        """
+        :return: command, values of the command at the given index.
+        """
+        position = index * ENTRY_SIZE
+        command, kind, offset, count = self.entries[position:position + ENTRY_SIZE]
+        if kind == KIND_OBJECT:
+            return command, self.objects[offset]
+        if kind == KIND_FLOAT:
+            return command, self.floats[offset:offset + count]
+        return command, self.ints[offset:offset + count]
+
+    def clear(self):
+        del self.entries[:]
+        del self.floats[:]
+        del self.ints[:]
+        del self.objects[:]
@@ -0,0 +1,130 @@
+import json
+import os
+from collections import OrderedDict
+from threading import Lock
+
+"""
+CompileCache keeps compiled job code on disk, keyed by a hash of everything the code depends upon.
+
+A repeated job finds its code in the cache and is streamed without being compiled again. The cache is limited in size,
+the least recently used entries are evicted first.
+"""
+
+SUFFIX = '.lhy'
+
+
+def default_cache_directory():
+    return os.path.join(os.path.expanduser('~'), '.meerk40t', 'cache')
+
+
+class CompileCache:
+    """
+    Disk backed least recently used cache of compiled code.
+
+    Each entry is a file named by its key, holding a line of json metadata followed by the code. The file times record
+    the use of the entries, so the order is kept between sessions.
+    """
+
+    def __init__(self, directory=None, max_size=256 * 1024 * 1024):
+        if directory is None or len(directory) == 0:
+            directory = default_cache_directory()
+        self.directory = directory
+        self.max_size = max_size
+        self.lock = Lock()
+        self.entries = OrderedDict()  # key: size, least recently used first.
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        try:
+            os.makedirs(directory, exist_ok=True)
+            files = [f for f in os.scandir(directory) if f.name.endswith(SUFFIX) and f.is_file()]
+        except OSError:
+            files = []
+        for f in sorted(files, key=lambda f: f.stat().st_mtime):
+            size = f.stat().st_size
+            self.entries[f.name[:-len(SUFFIX)]] = size
+            self.size += size
+
+    def __len__(self):
+        return len(self.entries)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def get(self, key):
+        """
+        :return: code, metadata of the entry or None if the key is not cached.
+        """
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            path = self.path(key)
+            try:
+                with open(path, 'rb') as f:
+                    metadata = json.loads(f.readline().decode('utf8'))
+                    data = f.read()
+                os.utime(path)
+            except (OSError, ValueError):
+                self._remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return data, metadata
+
+    def put(self, key, data, metadata):
+        """
+        Stores the code and its metadata, evicting the least recently used entries beyond the size limit.
+        """
+        header = (json.dumps(metadata) + '\n').encode('utf8')
+        size = len(header) + len(data)
+        if size > self.max_size:
+            return
+        with self.lock:
+            path = self.path(key)
+            try:
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(header)
+                    f.write(data)
+                os.replace(path + '.tmp', path)
+            except OSError:
+                return
+            if key in self.entries:
+                self.size -= self.entries[key]
+            self.entries[key] = size
+            self.entries.move_to_end(key)
+            self.size += size
+            self.stores += 1
+            while self.size > self.max_size and len(self.entries) > 1:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        self.size -= self.entries.pop(key, 0)
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.entries):
+                self._remove(key)
+            self.hits = 0
+            self.misses = 0
+            self.stores = 0
+            self.evictions = 0
+
+    def report(self):
+        """
+        :return: lines describing the cache.
+        """
+        lookups = self.hits + self.misses
+        yield 'Compile cache: %s' % self.directory
+        yield 'Entries: %d, %.1f of %.1f MB' % (len(self.entries), self.size / 1048576.0, self.max_size / 1048576.0)
+        yield 'Hits: %d, Misses: %d (%.0f%% hit rate)' % \
+              (self.hits, self.misses, 100.0 * self.hits / lookups if lookups else 0.0)
+        yield 'Stores: %d, Evictions: %d' % (self.stores, self.evictions)
@@ -175,6 +175,9 @@ class Console(Module, Pipe):
             yield 'trace_hull'
             yield 'trace_quick'
             yield 'pulse <time_ms>'
+            yield 'metrics [reset]'
+            yield 'compilecache [clear]'
+            yield 'slices [reset]'
             yield '-------------------'
             yield 'ruidaserver'
             yield 'grblserver'
@@ -1951,6 +1954,49 @@ class Console(Module, Pipe):
                 if active_device.device_name != 'Lhystudios':
                     yield 'Device cannot send egv data.'
                 active_device.interpreter.pipe.write(bytes(args[0].replace('$', '\n'), "utf8"))
+        elif command == 'metrics':
+            try:
+                metrics = active_device.interpreter.pipe.metrics
+            except AttributeError:
+                yield 'Device has no controller metrics.'
+                return
+            if len(args) >= 1 and args[0] == 'reset':
+                metrics.reset()
+                yield 'Controller metrics reset.'
+                return
+            for line in metrics.report():
+                yield line
+            timing = getattr(active_device.interpreter.pipe.driver, 'timing', None)
+            if timing is not None:
+                for name in sorted(timing):
+                    yield 'USB %s: %s' % (name, str(timing[name]))
+        elif command == 'compilecache':
+            try:
+                cache = active_device.interpreter.open_compile_cache()
+            except AttributeError:
+                yield 'Device cannot precompile jobs.'
+                return
+            if cache is None:
+                yield 'Compile cache is disabled.'
+                return
+            if len(args) >= 1 and args[0] == 'clear':
+                cache.clear()
+                yield 'Compile cache cleared.'
+                return
+            for line in cache.report():
+                yield line
+        elif command == 'slices':
+            try:
+                slice_metrics = active_device.interpreter.slice_metrics
+            except AttributeError:
+                yield 'Device has no interpreter slice metrics.'
+                return
+            if len(args) >= 1 and args[0] == 'reset':
+                slice_metrics.reset()
+                yield 'Interpreter slice metrics reset.'
+                return
+            for line in slice_metrics.report(active_device.slice_time / 1000.0):
+                yield line
         elif command == "grblserver":
             port = 23
             tcp = True
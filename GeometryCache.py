@@ -0,0 +1,135 @@
+import weakref
+from collections import OrderedDict
+from threading import RLock
+
+from svgelements import Path
+
+"""
+GeometryCache keeps the transformed geometry of elements between runs of LaserOperation.generate().
+
+Cutting or engraving an element reifies its transform into a copy of the element and copies each subpath again to be
+plotted between jogs. For a large element that is the bulk of the work of spooling it, and it repeats each time the
+element is sent. The cache keeps the result per element, keyed on the element's transform and its geometry version.
+The Elemental bumps the version when the element is altered and discards its entry when it is modified or altered.
+
+The cache is bounded by the total segments it holds, least recently used elements are evicted first. Elements are
+referenced weakly, so an entry never keeps a deleted element alive. The cached paths are shared by every run and must
+not be changed.
+"""
+
+MAX_SEGMENTS = 500000
+
+
+class GeometryCache:
+    """
+    Least recently used cache of the reified geometry of elements, by element.
+
+    Each entry is a weak reference to the element, the key it was made for, the reified plot, its subpaths once asked
+    for and the segments held.
+    """
+
+    def __init__(self, max_segments=MAX_SEGMENTS):
+        self.max_segments = max_segments
+        self.segments = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(element):
+        matrix = element.transform
+        return matrix.a, matrix.b, matrix.c, matrix.d, matrix.e, matrix.f, getattr(element, 'geometry_version', 0)
+
+    def _entry(self, element):
+        key = self.key(element)
+        with self._lock:
+            entry = self._entries.get(id(element))
+            if entry is not None and entry[0]() is element and entry[1] == key:
+                self._entries.move_to_end(id(element))
+                self.hits += 1
+                return entry
+        plot = abs(element)
+        entry = [weakref.ref(element, self._collected(id(element))), key, plot, None, self.size(plot)]
+        with self._lock:
+            self.misses += 1
+            self._discard(id(element))
+            self._entries[id(element)] = entry
+            self.segments += entry[4]
+            self._evict()
+        return entry
+
+    def plot(self, element):
+        """
+        :return: the element with its transform reified.
+        """
+        return self._entry(element)[2]
+
+    def subpaths(self, element):
+        """
+        :return: list of the subpaths of the reified element, each as a Path with its start unset.
+        """
+        entry = self._entry(element)
+        subpaths = entry[3]
+        if subpaths is not None:
+            return subpaths
+        subpaths = self.split(entry[2])
+        with self._lock:
+            if self._entries.get(id(element)) is entry:
+                entry[3] = subpaths
+                size = self.size(entry[2]) + sum(len(p) for p in subpaths)
+                self.segments += size - entry[4]
+                entry[4] = size
+                self._evict()
+        return subpaths
+
+    def discard(self, element):
+        with self._lock:
+            self._discard(id(element))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.segments = 0
+
+    @staticmethod
+    def split(plot):
+        """
+        :return: list of the subpaths of the plot, each as a Path with its start unset.
+        """
+        subpaths = []
+        for subplot in plot.as_subpaths():
+            p = Path(subplot)
+            try:
+                p[0].start = None
+            except IndexError:
+                continue
+            subpaths.append(p)
+        return subpaths
+
+    @staticmethod
+    def size(plot):
+        try:
+            return len(plot)
+        except TypeError:
+            return 1
+
+    def _collected(self, element_id):
+        def collected(ref):
+            with self._lock:
+                entry = self._entries.get(element_id)
+                if entry is not None and entry[0] is ref:
+                    self._discard(element_id)
+        return collected
+
+    def _discard(self, element_id):
+        entry = self._entries.pop(element_id, None)
+        if entry is not None:
+            self.segments -= entry[4]
+
+    def _evict(self):
+        while self.segments > self.max_segments and len(self._entries):
+            self._discard(next(iter(self._entries)))
@@ -1,3 +1,5 @@
+import threading
+
 import wx
 
 from Kernel import Module
@@ -59,6 +61,8 @@ class JobInfo(wx.Frame, Module):
         # self.Bind(wx.EVT_MENU, self.on_check_jog2, id=self.menu_jog2.GetId())
         self.menu_jog3 = wxglade_tmp_menu.Append(wx.ID_ANY, _("Jog Finish"), "", wx.ITEM_RADIO)
         self.Bind(wx.EVT_MENU, self.on_check_jog3, id=self.menu_jog3.GetId())
+        self.menu_jog_auto = wxglade_tmp_menu.Append(wx.ID_ANY, _("Jog Auto"), "", wx.ITEM_RADIO)
+        self.Bind(wx.EVT_MENU, self.on_check_jog_auto, id=self.menu_jog_auto.GetId())
         self.JobInfo_menubar.Append(wxglade_tmp_menu, _("Settings"))
 
         self.SetMenuBar(self.JobInfo_menubar)
@@ -82,6 +86,9 @@ class JobInfo(wx.Frame, Module):
         if not isinstance(ops, list):
             ops = [ops]
         self.operations = ops
+        self.estimate_thread = None  # Thread estimating the automatic rasters, off the gui thread.
+        self.needs_estimate = False
+        self.estimate_lock = threading.Lock()
 
     def jobadd_home(self, event=None):
         self.operations.append(OperationPreprocessor.home)
@@ -135,6 +142,7 @@ class JobInfo(wx.Frame, Module):
         self.device.setting(bool, "autostart", True)
         self.device.setting(bool, "opt_rapid_between", True)
         self.device.setting(int, "opt_jog_mode", 0)
+        self.device.setting(float, "jog_rapid_speed", 150.0)
         self.device.listen('element_property_update', self.on_element_property_update)
 
         self.menu_prehome.Check(self.device.prehome)
@@ -145,11 +153,14 @@ class JobInfo(wx.Frame, Module):
         self.menu_jog.Check(False)
         # self.menu_jog2.Check(False)
         self.menu_jog3.Check(False)
+        self.menu_jog_auto.Check(False)
         if jog_mode == 0:
             self.menu_jog.Check(True)
         elif jog_mode == 1:
             # self.menu_jog2.Check(True)
             pass
+        elif jog_mode == 3:
+            self.menu_jog_auto.Check(True)
         else:
             self.menu_jog3.Check(True)
         self.menu_rapid.Check(self.device.opt_rapid_between)
@@ -239,6 +250,10 @@ class JobInfo(wx.Frame, Module):
         if self.menu_jog3.IsChecked():
             self.device.opt_jog_mode = 2
 
+    def on_check_jog_auto(self, event):
+        if self.menu_jog_auto.IsChecked():
+            self.device.opt_jog_mode = 3
+
     def on_check_home_before(self, event):  # wxGlade: JobInfo.<event_handler>
         self.device.prehome = self.menu_prehome.IsChecked()
 
@@ -287,12 +302,53 @@ class JobInfo(wx.Frame, Module):
     def on_element_property_update(self, *args):
         self.update_gui()
 
+    def estimate_rasters(self):
+        """
+        Estimates the automatic rasters of the operations in the estimate thread. The estimates are kept on the
+        images, the list shows them once it is updated.
+        """
+        try:
+            while self.needs_estimate:
+                self.needs_estimate = False
+                for e in list(self.operations):
+                    if self.is_auto_raster(e):
+                        e.raster_estimates(self.device.jog_rapid_speed)
+        finally:
+            with self.estimate_lock:
+                self.estimate_thread = None
+        wx.CallAfter(self.update_estimates)
+
+    def update_estimates(self):
+        try:
+            self.update_gui()
+        except RuntimeError:
+            pass  # The window is closed.
+
+    def is_auto_raster(self, e):
+        """
+        :return: whether the operation is estimated in the list, a raster of automatic direction with its images
+        actualized.
+        """
+        return isinstance(e, LaserOperation) and e.operation in ("Raster", "Image") and e.raster_direction == 5 \
+            and len(self.preprocessor.commands) == 0
+
     def update_gui(self):
         def name_str(e):
             try:
                 return e.__name__
             except AttributeError:
-                return str(e)
+                pass
+            if self.is_auto_raster(e):
+                # Estimates of the automatic raster direction, as far as the estimate thread has made them.
+                estimate = e.raster_estimate(self.device.jog_rapid_speed, compute=False)
+                if estimate is None:
+                    with self.estimate_lock:
+                        self.needs_estimate = True
+                        if self.estimate_thread is None:
+                            self.estimate_thread = self.device.threaded(self.estimate_rasters)
+                    estimate = _("Estimating...")
+                return "%s (%s)" % (str(e), estimate)
+            return str(e)
 
         self.commands_listbox.Clear()
         self.operations_listbox.Clear()
@@ -146,7 +146,7 @@ class JobSpooler(wx.Frame, Module):
                     except AttributeError:
                         pass
                     try:
-                        settings.append(_("overscan=%d") % (e.overscan))
+                        settings.append(_("overscan=%s") % (e.overscan))
                     except AttributeError:
                         pass
                     self.list_job_spool.SetItem(m, 6, " ".join(settings))
@@ -1,7 +1,9 @@
 import os
 import time
-from threading import Thread, Lock
+from threading import Thread, Lock, Condition, Event, current_thread
 
+from CommandBuffer import CommandBuffer
+from GeometryCache import MAX_SEGMENTS
 from LaserOperation import *
 
 STATE_UNKNOWN = -1
@@ -14,6 +16,8 @@ STATE_END = 5
 STATE_WAIT = 7 # Controller is waiting for something. This could be aborted.
 STATE_TERMINATE = 10
 
+FEEDER_IDLE_WAIT = 1.0  # Longest block of an idle interpreter feeder thread on the spooler, in seconds.
+
 INTERPRETER_STATE_RAPID = 0
 INTERPRETER_STATE_FINISH = 1
 INTERPRETER_STATE_PROGRAM = 2
@@ -128,11 +132,12 @@ class Spooler(Module):
     * job_if_idle(job) -- Will enqueue the job if the device is currently idle.
     * clear_queue()
     * remove(job)
+    * wait(timeout) -- Blocks until there is a job.
     """
 
     def __init__(self):
         Module.__init__(self)
-        self.queue_lock = Lock()
+        self.queue_lock = Condition()
         self._queue = []
 
     def __repr__(self):
@@ -174,6 +179,7 @@ class Spooler(Module):
             self._queue.extend(job)
         else:
             self._queue.append(job)
+        self.queue_lock.notify_all()
         self.queue_lock.release()
         self.device.signal('spooler;queue', len(self._queue))
 
@@ -190,6 +196,7 @@ class Spooler(Module):
             self._queue.extend(jobs)
         else:
             self._queue.append(jobs)
+        self.queue_lock.notify_all()
         self.queue_lock.release()
         self.device.signal('spooler;queue', len(self._queue))
 
@@ -212,6 +219,22 @@ class Spooler(Module):
         self.queue_lock.release()
         self.device.signal('spooler;queue', len(self._queue))
 
+    def wait(self, timeout=None):
+        """
+        Blocks until the queue holds a job, the timeout passes or wake() is called.
+
+        :return: the head of the queue, or None if the queue is still empty.
+        """
+        with self.queue_lock:
+            if len(self._queue) == 0:
+                self.queue_lock.wait(timeout)
+            return self.peek()
+
+    def wake(self):
+        """Releases any threads waiting on the spooler."""
+        with self.queue_lock:
+            self.queue_lock.notify_all()
+
 
 class Interpreter(Module):
     """
@@ -229,10 +252,17 @@ class Interpreter(Module):
         Module.__init__(self)
         self.process_item = None
         self.spooled_item = None
-        self.process = self.process_spool
+        self.process = self.run_scheduled
         self.interval = 0.01
         self.pipe = pipe
         self.extra_hold = None
+        self.dispatch_table = self.command_table()
+        self.command_buffer = None  # CommandBuffer being performed, and the index of its next command.
+        self.command_index = 0
+        self.feeder = None  # Feeder thread, when the interpreter runs in its own thread.
+        self.feeder_event = Event()
+        self.feeder_stop = False
+        self.wait_end = None  # Time until which a COMMAND_WAIT holds the interpreter.
 
         self.state = INTERPRETER_STATE_RAPID
         self.pulse_total = 0.0
@@ -256,8 +286,105 @@ class Interpreter(Module):
         self.device.setting(bool, "opt_rapid_between", True)
         self.device.setting(int, "opt_jog_mode", 0)
         self.device.setting(int, "opt_jog_minimum", 127)
+        self.device.setting(float, "jog_rapid_speed", 150.0)
+        self.device.setting(bool, "interpreter_thread", False)
         self.schedule()
 
+    def detach(self, device, channel=None):
+        self.stop()
+        Module.detach(self, device, channel=channel)
+
+    def run_scheduled(self, *args):
+        """
+        Scheduled process of the interpreter. With the interpreter_thread setting the interpreter moves to a feeder
+        thread of its own instead.
+        """
+        if self.device.interpreter_thread:
+            self.start_feeder()
+            return
+        self.process_spool(*args)
+
+    def start_feeder(self):
+        """
+        Runs the interpreter in a dedicated feeder thread. The thread blocks on the spooler while there is nothing to
+        interpret and on the pipe while the interpreter holds, so scheduled jobs of the device do not add latency.
+        """
+        if self.feeder is not None:
+            return
+        self.unschedule()
+        self.feeder_stop = False
+        self.feeder = self.device.threaded(self._thread_feeder, 'Interpreter')
+
+    def stop(self, *args):
+        """Stops the feeder thread, if running."""
+        feeder = self.feeder
+        self.feeder_stop = True
+        self.feeder_event.set()
+        try:
+            self.device.spooler.wake()
+        except AttributeError:
+            pass
+        if feeder is not None and feeder is not current_thread():
+            feeder.join(5.0)
+
+    def wake(self):
+        """
+        Runs the interpreter as soon as possible, rather than at its next scheduled time. A COMMAND_WAIT being waited
+        is not cut short, the interpreter runs once it has passed.
+        """
+        if self.waiting():
+            return
+        if self.feeder is not None:
+            self.feeder_event.set()
+        else:
+            self.next_run = 0
+
+    def waiting(self):
+        """
+        :return: seconds left of the COMMAND_WAIT being waited, 0 if none.
+        """
+        wait_end = self.wait_end
+        if wait_end is None:
+            return 0
+        remaining = wait_end - time.time()
+        if remaining <= 0:
+            self.wait_end = None
+            return 0
+        return remaining
+
+    def feeder_idle(self):
+        """
+        :return: whether there is nothing to interpret until a job is spooled.
+        """
+        return self.spooled_item is None and self.device.spooler.peek() is None
+
+    def feeder_held(self):
+        """
+        :return: whether the interpreter is waiting for something other than the spooler.
+        """
+        return self.hold()
+
+    def _thread_feeder(self):
+        spooler = self.device.spooler
+        while not self.feeder_stop and self.device.interpreter_thread:
+            self.feeder_event.clear()
+            remaining = self.waiting()
+            if remaining:
+                self.feeder_event.wait(remaining)  # Waiting, as requested by a COMMAND_WAIT, until it has passed.
+                continue
+            self.next_run = 0
+            self.process_spool()
+            if self.waiting():
+                continue
+            elif self.feeder_idle():
+                spooler.wait(FEEDER_IDLE_WAIT)
+            elif self.feeder_held():
+                self.feeder_event.wait(self.interval)
+        self.feeder = None
+        if not self.feeder_stop:
+            self.next_run = time.time() + self.interval
+            self.schedule()  # Setting was turned off, back to the device scheduler.
+
     def process_spool(self, *args):
         """
         Get next spooled element if needed.
@@ -287,14 +414,28 @@ class Interpreter(Module):
             self.command(self.spooled_item[0], *self.spooled_item[1:])
             self.spooled_item = None
             return
-        try:
-            e = next(self.spooled_item)
-            if isinstance(e, int):
-                self.command(e)
-            else:
-                self.command(e[0], *e[1:])
-        except StopIteration:
-            self.spooled_item = None
+        buffer = self.command_buffer
+        if buffer is None:
+            try:
+                e = next(self.spooled_item)
+                if isinstance(e, int):
+                    self.command(e)
+                    return
+                if not isinstance(e, CommandBuffer):
+                    self.command(e[0], *e[1:])
+                    return
+            except StopIteration:
+                self.spooled_item = None
+                return
+            if len(e) == 0:
+                return
+            buffer = self.command_buffer = e
+            self.command_index = 0
+        index = self.command_index
+        self.command_index = index + 1
+        if self.command_index >= len(buffer):
+            self.command_buffer = None
+        self.dispatch(*buffer.get(index))
 
     def fetch_next_item(self):
         element = self.device.spooler.peek()
@@ -310,7 +451,8 @@ class Interpreter(Module):
             try:
                 self.spooled_item = element.generate(
                     rapid=self.device.opt_rapid_between,
-                    jog=self.device.opt_jog_mode)
+                    jog=self.device.opt_jog_mode,
+                    rapid_speed=self.device.jog_rapid_speed)
             except AttributeError:
                 try:
                     self.spooled_item = element()
@@ -318,102 +460,96 @@ class Interpreter(Module):
                     # This could be a text element, some unrecognized type.
                     return
 
+    @classmethod
+    def command_table(cls):
+        """
+        :return: the dispatch table of the interpreter class, built once for each subclass.
+        """
+        table = cls.__dict__.get('_command_table')
+        if table is None:
+            table = cls.build_command_table()
+            cls._command_table = table
+        return table
+
+    @classmethod
+    def build_command_table(cls):
+        """
+        Builds the dispatch table of spooled commands. Each command maps to a function taking the interpreter and the
+        values of the command. Subclasses may extend or replace the entries.
+        """
+        return {
+            COMMAND_LASER_OFF: lambda s, v: s.laser_off(),
+            COMMAND_LASER_ON: lambda s, v: s.laser_on(),
+            COMMAND_LASER_DISABLE: lambda s, v: s.laser_disable(),
+            COMMAND_LASER_ENABLE: lambda s, v: s.laser_enable(),
+            COMMAND_CUT: lambda s, v: s.cut(*v),
+            COMMAND_MOVE: lambda s, v: s.move(*v),
+            COMMAND_JOG: lambda s, v: s.jog(*v, mode=0, min_jog=s.device.opt_jog_minimum),
+            COMMAND_JOG_SWITCH: lambda s, v: s.jog(*v, mode=1, min_jog=s.device.opt_jog_minimum),
+            COMMAND_JOG_FINISH: lambda s, v: s.jog(*v, mode=2, min_jog=s.device.opt_jog_minimum),
+            COMMAND_JOG_AUTO: lambda s, v: s.jog(*v, mode=3, min_jog=s.device.opt_jog_minimum),
+            COMMAND_HOME: lambda s, v: s.home(),
+            COMMAND_LOCK: lambda s, v: s.lock_rail(),
+            COMMAND_UNLOCK: lambda s, v: s.unlock_rail(),
+            COMMAND_PLOT: lambda s, v: s.plot_path(v[0]),
+            COMMAND_RASTER: lambda s, v: s.plot_raster(v[0]),
+            COMMAND_SET_SPEED: lambda s, v: s.set_speed(v[0]),
+            COMMAND_SET_POWER: lambda s, v: s.set_power(v[0]),
+            COMMAND_SET_PWM: lambda s, v: s.set_pwm(v[0]),
+            COMMAND_SET_PPI: lambda s, v: s.set_ppi(v[0]),  # Shares the value of COMMAND_SET_PWM, and takes precedence.
+            COMMAND_SET_STEP: lambda s, v: s.set_step(v[0]),
+            COMMAND_SET_OVERSCAN: lambda s, v: s.set_overscan(v[0]),
+            COMMAND_SET_ACCELERATION: lambda s, v: s.set_acceleration(v[0]),
+            COMMAND_SET_D_RATIO: lambda s, v: s.set_d_ratio(v[0]),
+            COMMAND_SET_DIRECTION: lambda s, v: s.set_directions(v[0], v[1], v[2], v[3]),
+            COMMAND_SET_INCREMENTAL: lambda s, v: s.set_incremental(),
+            COMMAND_SET_ABSOLUTE: lambda s, v: s.set_absolute(),
+            COMMAND_SET_POSITION: lambda s, v: s.set_position(v[0], v[1]),
+            COMMAND_MODE_RAPID: lambda s, v: s.ensure_rapid_mode(),
+            COMMAND_MODE_PROGRAM: lambda s, v: s.ensure_program_mode(),
+            COMMAND_MODE_FINISHED: lambda s, v: s.ensure_finished_mode(),
+            COMMAND_WAIT: lambda s, v: s.wait(v[0]),
+            COMMAND_WAIT_FINISH: lambda s, v: s.wait_finish(),
+            COMMAND_BEEP: lambda s, v: s.beep(),
+            COMMAND_FUNCTION: lambda s, v: s.call_function(*v),
+            COMMAND_SIGNAL: lambda s, v: s.device.signal(v[0], *v[1:]) if len(v) >= 2 else None,
+        }
+
     def command(self, command, *values):
         """Commands are middle language LaserCommandConstants there values are given."""
+        self.dispatch(command, values)
+
+    def dispatch(self, command, values):
+        """Performs the command with the given values through the dispatch table."""
         try:
-            if command == COMMAND_LASER_OFF:
-                self.laser_off()
-            elif command == COMMAND_LASER_ON:
-                self.laser_on()
-            elif command == COMMAND_LASER_DISABLE:
-                self.laser_disable()
-            elif command == COMMAND_LASER_ENABLE:
-                self.laser_enable()
-            elif command == COMMAND_CUT:
-                x, y = values
-                self.cut(x, y)
-            elif command == COMMAND_MOVE:
-                x, y = values
-                self.move(x, y)
-            elif command == COMMAND_JOG:
-                x, y = values
-                self.jog(x, y, mode=0, min_jog=self.device.opt_jog_minimum)
-            elif command == COMMAND_JOG_SWITCH:
-                x, y = values
-                self.jog(x, y, mode=1, min_jog=self.device.opt_jog_minimum)
-            elif command == COMMAND_JOG_FINISH:
-                x, y = values
-                self.jog(x, y, mode=2, min_jog=self.device.opt_jog_minimum)
-            elif command == COMMAND_HOME:
-                self.home()
-            elif command == COMMAND_LOCK:
-                self.lock_rail()
-            elif command == COMMAND_UNLOCK:
-                self.unlock_rail()
-            elif command == COMMAND_PLOT:
-                self.plot_path(values[0])
-            elif command == COMMAND_RASTER:
-                self.plot_raster(values[0])
-            elif command == COMMAND_SET_SPEED:
-                self.set_speed(values[0])
-            elif command == COMMAND_SET_POWER:
-                self.set_power(values[0])
-            elif command == COMMAND_SET_PPI:
-                self.set_ppi(values[0])
-            elif command == COMMAND_SET_PWM:
-                self.set_pwm(values[0])
-            elif command == COMMAND_SET_STEP:
-                self.set_step(values[0])
-            elif command == COMMAND_SET_OVERSCAN:
-                self.set_overscan(values[0])
-            elif command == COMMAND_SET_ACCELERATION:
-                self.set_acceleration(values[0])
-            elif command == COMMAND_SET_D_RATIO:
-                self.set_d_ratio(values[0])
-            elif command == COMMAND_SET_DIRECTION:
-                self.set_directions(values[0], values[1], values[2], values[3])
-            elif command == COMMAND_SET_INCREMENTAL:
-                self.set_incremental()
-            elif command == COMMAND_SET_ABSOLUTE:
-                self.set_absolute()
-            elif command == COMMAND_SET_POSITION:
-                self.set_position(values[0], values[1])
-            elif command == COMMAND_MODE_RAPID:
-                self.ensure_rapid_mode()
-            elif command == COMMAND_MODE_PROGRAM:
-                self.ensure_program_mode()
-            elif command == COMMAND_MODE_FINISHED:
-                self.ensure_finished_mode()
-            elif command == COMMAND_WAIT:
-                self.wait(values[0])
-            elif command == COMMAND_WAIT_FINISH:
-                self.wait_finish()
-            elif command == COMMAND_BEEP:
-                if os.name == 'nt':
-                    try:
-                        import winsound
-                        for x in range(5):
-                            winsound.Beep(2000, 100)
-                    except:
-                        pass
-                if os.name == 'posix':
-                    # Mac or linux.
-                    print('\a')  # Beep.
-                    os.system('say "Ding"')
-                else:
-                    print('\a')  # Beep.
-            elif command == COMMAND_FUNCTION:
-                if len(values) >= 1:
-                    t = values[0]
-                    if callable(t):
-                        t()
-            elif command == COMMAND_SIGNAL:
-                if isinstance(values, str):
-                    self.device.signal(values, None)
-                elif len(values) >= 2:
-                    self.device.signal(values[0], *values[1:])
+            function = self.dispatch_table[command]
+        except KeyError:
+            return  # Unknown command.
+        try:
+            function(self, values)
         except AttributeError:
-            pass
+            pass  # Method doesn't exist.
+
+    def beep(self, *values):
+        if os.name == 'nt':
+            try:
+                import winsound
+                for x in range(5):
+                    winsound.Beep(2000, 100)
+            except:
+                pass
+        if os.name == 'posix':
+            # Mac or linux.
+            print('\a')  # Beep.
+            os.system('say "Ding"')
+        else:
+            print('\a')  # Beep.
+
+    def call_function(self, *values):
+        if len(values) >= 1:
+            t = values[0]
+            if callable(t):
+                t()
 
     def realtime_command(self, command, *values):
         """Asks for the execution of a realtime command. Unlike the spooled commands these
@@ -560,6 +696,7 @@ class Interpreter(Module):
 
     def wait(self, t):
         self.next_run = t
+        self.wait_end = time.time() + t
 
     def wait_finish(self, *values):
         """Adds an additional holding requirement if the pipe has any data."""
@@ -567,6 +704,7 @@ class Interpreter(Module):
 
     def reset(self):
         self.spooled_item = None
+        self.command_buffer = None
         self.device.spooler.clear_queue()
         self.spooled_item = None
         self.extra_hold = None
@@ -796,6 +934,8 @@ class Elemental(Module):
         device.save_types = self.save_types
         device.load = self.load
         device.load_types = self.load_types
+        device.setting(int, "geometry_cache_segments", MAX_SEGMENTS)
+        LaserOperation.geometry_cache.max_segments = device.geometry_cache_segments
         Module.attach(self, device, name)
 
     def register(self, obj):
@@ -803,6 +943,7 @@ class Elemental(Module):
         obj.icon = None
         obj.bounds = None
         obj.last_transform = None
+        obj.geometry_version = 0
         obj.selected = False
         obj.emphasized = False
         obj.highlighted = False
@@ -839,6 +980,7 @@ class Elemental(Module):
             """
             obj.bounds = None
             self._bounds = None
+            LaserOperation.geometry_cache.discard(obj)
             self.validate_bounds()
             self.device.signal('modified', obj)
 
@@ -858,7 +1000,9 @@ class Elemental(Module):
             obj.wx_bitmap_image = None
             obj.icon = None
             obj.bounds = None
+            obj.geometry_version += 1
             self._bounds = None
+            LaserOperation.geometry_cache.discard(obj)
             self.validate_bounds()
             self.device.signal('altered', obj)
 
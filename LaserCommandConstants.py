@@ -24,6 +24,7 @@ COMMAND_WAIT_FINISH = 21  # WAIT until the buffer is finished.
 COMMAND_JOG = 30  # Jogs the machine in rapid mode.
 COMMAND_JOG_SWITCH = 31  # Jogs the machine in rapid mode.
 COMMAND_JOG_FINISH = 32
+COMMAND_JOG_AUTO = 33  # Jogs the machine with the jog mode estimated to be fastest.
 
 COMMAND_MODE_RAPID = 50
 COMMAND_MODE_PROGRAM = 51
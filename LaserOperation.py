@@ -1,16 +1,74 @@
+import weakref
 from copy import copy
+from math import ceil
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from CommandBuffer import CommandBuffer
+from GeometryCache import GeometryCache
 from LaserCommandConstants import *
-from RasterPlotter import RasterPlotter, X_AXIS, TOP, BOTTOM, Y_AXIS, RIGHT, LEFT, UNIDIRECTIONAL
+from LaserSpeed import LaserSpeed
+from RasterPlotter import RasterPlotter, ArrayPixels, X_AXIS, TOP, BOTTOM, Y_AXIS, RIGHT, LEFT, UNIDIRECTIONAL
 from svgelements import SVGImage, SVGElement, Shape, Color, Path, Polygon, Move, SVGText
 
 
+class RasterCostModel:
+    """
+    Estimates the time to raster an image with a traversal, to choose the fastest.
+
+    Each scanline is travelled at the raster speed from where the last one ended to its far bound, overscan included,
+    then the head stops, steps to the next scanline and starts again. Stopping and starting take the ramp time of the
+    acceleration class of the speed, which LaserSpeed gives differently for horizontal and vertical rastering. A
+    scanline can go no faster than its value changes are sent, each change takes run_time. Scanlines more than a step
+    apart are reached by a jump, which leaves program mode and moves at rapid speed, along each axis in turn, to the
+    start of the next scanline.
+    """
+
+    RUN_TIME = 0.0002  # Estimated time to send a change of value, in seconds.
+    RAPID_SPEED = 150.0  # Default rapid speed of jumps, in mm/s.
+
+    def __init__(self, speed, acceleration=None, run_time=RUN_TIME, rapid_speed=RAPID_SPEED, finish_time=0.250):
+        self.speed = speed  # mm/s
+        self.acceleration = acceleration
+        self.run_time = run_time
+        self.rapid_speed = rapid_speed  # mm/s
+        self.finish_time = finish_time
+
+    def time(self, raster):
+        """
+        :param raster: RasterPlotter of the traversal.
+        :return: estimated time in seconds to raster it.
+        """
+        if self.speed <= 0:
+            return float('inf')
+        accel = self.acceleration
+        if accel is None:
+            accel = LaserSpeed.get_acceleration_for_speed(self.speed, raster=True,
+                                                          raster_horizontal=not raster.traversal & Y_AXIS)
+        ramp = 2.0 * LaserSpeed.RAMP_TIME[accel]
+        pixel_time = raster.step * 0.0254 / self.speed
+        rapid_time = raster.step * 0.0254 / self.rapid_speed
+        total = 0.0
+        for scanned, runs, stepped, moved in raster.travel():
+            total += max(scanned * pixel_time, runs * self.run_time) + ramp
+            if stepped > 1:
+                total += self.finish_time + (stepped + moved) * rapid_time
+            else:
+                total += stepped * pixel_time
+        return total
+
+
 class LaserOperation(list):
     """
     Default object defining any operation done on the laser.
     Laser operations are a type of list and should contain SVGElement based objects
     """
 
+    geometry_cache = GeometryCache()  # Reified geometry of the elements, shared by all operations.
+
     def __init__(self, *args, **kwargs):
         list.__init__(self)
         self.operation = None
@@ -125,7 +183,8 @@ class LaserOperation(list):
         try:
             self.overscan = int(kwargs['overscan'])
         except (ValueError, TypeError, KeyError):
-            pass
+            if kwargs.get('overscan') == 'auto':
+                self.overscan = 'auto'
         try:
             self.dot_length = int(kwargs['dot_length'])
         except (ValueError, TypeError, KeyError):
@@ -227,6 +286,8 @@ class LaserOperation(list):
                 raster_dir += "L2R"
             elif self.raster_direction == 4:
                 raster_dir += "X"
+            elif self.raster_direction == 5:
+                raster_dir += "Auto"
             else:
                 raster_dir += "%d" % self.raster_direction
             parts.append(raster_dir)
@@ -284,7 +345,203 @@ class LaserOperation(list):
             return "%s:%s:%s" % (int(hours), str(int(minutes)).zfill(2), str(int(seconds)).zfill(2))
         return "Unknown"
 
-    def generate(self, rapid=True, jog=0):
+    def raster_estimate(self, rapid_speed=RasterCostModel.RAPID_SPEED, compute=True):
+        """
+        Estimated time of the images rastered with each of the traversals an automatic direction chooses from.
+
+        :param compute: estimate the images not estimated yet, otherwise None is returned for them.
+        """
+        image_estimates = self.raster_estimates(rapid_speed, compute)
+        if image_estimates is None:
+            return None
+        totals = {}
+        for estimates in image_estimates:
+            for direction, estimate in estimates.items():
+                totals[direction] = totals.get(direction, 0.0) + estimate
+        parts = []
+        for direction, name in ((0, "T2B"), (3, "L2R")):
+            if direction not in totals:
+                continue
+            hours, remainder = divmod(totals[direction], 3600)
+            minutes, seconds = divmod(remainder, 60)
+            parts.append("%s %s:%s:%s" % (name, int(hours), str(int(minutes)).zfill(2), str(int(seconds)).zfill(2)))
+        return ", ".join(parts)
+
+    def raster_estimates(self, rapid_speed=RasterCostModel.RAPID_SPEED, compute=True):
+        """
+        :param compute: estimate the images not estimated yet, otherwise None is returned if there are any.
+        :return: list of the estimated times, by direction, of each image. The estimates are kept on the image until
+        it or the settings they depend on change.
+        """
+        estimates = []
+        for svgimage in self:
+            if not isinstance(svgimage, SVGImage):
+                continue
+            key = (self.speed, self.overscan, self.raster_step, self.raster_swing,
+                   self.acceleration_custom and self.acceleration, self.operation, rapid_speed)
+            try:
+                image, cached_key, estimate = svgimage.raster_estimates
+                if image() is svgimage.image and cached_key == key:
+                    estimates.append(estimate)
+                    continue
+            except AttributeError:
+                pass
+            if not compute:
+                return None
+            estimate = self.fastest_raster(*self.raster_setup(svgimage), rapid_speed=rapid_speed)[1]
+            svgimage.raster_estimates = weakref.ref(svgimage.image), key, estimate
+            estimates.append(estimate)
+        return estimates
+
+    def raster_setup(self, svgimage):
+        """
+        :return: data, width, height, overscan, offset_x, offset_y, step and filter to raster the image with.
+        """
+        if self.operation == "Raster":
+            step = self.raster_step
+        else:
+            try:
+                step = int(svgimage.values['raster_step'])
+            except (KeyError, ValueError):
+                step = 1
+        image = svgimage.image
+        width, height = image.size
+        data, image_filter = self.raster_data(image, getattr(svgimage, 'raster_store', None))
+        m = svgimage.transform
+
+        overscan = self.overscan
+        if overscan is None:
+            overscan = 20
+        elif overscan == 'auto':
+            # The ramp times are not measured, the default is kept as the least overscan. Whole steps, rounded up, as
+            # the raster takes the overscan in steps.
+            step_size = max(step, 1)
+            overscan = step_size * int(ceil(max(20, self.minimum_overscan()) / float(step_size)))
+        else:
+            try:
+                overscan = int(overscan)
+            except ValueError:
+                overscan = 20
+        tx = m.value_trans_x()
+        ty = m.value_trans_y()
+        return data, width, height, overscan, tx, ty, step, image_filter
+
+    def minimum_overscan(self):
+        """
+        The overscan needed to start or stop at the raster speed, the distance covered while ramping within the ramp
+        time of its acceleration class. Program mode takes the acceleration class of horizontal rastering.
+
+        :return: overscan in mils.
+        """
+        if self.acceleration is not None and self.acceleration_custom:
+            accel = self.acceleration
+        else:
+            accel = LaserSpeed.get_acceleration_for_speed(self.speed, raster=True)
+        return int(ceil(self.speed / 0.0254 * LaserSpeed.RAMP_TIME[accel] / 2.0))
+
+    def raster_jumps(self, rapid_speed=RasterCostModel.RAPID_SPEED):
+        """
+        Jumping to the start of scanlines at rapid speed only pays for rasters slower than that. Both the rasters
+        generated and their estimates take this.
+
+        :return: whether scanlines more than a step apart are reached by a jump.
+        """
+        return self.speed < rapid_speed
+
+    def fastest_raster(self, data, width, height, overscan, tx, ty, step, image_filter,
+                       rapid_speed=RasterCostModel.RAPID_SPEED):
+        """
+        Estimates the time to raster the image top to bottom, direction 0, and left to right, direction 3.
+
+        :return: RasterPlotter of the fastest, estimated time of each by direction.
+        """
+        acceleration = self.acceleration if self.acceleration is not None and self.acceleration_custom else None
+        model = RasterCostModel(self.speed, acceleration, rapid_speed=rapid_speed)
+        swing = UNIDIRECTIONAL if self.raster_swing else 0
+        estimates = {}
+        fastest = None
+        index = None
+        for direction, traverse in ((0, X_AXIS | TOP), (3, Y_AXIS | LEFT)):
+            raster = RasterPlotter(data, width, height, traverse | swing, 0, overscan, tx, ty, step, image_filter,
+                                   index=index, jumps=self.raster_jumps(rapid_speed))
+            index = raster.index
+            estimates[direction] = model.time(raster)
+            if fastest is None or estimates[direction] < estimates[fastest[0]]:
+                fastest = direction, raster
+        return fastest[1], estimates
+
+    @staticmethod
+    def raster_data(image, store=None):
+        """
+        Converts the image into the pixel data to raster and the filter giving the power of a pixel, 0.0 to 1.0.
+
+        The power of a pixel depends only on its value, so it is computed once per possible value into a table. With
+        numpy the image is converted in bulk into an array of table indexes, the channels of RGB and RGBA pixels are
+        combined into a single index. Without numpy the pixels of single channel images are looked up in the table,
+        RGB and RGBA pixels are filtered one by one. An image held in a TiledRaster store is rastered from the store,
+        looking its pixels up in the table, without converting it.
+
+        :param image: image to raster
+        :param store: TiledRaster the image may be taken from
+        :return: data, filter
+        """
+        mode = image.mode
+        if mode != "1" and mode != "P" and mode != "L" and mode != "RGB" and mode != "RGBA":
+            # Any mode without a filter should get converted.
+            image = image.convert("RGBA")
+            mode = image.mode
+        if mode == "1":
+            def image_filter(pixel):
+                return (255 - pixel) / 255.0
+            lut = [image_filter(v) for v in range(256)]
+        elif mode == "P":
+            p = image.getpalette()
+
+            def image_filter(pixel):
+                v = p[pixel * 3] + p[pixel * 3 + 1] + p[pixel * 3 + 2]
+                return 1.0 - v / 765.0
+            lut = [image_filter(v) for v in range(len(p) // 3)] if p is not None else None
+        elif mode == "L":
+            def image_filter(pixel):
+                return (255 - pixel) / 255.0
+            lut = [image_filter(v) for v in range(256)]
+        elif mode == "RGB":
+            def image_filter(pixel):
+                return 1.0 - (pixel[0] + pixel[1] + pixel[2]) / 765.0
+            lut = [image_filter((v, 0, 0)) for v in range(766)] if np is not None else None  # By channel sum.
+        elif mode == "RGBA":
+            def image_filter(pixel):
+                return (1.0 - (pixel[0] + pixel[1] + pixel[2]) / 765.0) * pixel[3] / 255.0
+            if np is not None:
+                lut = [image_filter((v // 256, 0, 0, v & 255)) for v in range(766 * 256)]  # By sum * 256 + alpha.
+            else:
+                lut = None
+        else:
+            raise ValueError  # this shouldn't happen.
+        if store is not None and store.backs(image):
+            return store, lut.__getitem__
+        data = image.load()
+        if lut is None:
+            return data, image_filter
+        if np is None:
+            return data, lut.__getitem__
+        pixels = np.asarray(image)
+        if mode == "1":
+            codes = pixels.astype(np.uint8)
+            if pixels.any():
+                y, x = np.unravel_index(pixels.argmax(), pixels.shape)
+                codes *= data[int(x), int(y)]  # Value of a set pixel, 1 or 255 depending on Pillow.
+        elif mode == "RGB":
+            codes = pixels.sum(axis=2, dtype=np.uint16)
+        elif mode == "RGBA":
+            codes = pixels[:, :, :3].sum(axis=2, dtype=np.uint32) * 256 + pixels[:, :, 3]
+        else:
+            codes = pixels
+            if codes.size and int(codes.max()) >= len(lut):
+                return data, image_filter  # Palette index beyond the palette.
+        return ArrayPixels(codes, lut), None
+
+    def generate(self, rapid=True, jog=0, rapid_speed=RasterCostModel.RAPID_SPEED):
         if self.operation in ("Cut", "Engrave"):
             yield COMMAND_MODE_RAPID
             yield COMMAND_SET_ABSOLUTE
@@ -300,7 +557,8 @@ class LaserOperation(list):
             else:
                 yield COMMAND_SET_ACCELERATION, None
             try:
-                first = abs(self[0]).first_point
+                element = self[0]
+                first = (self.geometry_cache.plot(element) if isinstance(element, Shape) else abs(element)).first_point
                 yield COMMAND_MOVE, first[0], first[1]
             except (IndexError, AttributeError):
                 pass
@@ -312,26 +570,32 @@ class LaserOperation(list):
                 elif isinstance(object_path, SVGText):
                     plot = Path()  # SVGText objects cannot be correctly cut/engraved.
                 else:
-                    plot = abs(object_path)
+                    plot = None  # Reified geometry is taken from the cache.
                 if rapid:
-                    for subplot in plot.as_subpaths():
+                    if jog == 0:
+                        jog_command = COMMAND_JOG
+                    elif jog == 1:
+                        jog_command = COMMAND_JOG_SWITCH
+                    elif jog == 3:
+                        jog_command = COMMAND_JOG_AUTO
+                    else:
+                        jog_command = COMMAND_JOG_FINISH
+                    commands = CommandBuffer()
+                    if plot is None:
+                        subpaths = self.geometry_cache.subpaths(object_path)
+                    else:
+                        subpaths = GeometryCache.split(plot)
+                    for p in subpaths:
                         try:
-                            p = Path(subplot)
-                            p[0].start = None
                             first = p.first_point
-                            x = first[0]
-                            y = first[1]
-                            if jog == 0:
-                                yield COMMAND_JOG, x, y
-                            elif jog == 1:
-                                yield COMMAND_JOG_SWITCH, x, y
-                            else:
-                                yield COMMAND_JOG_FINISH, x, y
-                            yield COMMAND_PLOT, p
+                            commands.append(jog_command, first[0], first[1])
+                            commands.append(COMMAND_PLOT, p)
                         except (IndexError, AttributeError):
                             pass
-
+                    yield commands
                 else:
+                    if plot is None:
+                        plot = self.geometry_cache.plot(object_path)
                     yield COMMAND_PLOT, plot
             yield COMMAND_MODE_RAPID
         elif self.operation in ("Raster", "Image"):
@@ -368,59 +632,18 @@ class LaserOperation(list):
             for svgimage in self:
                 if not isinstance(svgimage, SVGImage):
                     continue  # We do not raster anything that is not classed properly.
-                if self.operation == "Raster":
-                    step = self.raster_step
-                else:
-                    try:
-                        step = int(svgimage.values['raster_step'])
-                    except (KeyError, ValueError):
-                        step = 1
+                data, width, height, overscan, tx, ty, step, image_filter = self.raster_setup(svgimage)
                 yield COMMAND_SET_STEP, step
-                image = svgimage.image
-                width, height = image.size
-                mode = image.mode
-
-                if mode != "1" and mode != "P" and mode != "L" and mode != "RGB" and mode != "RGBA":
-                    # Any mode without a filter should get converted.
-                    image = image.convert("RGBA")
-                    mode = image.mode
-                if mode == "1":
-                    def image_filter(pixel):
-                        return (255 - pixel) / 255.0
-                elif mode == "P":
-                    p = image.getpalette()
-
-                    def image_filter(pixel):
-                        v = p[pixel * 3] + p[pixel * 3 + 1] + p[pixel * 3 + 2]
-                        return 1.0 - v / 765.0
-                elif mode == "L":
-                    def image_filter(pixel):
-                        return (255 - pixel) / 255.0
-                elif mode == "RGB":
-                    def image_filter(pixel):
-                        return 1.0 - (pixel[0] + pixel[1] + pixel[2]) / 765.0
-                elif mode == "RGBA":
-                    def image_filter(pixel):
-                        return (1.0 - (pixel[0] + pixel[1] + pixel[2]) / 765.0) * pixel[3] / 255.0
+                if direction == 5:
+                    # Automatic, the traversal estimated fastest for this image.
+                    raster = self.fastest_raster(data, width, height, overscan, tx, ty, step, image_filter,
+                                                 rapid_speed=rapid_speed)[0]
                 else:
-                    raise ValueError  # this shouldn't happen.
-                m = svgimage.transform
-                data = image.load()
-
-                overscan = self.overscan
-                if overscan is None:
-                    overscan = 20
-                else:
-                    try:
-                        overscan = int(overscan)
-                    except ValueError:
-                        overscan = 20
-                tx = m.value_trans_x()
-                ty = m.value_trans_y()
-                raster = RasterPlotter(data, width, height, traverse, 0, overscan,
-                                       tx,
-                                       ty,
-                                       step, image_filter)
+                    raster = RasterPlotter(data, width, height, traverse, 0, overscan,
+                                           tx,
+                                           ty,
+                                           step, image_filter, jumps=self.raster_jumps(rapid_speed))
+                yield COMMAND_SET_OVERSCAN, raster.overscan * step
                 yield COMMAND_MODE_RAPID
                 x, y = raster.initial_position_in_scene()
                 yield COMMAND_MOVE, x, y
@@ -441,9 +664,9 @@ class LaserOperation(list):
                             cross_traverse ^= RIGHT
 
                     cross_raster = RasterPlotter(data, width, height, cross_traverse, 0, overscan,
-                                           tx,
-                                           ty,
-                                           step, image_filter)
+                                                 tx,
+                                                 ty,
+                                                 step, image_filter, index=raster.index, jumps=raster.jumps)
                     yield COMMAND_MODE_RAPID
                     x, y = cross_raster.initial_position_in_scene()
                     yield COMMAND_MOVE, x, y
@@ -1,6 +1,7 @@
 import wx
 from PIL import Image
 
+from RasterStore import TiledRaster
 from ZMatrix import ZMatrix
 from svgelements import *
 
@@ -238,11 +239,11 @@ class LaserRender:
                 except AttributeError:
                     max_allowed = 2048
                 node.c_width, node.c_height = node.image.size
-                node.wx_bitmap_image = self.make_thumbnail(node.image, maximum=max_allowed)
+                node.wx_bitmap_image = self.make_thumbnail(self.image_source(node), maximum=max_allowed)
             gc.DrawBitmap(node.wx_bitmap_image, 0, 0, node.c_width, node.c_height)
         else:
             node.c_width, node.c_height = node.image.size
-            cache = self.make_thumbnail(node.image)
+            cache = self.make_thumbnail(self.image_source(node))
             gc.DrawBitmap(cache, 0, 0, node.c_width, node.c_height)
         gc.PopState()
 
@@ -297,8 +298,16 @@ class LaserRender:
             return bmp
         return image
 
+    @staticmethod
+    def image_source(node):
+        """The TiledRaster store of the node's image if it is held in one, otherwise the image."""
+        store = getattr(node, 'raster_store', None)
+        if store is not None and store.backs(node.image):
+            return store
+        return node.image
+
     def make_thumbnail(self, pil_data, maximum=None, width=None, height=None):
-        """Resizes the given pil image into wx.Bitmap object that fits the constraints."""
+        """Resizes the given pil image, or TiledRaster, into wx.Bitmap object that fits the constraints."""
         image_width, image_height = pil_data.size
         if width is not None and height is None:
             height = width * image_height / float(image_width)
@@ -313,10 +322,12 @@ class LaserRender:
             scale = min(scale_x, scale_y)
             width = int(round(width * scale))
             height = int(round(height * scale))
-        if image_width != width or image_height != height:
-            pil_data = pil_data.copy().resize((width, height))
-        else:
-            pil_data = pil_data.copy()
+        if isinstance(pil_data, TiledRaster):
+            width = int(round(width))
+            height = int(round(height))
+            pil_data = pil_data.thumbnail(width, height)  # Resized a tile at a time.
+        elif image_width != width or image_height != height:
+            pil_data = pil_data.resize((width, height))
         if pil_data.mode != "RGBA":
             pil_data = pil_data.convert('RGBA')
         pil_bytes = pil_data.tobytes()
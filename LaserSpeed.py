@@ -36,6 +36,8 @@ class LaserSpeed:
     are used.
     """
 
+    RAMP_TIME = (0.0, 0.005, 0.010, 0.020, 0.040)  # Estimated time to start or stop, in seconds, per acceleration.
+
     def __init__(self, *args, **kwargs):
         self.board = 'M2'
         self.speed = 30
@@ -0,0 +1,384 @@
+import hashlib
+import importlib
+import json
+import os
+import pickle
+import subprocess
+import sys
+import time
+from copy import copy
+from multiprocessing.connection import Client, Listener, arbitrary_address, default_family
+
+from LhystudiosDevice import LhymicroInterpreter
+
+"""
+LhystudiosCompiler compiles laser operations to LHYMICRO-GL in a separate process.
+
+When the LhymicroInterpreter fetches a laser operation with the precompile setting enabled, the operation is sent to
+the compiler process together with the current state of the interpreter. A headless LhymicroInterpreter in that process
+runs the generate() of the operation and sends the code back in chunks as it is encoded, followed by the final state.
+The interpreter in the main process only streams the compiled code to the controller, so the plotting and encoding of
+the job do not compete with the GUI and the USB thread for the main interpreter.
+
+Compiled code is kept in a CompileCache under the compile_key of the operation, so a repeated job is streamed without
+being compiled again.
+"""
+
+CHUNK_SIZE = 16384  # Compiled code sent per message.
+CHUNK_TIME = 0.05  # Longest delay before compiled code is sent.
+
+INTERPRETER_STATE = ('state', 'pulse_total', 'pulse_modulation', 'group_modulation', 'properties', 'is_relative',
+                     'laser', 'laser_enabled', 'raster_step', 'overscan', 'speed', 'power', 'd_ratio', 'acceleration',
+                     'next_x', 'next_y', 'max_x', 'max_y', 'min_x', 'min_y', 'start_x', 'start_y')
+DEVICE_STATE = ('current_x', 'current_y')
+DEVICE_SETTINGS = ('board', 'autolock', 'swap_xy', 'flip_x', 'flip_y', 'home_right', 'home_bottom', 'home_adjust_x',
+                   'home_adjust_y', 'bed_width', 'bed_height', 'opt_rapid_between', 'opt_jog_mode', 'opt_jog_minimum',
+                   'opt_peephole', 'jog_rapid_speed', 'jog_event_time', 'jog_switch_time', 'jog_finish_time')
+OPERATION_SETTINGS = ('operation', 'speed', 'power', 'dratio_custom', 'dratio', 'acceleration_custom', 'acceleration',
+                      'raster_step', 'raster_direction', 'raster_swing', 'overscan', 'raster_preference_top',
+                      'raster_preference_right', 'raster_preference_left', 'raster_preference_bottom', 'advanced',
+                      'dot_length_custom', 'dot_length', 'group_pulses', 'passes_custom', 'passes', 'rapid')
+ENCODER_MODULES = ('LhystudiosDevice', 'LaserOperation', 'LaserSpeed', 'RasterPlotter', 'zinglplotter', 'svgelements')
+
+_encoder_digest = None
+
+
+def interpreter_state(interpreter):
+    """
+    :return: dict of the interpreter and device state the encoding of the next command depends upon.
+    """
+    state = dict((name, getattr(interpreter, name)) for name in INTERPRETER_STATE)
+    for name in DEVICE_STATE:
+        state[name] = getattr(interpreter.device, name)
+    return state
+
+
+def restore_interpreter_state(interpreter, state):
+    for name in INTERPRETER_STATE:
+        setattr(interpreter, name, state[name])
+    for name in DEVICE_STATE:
+        setattr(interpreter.device, name, state[name])
+
+
+def device_settings(device):
+    return dict((name, getattr(device, name)) for name in DEVICE_SETTINGS)
+
+
+def encoder_digest():
+    """
+    :return: digest of the modules producing the code, so cached code does not outlive a change of the encoder.
+    """
+    global _encoder_digest
+    if _encoder_digest is None:
+        digest = hashlib.sha256()
+        for name in ENCODER_MODULES:
+            digest.update(name.encode())
+            try:
+                with open(importlib.import_module(name).__file__, 'rb') as f:
+                    digest.update(f.read())
+            except (ImportError, AttributeError, TypeError, OSError):
+                pass
+        _encoder_digest = digest.digest()
+    return _encoder_digest
+
+
+def compile_key(operation, state, settings):
+    """
+    Key of the compiled code of the operation. This covers the operation settings, the geometry, transforms and images
+    of its elements, the interpreter state and the device settings the code is compiled with.
+
+    :return: hex digest or None if the elements cannot be hashed.
+    """
+    key = hashlib.sha256(encoder_digest())
+    key.update(repr([(name, getattr(operation, name, None)) for name in OPERATION_SETTINGS]).encode())
+    key.update(repr(sorted(state.items())).encode())
+    key.update(repr(sorted(settings.items())).encode())
+    try:
+        for element in operation:
+            key.update(pickle.dumps(copy(element), protocol=4))
+    except (pickle.PicklingError, AttributeError, TypeError, ValueError):
+        return None
+    return key.hexdigest()
+
+
+class CompiledJob:
+    """
+    Interpreter side state of an operation being compiled, or of its cached code.
+    """
+
+    def __init__(self, job_id, operation, data=b'', state=None):
+        self.job_id = job_id
+        self.operation = operation
+        self.data = bytearray(data)
+        self.compiled = len(data)
+        self.sent = 0
+        self.state = state  # Final interpreter state, once compiled.
+        self.error = None
+        self.key = None  # Cache key, the code is kept while it is compiled.
+        self.code = None
+
+    def receive(self, message):
+        if message[1] != self.job_id:
+            return  # Cancelled job.
+        if message[0] == 'data':
+            self.data += message[2]
+            self.compiled += len(message[2])
+            if self.code is not None:
+                self.code += message[2]
+        elif message[0] == 'done':
+            self.state = message[2]
+        elif message[0] == 'error':
+            self.error = message[2]
+
+    def read(self, size):
+        data = bytes(self.data[:size])
+        del self.data[:size]
+        self.sent += len(data)
+        return data
+
+    def finished(self):
+        return self.state is not None and len(self.data) == 0
+
+
+class CompilerProcess:
+    """
+    Interpreter side handle of the compiler process.
+
+    As with the sender process, this is started as a fresh interpreter running this module, so it does not depend upon
+    the main module of the application being safe to import.
+    """
+
+    def __init__(self):
+        self.process = None
+        self.connection = None
+        self.job_id = 0
+
+    def start(self, timeout=10.0):
+        """
+        Starts the compiler process and connects to it.
+
+        :raise ConnectionRefusedError: if the compiler process could not be connected.
+        """
+        if getattr(sys, 'frozen', False):
+            # A frozen build has no Python to run this module with, sys.executable is the application itself.
+            raise ConnectionRefusedError
+        address = arbitrary_address(default_family)
+        authkey = os.urandom(16)
+        config = dict(address=address, authkey=authkey.hex())
+        directory = os.path.dirname(os.path.abspath(__file__))
+        self.process = subprocess.Popen([sys.executable, '-c',
+                                         'import sys; sys.path.insert(0, %r); '
+                                         'import LhystudiosCompiler; LhystudiosCompiler.main()' % directory],
+                                        stdin=subprocess.PIPE)
+        self.process.stdin.write((json.dumps(config) + '\n').encode())
+        self.process.stdin.close()
+        start = time.time()
+        while self.connection is None:
+            try:
+                self.connection = Client(address, authkey=authkey)
+            except OSError:
+                if self.process.poll() is not None or time.time() - start > timeout:
+                    self.stop()
+                    raise ConnectionRefusedError
+                time.sleep(0.05)
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def compile(self, operation, state, settings):
+        """
+        Sends a copy of the operation to be compiled from the given interpreter state.
+
+        :return: CompiledJob receiving the compiled code.
+        :raise OSError: if the operation could not be sent.
+        """
+        self.job_id += 1
+        job = CompiledJob(self.job_id, operation)
+        try:
+            self.connection.send(('compile', job.job_id, copy(operation), state, settings))
+        except (pickle.PicklingError, AttributeError, TypeError, ValueError) as e:
+            raise OSError(str(e))  # Operation cannot be pickled.
+        return job
+
+    def cancel(self, job):
+        try:
+            self.connection.send(('cancel', job.job_id))
+        except (OSError, ValueError):
+            pass
+
+    def receive(self, job):
+        """
+        Passes the messages waiting from the compiler process to the job.
+
+        :return: False if the compiler process has gone away.
+        """
+        try:
+            while self.connection.poll():
+                job.receive(self.connection.recv())
+        except (EOFError, OSError, ValueError):
+            return False
+        return True
+
+    def stop(self):
+        if self.connection is not None:
+            try:
+                self.connection.send(('quit',))
+            except (OSError, ValueError):
+                pass
+        if self.process is not None:
+            try:
+                self.process.wait(2.0)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class CompileCancelled(Exception):
+    pass
+
+
+class CompilerDevice:
+    """
+    Headless stand in for the LhystudiosDevice, holding the settings the interpreter reads.
+    """
+
+    def __init__(self, settings):
+        self.buffer_limit = False
+        self.__dict__.update(settings)
+
+    def setting(self, setting_type, setting_name, default=None):
+        if not hasattr(self, setting_name):
+            setattr(self, setting_name, default)
+        return getattr(self, setting_name)
+
+    def signal(self, code, *message):
+        pass
+
+    def add(self, *args, **kwargs):
+        pass
+
+    def remove(self, *args, **kwargs):
+        pass
+
+
+class CompilerPipe:
+    """
+    Pipe of the headless interpreter, sending the compiled code back in chunks.
+    """
+
+    def __init__(self, compiler, job_id):
+        self.compiler = compiler
+        self.job_id = job_id
+        self.data = bytearray()
+        self.last_send = time.time()
+
+    def __len__(self):
+        return 0
+
+    def write(self, data):
+        self.data += data
+        if len(self.data) >= CHUNK_SIZE or time.time() - self.last_send >= CHUNK_TIME:
+            self.send()
+
+    def send(self):
+        self.compiler.check_cancel(self.job_id)
+        if len(self.data):
+            self.compiler.send('data', self.job_id, bytes(self.data))
+            del self.data[:]
+        self.last_send = time.time()
+
+    def realtime_write(self, data):
+        self.write(data)
+
+    def clear_buffers(self):
+        del self.data[:]
+
+
+class LhymicroCompiler:
+    """
+    Compiler process side. Compiles each requested operation with a headless LhymicroInterpreter.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.cancelled = set()
+        self.pending = []
+        self.quit = False
+
+    def send(self, *message):
+        self.connection.send(message)
+
+    def check_cancel(self, job_id):
+        while self.connection.poll():
+            message = self.connection.recv()
+            if message[0] == 'cancel':
+                self.cancelled.add(message[1])
+            elif message[0] == 'quit':
+                self.quit = True
+                self.cancelled.add(job_id)
+            else:
+                self.pending.append(message)
+        if job_id in self.cancelled:
+            raise CompileCancelled
+
+    def run(self):
+        while not self.quit:
+            if len(self.pending):
+                message = self.pending.pop(0)
+            else:
+                message = self.connection.recv()
+            if message[0] == 'quit':
+                break
+            if message[0] == 'compile':
+                job_id, operation, state, settings = message[1:]
+                try:
+                    self.send('done', job_id, self.compile(job_id, operation, state, settings))
+                except CompileCancelled:
+                    pass
+                except Exception as e:
+                    self.send('error', job_id, repr(e))
+            self.cancelled.clear()
+
+    def compile(self, job_id, operation, state, settings):
+        """
+        Compiles the operation from the given state.
+
+        :return: final interpreter state.
+        """
+        device = CompilerDevice(settings)
+        pipe = CompilerPipe(self, job_id)
+        interpreter = LhymicroInterpreter(pipe)
+        interpreter.device = device
+        interpreter.update_codes()
+        restore_interpreter_state(interpreter, state)
+        interpreter.spooled_item = operation.generate(rapid=device.opt_rapid_between, jog=device.opt_jog_mode,
+                                                      rapid_speed=device.jog_rapid_speed)
+        while interpreter.spooled_item is not None or interpreter.plot is not None:
+            interpreter.execute()
+        interpreter.flush()
+        pipe.send()
+        state = interpreter_state(interpreter)
+        if interpreter.peephole is not None:
+            state['peephole'] = (interpreter.peephole.bytes_in, interpreter.peephole.bytes_out)
+        if interpreter.jog_model.jogs:
+            state['jog'] = interpreter.jog_model.summary()
+        return state
+
+
+def main():
+    """
+    Entry point of the compiler process. The configuration is read as a line of json from stdin.
+    """
+    config = json.loads(sys.stdin.readline())
+    listener = Listener(config['address'], authkey=bytes.fromhex(config['authkey']))
+    connection = listener.accept()
+    listener.close()
+    try:
+        LhymicroCompiler(connection).run()
+    except (EOFError, OSError):
+        pass  # Interpreter has gone away.
+    finally:
+        connection.close()
@@ -1,6 +1,12 @@
+import re
 import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from itertools import chain
 
 from CH341DriverBase import *
+from ChunkedBuffer import ChunkedBuffer
 from Kernel import *
 from LaserSpeed import LaserSpeed
 from svgelements import *
@@ -38,6 +44,15 @@ DIRECTION_FLAG_Y = 8  # Y-stepper motor is engaged.
 DIRECTION_START_X = 16
 DIRECTION_START_Y = 32
 
+OP_FRAME = 1  # Sender process, send and confirm the frame.
+OP_FRAME_WAIT = 2  # Sender process, send and confirm the frame, then wait for the board to finish.
+OP_WAIT = 3  # Sender process, wait for the board to finish.
+
+CODE_FLUSH_SIZE = 1024  # Interpreter code is written to the pipe once this many bytes are encoded.
+
+WATERMARK_MIN = 300  # Bounds of the auto-tuned buffer watermark, in bytes.
+WATERMARK_MAX = 100000
+
 
 class LhystudiosDevice(Device):
     """
@@ -122,6 +137,252 @@ def lhymicro_distance(v):
     return dist + distance_lookup[v]
 
 
+PEEPHOLE_TOKENS = re.compile(rb'((?:[a-y]|z|\|[a-z]|[0-9]{3})+)|([BTLRM])|([DU])|([CV][0-9CVG]*)|(S[0-9]?)|(.)', re.S)
+PEEPHOLE_PENDING = re.compile(rb'[0-9CVGS|]+$')
+PEEPHOLE_AXIS = {ord('B'): 1, ord('T'): 1, ord('L'): 2, ord('R'): 2}
+
+
+class PeepholeOptimizer:
+    """
+    Peephole pass over an LHYMICRO-GL byte stream.
+
+    * Adjacent distances are summed and given the shortest encoding.
+    * Consecutive moves along the same direction are merged into one move.
+    * A direction switch immediately overridden by a switch on the same axis is removed.
+    * Repeated laser on or laser off commands are removed.
+
+    Only the first rule applies outside of vector program mode, the other rules are limited to the compact vector
+    moves where they are known to be no-ops. The stream is fed in chunks, the tail which may still merge with the
+    next chunk is held back until the next feed or the final flush.
+    """
+
+    def __init__(self):
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.pending = b''  # Bytes of an incomplete trailing token.
+        self.tokens = []  # Held tokens: [kind, value, raw, vector]
+        self.program = False
+        self.raster = False
+        self.after_n = False
+        self.last = None
+
+    def clear(self):
+        self.pending = b''
+        del self.tokens[:]
+        self.program = False
+        self.raster = False
+        self.after_n = False
+        self.last = None
+
+    def feed(self, data, final=False):
+        """
+        :return: optimized code which can be written. The held tail is included if final is set.
+        """
+        self.bytes_in += len(data)
+        data = self.pending + data
+        self.pending = b''
+        if not final:
+            match = PEEPHOLE_PENDING.search(data)
+            if match is not None:
+                self.pending = data[match.start():]
+                data = data[:match.start()]
+        tokens = self.tokens
+        for match in PEEPHOLE_TOKENS.finditer(data):
+            kind = match.lastindex
+            raw = match.group(kind)
+            vector = self.program and not self.raster
+            if kind == 1:
+                value = 0
+                for m in re.finditer(rb'[a-y]|z|\|[a-z]|[0-9]{3}', raw):
+                    part = m.group()
+                    if part[0] == 122:  # z
+                        value += 255
+                    elif part[0] == 124:  # |
+                        value += part[1] - 96 + 25
+                    elif len(part) == 3:
+                        value += int(part)
+                    else:
+                        value += part[0] - 96
+                if len(tokens) and tokens[-1][0] == 1:
+                    tokens[-1][1] += value  # Distances are additive.
+                    tokens[-1][2] += raw
+                    continue
+                if vector and len(tokens) >= 3 and tokens[-1][0] == 2 and tokens[-1][3] \
+                        and tokens[-2][0] == 1 and tokens[-3][0] == 2 and tokens[-3][1] == tokens[-1][1]:
+                    tokens.pop()  # X d1 X d2 is X d1+d2.
+                    tokens[-1][1] += value
+                    tokens[-1][2] += raw
+                    continue
+                if vector and len(tokens) >= 2 and tokens[-1][0] == 2 and tokens[-2][0] == 2 and tokens[-2][3] \
+                        and PEEPHOLE_AXIS.get(tokens[-1][1]) is not None \
+                        and PEEPHOLE_AXIS.get(tokens[-1][1]) == PEEPHOLE_AXIS.get(tokens[-2][1]):
+                    del tokens[-2]  # Direction switch overridden before any move.
+                tokens.append([1, value, raw, vector])
+                self.after_n = False
+            elif kind == 2:
+                tokens.append([2, raw[0], raw, vector])
+                self.after_n = False
+            elif kind == 3:
+                if vector and len(tokens) and tokens[-1][0] == 3 and tokens[-1][1] == raw[0] and tokens[-1][3]:
+                    continue  # Laser is already in that state.
+                tokens.append([3, raw[0], raw, vector])
+            else:
+                if kind == 4:
+                    self.raster = b'G' in raw
+                elif kind == 5:
+                    self.program = False
+                elif raw == b'E' and self.last is not None and self.last[0] == 5:
+                    # S1E enters program mode, as does SE closing a jog. NSE leaves it.
+                    self.program = self.last == (5, b'S1') or not self.after_n
+                else:
+                    self.program = False
+                    self.after_n = raw == b'N'
+                tokens.append([kind, None, raw, vector])
+            self.last = (kind, raw)
+        keep = 0
+        if not final:
+            while keep < 3 and keep < len(tokens) and tokens[-1 - keep][0] <= 3:
+                keep += 1
+        out = bytearray()
+        for i in range(len(tokens) - keep):
+            kind, value, raw, vector = tokens[i]
+            if kind == 1:
+                code = lhymicro_distance(value)
+                if len(code) < len(raw):
+                    raw = code
+            out += raw
+        del tokens[:len(tokens) - keep]
+        self.bytes_out += len(out)
+        return bytes(out)
+
+
+class SliceMetrics:
+    """
+    Durations of the execute slices of the LhymicroInterpreter.
+
+    Each slice is recorded with its start, duration, the bytes it encoded and why it ended: held by the buffer, out of
+    budget or out of work. Lateness is how long after its scheduled time a slice began, negative when the slice was
+    woken early by the buffer draining. Headroom is the part of the time budget a slice did not use.
+    """
+
+    def __init__(self, history=512):
+        self.slices = deque(maxlen=history)  # (start, duration, bytes, lateness)
+        self.ended = {'hold': 0, 'budget': 0, 'idle': 0}
+        self._last_end = None
+
+    def reset(self):
+        self.slices.clear()
+        for reason in self.ended:
+            self.ended[reason] = 0
+        self._last_end = None
+
+    def record(self, start, end, length, reason, interval):
+        lateness = start - (self._last_end + interval) if self._last_end is not None else 0.0
+        self.slices.append((start, end - start, length, lateness))
+        self.ended[reason] += 1
+        self._last_end = end if reason != 'idle' else None
+
+    def report(self, budget):
+        """
+        :param budget: time budget of a slice in seconds.
+        :return: lines describing the recorded slices.
+        """
+        if len(self.slices) == 0:
+            yield 'No slices recorded.'
+            return
+        durations = sorted(s[1] for s in self.slices)
+        lateness = sorted(s[3] for s in self.slices)
+        count = len(durations)
+        mean = sum(durations) / count
+        yield 'Slices: %d (held %d, budget %d, idle %d)' % \
+              (count, self.ended['hold'], self.ended['budget'], self.ended['idle'])
+        yield 'Duration: mean %.2fms, p95 %.2fms, max %.2fms of %.2fms budget (%.0f%% headroom)' % \
+              (mean * 1000.0, durations[int(0.95 * (count - 1))] * 1000.0, durations[-1] * 1000.0, budget * 1000.0,
+               100.0 * max(0.0, 1.0 - mean / budget) if budget > 0 else 0.0)
+        yield 'Lateness: mean %.2fms, p95 %.2fms, max %.2fms' % \
+              (sum(lateness) / count * 1000.0, lateness[int(0.95 * (count - 1))] * 1000.0, lateness[-1] * 1000.0)
+        yield 'Bytes: %.1f per slice' % (sum(s[2] for s in self.slices) / float(count))
+
+
+class JogCostModel:
+    """
+    Estimates the time a jog between cuts takes for each jog mode, to choose the fastest per jog.
+
+    A jog event (mode 0) stays in compact mode: the head stops, travels the jog at the program speed and starts again.
+    Jog finish (mode 2) leaves compact mode, which waits for the board to finish, travels at rapid speed and enters
+    compact mode again. Jog switch (mode 1) travels at the program speed as well, with a speed switch on top of the
+    jog event, so it is never faster and is not chosen. The program speed and its acceleration class are those of the
+    speed code the board is given, the fixed costs are tunable constants.
+
+    Jogs move along each axis in turn, so the distance travelled is the sum of both axes.
+    """
+
+    RAMP_TIME = LaserSpeed.RAMP_TIME  # Time to start or stop, in seconds, per acceleration class.
+
+    def __init__(self, rapid_speed=150.0, event_time=0.010, switch_time=0.030, finish_time=0.250):
+        self.rapid_speed = rapid_speed  # mm/s
+        self.event_time = event_time  # Fixed costs of the jog modes, in seconds.
+        self.switch_time = switch_time
+        self.finish_time = finish_time
+        self.speeds = {}
+        self.jogs = 0
+        self.time = 0.0  # Estimated time of the chosen jogs.
+        self.totals = [0.0, 0.0, 0.0]  # Estimated time of the jogs with each mode.
+
+    def reset(self):
+        self.jogs = 0
+        self.time = 0.0
+        self.totals = [0.0, 0.0, 0.0]
+
+    def program_speed(self, board, speed, acceleration=None):
+        """
+        :return: speed in mm/s and acceleration class of the speed code for the requested speed.
+        """
+        key = (board, speed, acceleration)
+        try:
+            return self.speeds[key]
+        except KeyError:
+            pass
+        speed_code = LaserSpeed(board, speed, acceleration=acceleration, fix_limit=True, fix_lows=True,
+                                fix_speeds=False, raster_horizontal=True).speedcode
+        accel = LaserSpeed.parse_speed_code(speed_code)[1]
+        value = self.speeds[key] = (LaserSpeed.get_speed_from_code(speed_code, board), accel)
+        return value
+
+    def times(self, distance, speed, accel):
+        """
+        :param distance: distance travelled, in mils.
+        :param speed: program speed in mm/s.
+        :param accel: acceleration class of the program speed.
+        :return: estimated time in seconds of the jog for each mode.
+        """
+        distance *= 0.0254
+        ramp = 2.0 * self.RAMP_TIME[accel]
+        travel = distance / speed if speed > 0 else float('inf')
+        rapid_ramp = 2.0 * self.RAMP_TIME[LaserSpeed.get_acceleration_for_speed(self.rapid_speed)]
+        rapid_travel = distance / self.rapid_speed if self.rapid_speed > 0 else float('inf')
+        return (self.event_time + ramp + travel,
+                self.switch_time + ramp + travel,
+                self.finish_time + ramp + rapid_ramp + rapid_travel)
+
+    def choose(self, distance, speed, accel):
+        """
+        Chooses the jog mode for the jog and records its estimates.
+
+        :return: jog mode, 0 or 2.
+        """
+        times = self.times(distance, speed, accel)
+        mode = 0 if times[0] <= times[2] else 2
+        self.jogs += 1
+        self.time += times[mode]
+        for i in range(3):
+            self.totals[i] += times[i]
+        return mode
+
+    def summary(self):
+        return self.jogs, self.time, tuple(self.totals)
+
+
 class LhymicroInterpreter(Interpreter):
     """
     LhymicroInterpreter provides Lhystudio specific coding for elements and sends it to the backend
@@ -150,6 +411,19 @@ class LhymicroInterpreter(Interpreter):
         self.start_x = None
         self.start_y = None
         self.is_paused = False
+        self._code = bytearray()  # Encoded code not yet written to the pipe.
+        self.compiler = None  # Compiler process, when operations are precompiled.
+        self.compiled = None  # Operation being streamed from the compiler process.
+        self.compile_cache = None
+        self.peephole = None  # Peephole optimizer of the code, when enabled.
+        self.peephole_reported = (0, 0)
+        self.jog_model = JogCostModel()  # Chooses the mode of auto jogs.
+        self.fold_jumps = False  # Blank moves after raster jumps are made within the jump, at rapid speed.
+        self.written = 0  # Bytes of code flushed.
+        self.slice_end = None  # Time and written bytes at which the current execute slice is spent.
+        self.slice_limit = 0
+        self.slice_metrics = SliceMetrics()
+        self.held = False  # Last slice ended held, waiting for the buffer to drain.
 
     def initialize(self, channel=None):
         self.device.setting(bool, "swap_xy", False)
@@ -161,6 +435,19 @@ class LhymicroInterpreter(Interpreter):
         self.device.setting(int, "home_adjust_y", 0)
         self.device.setting(int, "buffer_max", 900)
         self.device.setting(bool, "buffer_limit", True)
+        self.device.setting(bool, "buffer_auto", True)
+        self.device.setting(int, "buffer_target_ms", 500)
+        self.device.setting(bool, "precompile", False)
+        self.device.setting(bool, "compile_cache", True)
+        self.device.setting(int, "compile_cache_size", 256)
+        self.device.setting(str, "compile_cache_dir", '')
+        self.device.setting(bool, "opt_peephole", False)
+        self.device.setting(int, "slice_time", 20)  # Time budget of an execute slice, in ms.
+        self.device.setting(int, "slice_bytes", 16384)  # Code budget of an execute slice, in bytes.
+        self.device.setting(float, "jog_rapid_speed", 150.0)  # Cost model of auto jogs, speeds in mm/s, times in ms.
+        self.device.setting(int, "jog_event_time", 10)
+        self.device.setting(int, "jog_switch_time", 30)
+        self.device.setting(int, "jog_finish_time", 250)
         self.device.setting(int, "current_x", 0)
         self.device.setting(int, "current_y", 0)
 
@@ -181,8 +468,15 @@ class LhymicroInterpreter(Interpreter):
         self.device.add('control', "Realtime Pause", self.pause)
         self.device.add('control', "Realtime Resume", self.resume)
         self.device.add('control', "Update Codes", self.update_codes)
+        try:
+            self.pipe.drain_listener = self.pipe_drained
+        except AttributeError:
+            pass  # Pipe cannot report draining, slices run on the timer alone.
 
     def finalize(self, channel=None):
+        if self.compiler is not None:
+            self.compiler.stop()
+            self.compiler = None
         self.device.remove('control', "Realtime Pause_Resume")
         self.device.remove('control', "Realtime Pause")
         self.device.remove('control', "Realtime Resume")
@@ -219,13 +513,233 @@ class LhymicroInterpreter(Interpreter):
                 return True
             else:
                 self.extra_hold = None
-        return self.device.buffer_limit and len(self.pipe) > self.device.buffer_max
+        if not self.device.buffer_limit:
+            return False
+        watermark = getattr(self.pipe, 'watermark', None)
+        if watermark is None or not self.device.buffer_auto:
+            watermark = self.device.buffer_max
+        return len(self.pipe) + len(self._code) > watermark
+
+    def write(self, data):
+        """
+        Encodes into the local code buffer. The code is written to the pipe once per execute slice, or when the
+        buffer fills, so the pipe overhead scales with the bytes and not with the number of moves.
+        """
+        code = self._code
+        code += data
+        if len(code) >= CODE_FLUSH_SIZE:
+            self.flush(False)
+
+    def flush(self, final=True):
+        """
+        Writes the encoded code to the pipe. With the opt_peephole setting the code passes through the peephole
+        optimizer, which holds back the tail of the code unless this is the final flush of the slice.
+        """
+        peephole = self.peephole
+        if self.device.opt_peephole:
+            if peephole is None:
+                peephole = self.peephole = PeepholeOptimizer()
+        elif peephole is not None:
+            self.peephole = None
+            final = True
+        if len(self._code) or (peephole is not None and final):
+            data = bytes(self._code)
+            del self._code[:]
+            self.written += len(data)
+            if peephole is not None:
+                data = peephole.feed(data, final)
+            if len(data):
+                self.pipe.write(data)
+
+    def report_peephole(self, bytes_in, bytes_out):
+        if bytes_in == 0:
+            return
+        self.device.signal('interpreter;peephole', (bytes_in, bytes_out))
+        self.device.channel_open('interpreter')("Peephole: saved %d of %d bytes" % (bytes_in - bytes_out, bytes_in))
+
+    def report_jog(self, jogs, estimate, totals):
+        if jogs == 0:
+            return
+        self.device.signal('interpreter;jog', (jogs, estimate, totals))
+        self.device.channel_open('interpreter')(
+            "Jog: %d auto jogs, estimated %.2fs, saved %.2fs over jog standard and %.2fs over jog finish" %
+            (jogs, estimate, totals[0] - estimate, totals[2] - estimate))
+
+    def process_spool(self, *args):
+        """
+        Runs an execute slice. Commands are performed until the buffer holds, the spooler runs out or the slice has
+        spent its time or code budget.
+        """
+        start = time.perf_counter()
+        written = self.written + len(self._code)
+        self.slice_end = start + self.device.slice_time / 1000.0
+        self.slice_limit = written + self.device.slice_bytes
+        next_run = self.next_run
+        busy = self.compiled is not None or self.spooled_item is not None
+        reason = 'idle'
+        if self.compiled is not None:
+            self.stream_compiled()
+            if self.hold():
+                reason = 'hold'
+        else:
+            while True:
+                Interpreter.process_spool(self, *args)
+                if self.spooled_item is None and self.plot is None and self.device.spooler.peek() is None:
+                    break
+                busy = True
+                if self.hold():
+                    reason = 'hold'
+                    break
+                if self.slice_spent():
+                    reason = 'budget'
+                    break
+                if self.compiled is not None or self.next_run != next_run:
+                    break
+        self.flush()
+        self.slice_end = None
+        self.held = self.hold() and not self.waiting()  # A COMMAND_WAIT ends in time, not when the buffer drains.
+        if busy:
+            self.slice_metrics.record(start, time.perf_counter(), self.written - written, reason, self.interval)
+
+    def feeder_idle(self):
+        return self.plot is None and self.compiled is None and Interpreter.feeder_idle(self)
+
+    def feeder_held(self):
+        job = self.compiled
+        if job is not None and len(job.data) == 0 and job.state is None:
+            return True  # Waiting for the compiler process.
+        return self.hold()
+
+    def slice_spent(self):
+        """
+        :return: whether the current execute slice has spent its time or code budget.
+        """
+        if self.slice_end is None:
+            return False
+        return time.perf_counter() >= self.slice_end or self.written + len(self._code) >= self.slice_limit
+
+    def pipe_drained(self, length):
+        """
+        Called by the pipe as its buffer changes. Wakes the interpreter once a held slice can continue, rather than
+        waiting for the next tick.
+        """
+        if self.held and not self.hold():
+            self.held = False
+            self.wake()
+
+    def fetch_next_item(self):
+        if self.peephole is not None:
+            # Report the job just finished.
+            bytes_in, bytes_out = self.peephole.bytes_in, self.peephole.bytes_out
+            self.report_peephole(bytes_in - self.peephole_reported[0], bytes_out - self.peephole_reported[1])
+            self.peephole_reported = bytes_in, bytes_out
+        if self.jog_model.jogs:
+            self.report_jog(*self.jog_model.summary())
+            self.jog_model.reset()
+        if self.device.precompile:
+            element = self.device.spooler.peek()
+            if hasattr(element, 'generate') and self.compile_operation(element):
+                self.device.spooler.pop()
+                return
+        Interpreter.fetch_next_item(self)
+
+    def compile_operation(self, operation):
+        """
+        Sends the operation to the compiler process, to be compiled from the current state. If the code for the
+        operation and state is cached, the cached code is streamed instead.
+
+        :return: False if the operation cannot be compiled out of process.
+        """
+        from LhystudiosCompiler import CompilerProcess, CompiledJob, interpreter_state, device_settings, compile_key
+        state = interpreter_state(self)
+        settings = device_settings(self.device)
+        cache = self.open_compile_cache()
+        key = None
+        if cache is not None:
+            key = compile_key(operation, state, settings)
+            entry = cache.get(key) if key is not None else None
+            if entry is not None:
+                data, metadata = entry
+                self.compiled = CompiledJob(0, operation, data, metadata['state'])
+                return True
+        if self.compiler is None or not self.compiler.is_alive():
+            compiler = CompilerProcess()
+            try:
+                compiler.start()
+            except ConnectionRefusedError:
+                return False
+            self.compiler = compiler
+        try:
+            self.compiled = self.compiler.compile(operation, state, settings)
+        except OSError:
+            return False
+        if key is not None:
+            self.compiled.key = key
+            self.compiled.code = bytearray()
+        return True
+
+    def open_compile_cache(self):
+        """
+        :return: the compile cache, or None if caching is disabled.
+        """
+        if not self.device.compile_cache:
+            self.compile_cache = None
+            return None
+        max_size = self.device.compile_cache_size * 1024 * 1024
+        if self.compile_cache is None or self.compile_cache.directory != self.device.compile_cache_dir:
+            from CompileCache import CompileCache
+            self.compile_cache = CompileCache(self.device.compile_cache_dir, max_size)
+            self.device.compile_cache_dir = self.compile_cache.directory
+        self.compile_cache.max_size = max_size
+        return self.compile_cache
+
+    def stream_compiled(self):
+        """
+        Writes the compiled code to the pipe, as far as the hold allows. Once all the code is sent, the interpreter
+        takes the final state of the compiled operation.
+        """
+        job = self.compiled
+        if job.state is None and not self.compiler.receive(job):
+            job.error = "Compiler process has gone away."
+        if job.code is not None and (self.compile_cache is None or len(job.code) > self.compile_cache.max_size):
+            job.code = None  # Too large to be cached.
+        while len(job.data) and not self.hold():
+            self.pipe.write(job.read(CODE_FLUSH_SIZE))
+        self.device.signal('interpreter;compile', (job.compiled, job.sent, job.state is not None))
+        if job.error is not None:
+            self.compiled = None
+            if job.sent == 0:
+                # Nothing was sent, the operation is interpreted here instead.
+                self.spooled_item = job.operation.generate(rapid=self.device.opt_rapid_between,
+                                                           jog=self.device.opt_jog_mode,
+                                                           rapid_speed=self.device.jog_rapid_speed)
+            else:
+                self.reset()
+            return
+        if job.finished():
+            from LhystudiosCompiler import restore_interpreter_state
+            self.compiled = None
+            if job.code is not None and self.compile_cache is not None:
+                self.compile_cache.put(job.key, bytes(job.code), dict(state=job.state, start=(
+                    self.device.current_x, self.device.current_y)))
+            restore_interpreter_state(self, job.state)
+            if 'peephole' in job.state:
+                self.report_peephole(*job.state['peephole'])
+            if 'jog' in job.state:
+                self.report_jog(*job.state['jog'])
+            self.device.signal('interpreter;mode', self.state)
+            self.device.signal('interpreter;position', (self.device.current_x, self.device.current_y,
+                                                        self.device.current_x, self.device.current_y))
+
+    def wait_finish(self, *values):
+        self.flush()
+        Interpreter.wait_finish(self, *values)
 
     def execute(self):
         if self.hold():
             return
         while self.plot is not None:
-            if self.hold():
+            if self.hold() or self.slice_spent():
                 return
             sx = self.device.current_x
             sy = self.device.current_y
@@ -236,40 +750,48 @@ class LhymicroInterpreter(Interpreter):
                 if self.raster_step != 0:
                     if self.is_prop(DIRECTION_FLAG_X):
                         if dy != 0:
-                            if self.is_prop(DIRECTION_FLAG_TOP):
-                                if abs(dy) > self.raster_step:
-                                    self.ensure_finished_mode()
-                                    self.move_relative(0, dy + self.raster_step)
-                                    self.set_prop(DIRECTION_FLAG_X)
-                                    self.unset_prop(DIRECTION_FLAG_Y)
-                                    self.ensure_program_mode()
-                                self.h_switch()
-                            else:
-                                if abs(dy) > self.raster_step:
-                                    self.ensure_finished_mode()
-                                    self.move_relative(0, dy - self.raster_step)
-                                    self.set_prop(DIRECTION_FLAG_X)
-                                    self.unset_prop(DIRECTION_FLAG_Y)
-                                    self.ensure_program_mode()
-                                self.h_switch()
+                            if abs(dy) > self.raster_step:
+                                left = self.is_prop(DIRECTION_FLAG_LEFT)
+                                top = self.is_prop(DIRECTION_FLAG_TOP)
+                                self.ensure_finished_mode()
+                                fold = 0
+                                if self.fold_jumps:
+                                    fold = self.fold_jump(x, y, 0, 1 if left else -1)
+                                if top:
+                                    self.move_relative(fold, dy + self.raster_step)
+                                else:
+                                    self.move_relative(fold, dy - self.raster_step)
+                                x += fold
+                                self.set_prop(DIRECTION_FLAG_X)
+                                self.unset_prop(DIRECTION_FLAG_Y)
+                                if left:
+                                    self.set_prop(DIRECTION_FLAG_LEFT)
+                                else:
+                                    self.unset_prop(DIRECTION_FLAG_LEFT)
+                                self.ensure_program_mode()
+                            self.h_switch()
                     elif self.is_prop(DIRECTION_FLAG_Y):
                         if dx != 0:
-                            if self.is_prop(DIRECTION_FLAG_LEFT):
-                                if abs(dx) > self.raster_step:
-                                    self.ensure_finished_mode()
-                                    self.move_relative(dx + self.raster_step, 0)
-                                    self.set_prop(DIRECTION_FLAG_Y)
-                                    self.unset_prop(DIRECTION_FLAG_X)
-                                    self.ensure_program_mode()
-                                self.v_switch()
-                            else:
-                                if abs(dx) > self.raster_step:
-                                    self.ensure_finished_mode()
-                                    self.move_relative(dx - self.raster_step, 0)
-                                    self.set_prop(DIRECTION_FLAG_Y)
-                                    self.unset_prop(DIRECTION_FLAG_X)
-                                    self.ensure_program_mode()
-                                self.v_switch()
+                            if abs(dx) > self.raster_step:
+                                left = self.is_prop(DIRECTION_FLAG_LEFT)
+                                top = self.is_prop(DIRECTION_FLAG_TOP)
+                                self.ensure_finished_mode()
+                                fold = 0
+                                if self.fold_jumps:
+                                    fold = self.fold_jump(x, y, 1, 1 if top else -1)
+                                if left:
+                                    self.move_relative(dx + self.raster_step, fold)
+                                else:
+                                    self.move_relative(dx - self.raster_step, fold)
+                                y += fold
+                                self.set_prop(DIRECTION_FLAG_Y)
+                                self.unset_prop(DIRECTION_FLAG_X)
+                                if top:
+                                    self.set_prop(DIRECTION_FLAG_TOP)
+                                else:
+                                    self.unset_prop(DIRECTION_FLAG_TOP)
+                                self.ensure_program_mode()
+                            self.v_switch()
                 self.goto_octent_abs(x, y, on)
             except StopIteration:
                 self.plot = None
@@ -279,6 +801,34 @@ class LhymicroInterpreter(Interpreter):
                 return
         Interpreter.execute(self)
 
+    def fold_jump(self, x, y, axis, sweep):
+        """
+        Takes the blank moves along the scanline that follow a raster jump to (x, y), so they are made within the
+        jump rather than in program mode. Moves in the direction of the coming sweep are taken short by the overscan,
+        leaving room to accelerate into the scanline.
+
+        :param x: x of the jump
+        :param y: y of the jump
+        :param axis: 0 for scanlines along x, 1 for scanlines along y.
+        :param sweep: direction of the coming sweep along the scanline, 1 or -1.
+        :return: distance along the scanline to move within the jump.
+        """
+        position = (x, y)[axis]
+        line = (x, y)[1 - axis]
+        end = position
+        for event in self.plot:
+            if event[2] or event[1 - axis] != line or (event[axis] - end) * (end - position) < 0:
+                self.plot = chain((event,), self.plot)
+                break
+            end = event[axis]
+        fold = end - position
+        if fold * sweep > 0:
+            fold -= sweep * min(abs(fold), int(round(self.overscan)))
+            if fold != end - position:
+                remaining = (end, line, 0) if axis == 0 else (line, end, 0)
+                self.plot = chain((remaining,), self.plot)
+        return fold
+
     def plot_path(self, path):
         """
         Set the self.plot object with the given path.
@@ -305,7 +855,13 @@ class LhymicroInterpreter(Interpreter):
         self.plot = self.convert_to_wrapped_plot(ZinglPlotter.plot_path(path), True, self.device.current_x, self.device.current_y)
 
     def plot_raster(self, raster):
-        self.plot = self.convert_to_wrapped_plot(ZinglPlotter.singles(raster.plot()), True, self.device.current_x, self.device.current_y)
+        self.fold_jumps = raster.jumps  # Decided by the operation, LaserOperation.raster_jumps().
+        if self.group_modulation:
+            # Group modulation shifts single pixels, it needs the single stepped plots.
+            self.plot = self.convert_to_wrapped_plot(ZinglPlotter.singles(raster.plot()), True,
+                                                     self.device.current_x, self.device.current_y)
+            return
+        self.plot = self.convert_to_raster_runs(raster.plot(), self.device.current_x, self.device.current_y)
 
     def set_directions(self, left, top, x_dir, y_dir):
         # Left, Top, X-Momentum, Y-Momentum
@@ -335,8 +891,13 @@ class LhymicroInterpreter(Interpreter):
 
     def reset(self):
         Interpreter.reset(self)
-        self.pipe._buffer = b''
-        self.pipe._queue = b''
+        del self._code[:]
+        if self.peephole is not None:
+            self.peephole.clear()
+        if self.compiled is not None:
+            self.compiler.cancel(self.compiled)
+            self.compiled = None
+        self.pipe.clear_buffers()
         self.device.signal('pipe;buffer', 0)
         self.plot = None
         self.pipe.realtime_write(b'I*\n')
@@ -369,6 +930,8 @@ class LhymicroInterpreter(Interpreter):
         dx = int(round(dx))
         dy = int(round(dy))
         if abs(dx) >= min_jog or abs(dy) >= min_jog:
+            if mode == 3:
+                mode = self.choose_jog_mode(dx, dy)
             if mode == 0:
                 self.jog_event(dx, dy)
             elif mode == 1:
@@ -378,6 +941,19 @@ class LhymicroInterpreter(Interpreter):
                 self.move_relative(dx, dy)
                 self.ensure_program_mode(direction=direction)
 
+    def choose_jog_mode(self, dx, dy):
+        """
+        Chooses the jog mode estimated to be fastest for the jog, from the current speed.
+        """
+        model = self.jog_model
+        device = self.device
+        model.rapid_speed = device.jog_rapid_speed
+        model.event_time = device.jog_event_time / 1000.0
+        model.switch_time = device.jog_switch_time / 1000.0
+        model.finish_time = device.jog_finish_time / 1000.0
+        speed, accel = model.program_speed(device.board, self.speed, self.acceleration)
+        return model.choose(abs(dx) + abs(dy), speed, accel)
+
     def jog_event(self, dx=0, dy=0):
         dx = int(round(dx))
         dy = int(round(dy))
@@ -385,21 +961,21 @@ class LhymicroInterpreter(Interpreter):
         self.laser = False
         if self.is_prop(DIRECTION_START_X):
             if not self.is_left and dx >= 0:
-                self.pipe.write(self.CODE_LEFT)
+                self.write(self.CODE_LEFT)
             if not self.is_right and dx <= 0:
-                self.pipe.write(self.CODE_RIGHT)
+                self.write(self.CODE_RIGHT)
         if self.is_prop(DIRECTION_START_Y):
             if not self.is_top and dy >= 0:
-                self.pipe.write(self.CODE_TOP)
+                self.write(self.CODE_TOP)
             if not self.is_bottom and dy <= 0:
-                self.pipe.write(self.CODE_BOTTOM)
-        self.pipe.write(b'N')
+                self.write(self.CODE_BOTTOM)
+        self.write(b'N')
         if dy != 0:
             self.goto_y(dy)
         if dx != 0:
             self.goto_x(dx)
-        self.pipe.write(b'SE')
-        self.pipe.write(self.code_declare_directions())
+        self.write(b'SE')
+        self.write(self.code_declare_directions())
         self.state = INTERPRETER_STATE_PROGRAM
 
     def move(self, x, y):
@@ -452,14 +1028,14 @@ class LhymicroInterpreter(Interpreter):
         dx = int(round(dx))
         dy = int(round(dy))
         if self.state == INTERPRETER_STATE_RAPID:
-            self.pipe.write(b'I')
+            self.write(b'I')
             if dx != 0:
                 self.goto_x(dx)
             if dy != 0:
                 self.goto_y(dy)
-            self.pipe.write(b'S1P\n')
+            self.write(b'S1P\n')
             if not self.device.autolock:
-                self.pipe.write(b'IS2P\n')
+                self.write(b'IS2P\n')
         elif self.state == INTERPRETER_STATE_PROGRAM:
             mx = 0
             my = 0
@@ -472,7 +1048,7 @@ class LhymicroInterpreter(Interpreter):
                 self.goto_x(dx)
             if dy != 0:
                 self.goto_y(dy)
-            self.pipe.write(b'N')
+            self.write(b'N')
         self.check_bounds()
         self.device.signal('interpreter;position', (self.device.current_x, self.device.current_y,
                                                     self.device.current_x - dx, self.device.current_y - dy))
@@ -544,49 +1120,46 @@ class LhymicroInterpreter(Interpreter):
     def laser_off(self):
         if not self.laser:
             return False
-        controller = self.pipe
         if self.state == INTERPRETER_STATE_RAPID:
-            controller.write(b'I')
-            controller.write(self.CODE_LASER_OFF)
-            controller.write(b'S1P\n')
+            self.write(b'I')
+            self.write(self.CODE_LASER_OFF)
+            self.write(b'S1P\n')
             if not self.device.autolock:
-                controller.write(b'IS2P\n')
+                self.write(b'IS2P\n')
         elif self.state == INTERPRETER_STATE_PROGRAM:
-            controller.write(self.CODE_LASER_OFF)
+            self.write(self.CODE_LASER_OFF)
         elif self.state == INTERPRETER_STATE_FINISH:
-            controller.write(self.CODE_LASER_OFF)
-            controller.write(b'N')
+            self.write(self.CODE_LASER_OFF)
+            self.write(b'N')
         self.laser = False
         return True
 
     def laser_on(self):
         if self.laser:
             return False
-        controller = self.pipe
         if self.state == INTERPRETER_STATE_RAPID:
-            controller.write(b'I')
-            controller.write(self.CODE_LASER_ON)
-            controller.write(b'S1P\n')
+            self.write(b'I')
+            self.write(self.CODE_LASER_ON)
+            self.write(b'S1P\n')
             if not self.device.autolock:
-                controller.write(b'IS2P\n')
+                self.write(b'IS2P\n')
         elif self.state == INTERPRETER_STATE_PROGRAM:
-            controller.write(self.CODE_LASER_ON)
+            self.write(self.CODE_LASER_ON)
         elif self.state == INTERPRETER_STATE_FINISH:
-            controller.write(self.CODE_LASER_ON)
-            controller.write(b'N')
+            self.write(self.CODE_LASER_ON)
+            self.write(b'N')
         self.laser = True
         return True
 
     def ensure_rapid_mode(self):
         if self.state == INTERPRETER_STATE_RAPID:
             return
-        controller = self.pipe
         if self.state == INTERPRETER_STATE_FINISH:
-            controller.write(b'S1P\n')
+            self.write(b'S1P\n')
             if not self.device.autolock:
-                controller.write(b'IS2P\n')
+                self.write(b'IS2P\n')
         elif self.state == INTERPRETER_STATE_PROGRAM:
-            controller.write(b'FNSE-\n')
+            self.write(b'FNSE-\n')
             self.reset_modes()
         self.state = INTERPRETER_STATE_RAPID
         self.device.signal('interpreter;mode', self.state)
@@ -594,7 +1167,7 @@ class LhymicroInterpreter(Interpreter):
     def fly_switch_speed(self, dx=0, dy=0):
         dx = int(round(dx))
         dy = int(round(dy))
-        self.pipe.write(b'@NSE')
+        self.write(b'@NSE')
         self.state = INTERPRETER_STATE_RAPID
         speed_code = LaserSpeed(
             self.device.board,
@@ -610,38 +1183,36 @@ class LhymicroInterpreter(Interpreter):
             speed_code = bytes(speed_code)
         except TypeError:
             speed_code = bytes(speed_code, 'utf8')
-        self.pipe.write(speed_code)
+        self.write(speed_code)
         if dx != 0:
             self.goto_x(dx)
         if dy != 0:
             self.goto_y(dy)
-        self.pipe.write(b'N')
+        self.write(b'N')
         if self.is_prop(DIRECTION_FLAG_X):
             self.set_prop(DIRECTION_START_X)
             self.unset_prop(DIRECTION_START_Y)
         else:
             self.unset_prop(DIRECTION_START_X)
             self.set_prop(DIRECTION_START_Y)
-        self.pipe.write(self.code_declare_directions())
-        self.pipe.write(b'S1E')
+        self.write(self.code_declare_directions())
+        self.write(b'S1E')
         self.state = INTERPRETER_STATE_PROGRAM
 
     def ensure_finished_mode(self):
         if self.state == INTERPRETER_STATE_FINISH:
             return
-        controller = self.pipe
         if self.state == INTERPRETER_STATE_PROGRAM:
-            controller.write(b'@NSE')
+            self.write(b'@NSE')
             self.reset_modes()
         elif self.state == INTERPRETER_STATE_RAPID:
-            controller.write(b'I')
+            self.write(b'I')
         self.state = INTERPRETER_STATE_FINISH
         self.device.signal('interpreter;mode', self.state)
 
     def ensure_program_mode(self, direction=None):
         if self.state == INTERPRETER_STATE_PROGRAM:
             return
-        controller = self.pipe
         self.ensure_finished_mode()
 
         speed_code = LaserSpeed(
@@ -658,8 +1229,8 @@ class LhymicroInterpreter(Interpreter):
             speed_code = bytes(speed_code)
         except TypeError:
             speed_code = bytes(speed_code, 'utf8')
-        controller.write(speed_code)
-        controller.write(b'N')
+        self.write(speed_code)
+        self.write(b'N')
         if direction is not None and direction != 0:
             if direction == 1:
                 self.unset_prop(DIRECTION_FLAG_X)
@@ -684,17 +1255,16 @@ class LhymicroInterpreter(Interpreter):
             self.unset_prop(DIRECTION_START_X)
             self.set_prop(DIRECTION_START_Y)
         self.declare_directions()
-        controller.write(b'S1E')
+        self.write(b'S1E')
         self.state = INTERPRETER_STATE_PROGRAM
         self.device.signal('interpreter;mode', self.state)
 
     def h_switch(self):
-        controller = self.pipe
         if self.is_prop(DIRECTION_FLAG_LEFT):
-            controller.write(self.CODE_RIGHT)
+            self.write(self.CODE_RIGHT)
             self.unset_prop(DIRECTION_FLAG_LEFT)
         else:
-            controller.write(self.CODE_LEFT)
+            self.write(self.CODE_LEFT)
             self.set_prop(DIRECTION_FLAG_LEFT)
         if self.is_prop(DIRECTION_FLAG_TOP):
             self.device.current_y -= self.raster_step
@@ -703,12 +1273,11 @@ class LhymicroInterpreter(Interpreter):
         self.laser = False
 
     def v_switch(self):
-        controller = self.pipe
         if self.is_prop(DIRECTION_FLAG_TOP):
-            controller.write(self.CODE_BOTTOM)
+            self.write(self.CODE_BOTTOM)
             self.unset_prop(DIRECTION_FLAG_TOP)
         else:
-            controller.write(self.CODE_TOP)
+            self.write(self.CODE_TOP)
             self.set_prop(DIRECTION_FLAG_TOP)
         if self.is_prop(DIRECTION_FLAG_LEFT):
             self.device.current_x -= self.raster_step
@@ -727,9 +1296,8 @@ class LhymicroInterpreter(Interpreter):
 
     def home(self):
         x, y = self.calc_home_position()
-        controller = self.pipe
         self.ensure_rapid_mode()
-        controller.write(b'IPP\n')
+        self.write(b'IPP\n')
         old_x = self.device.current_x
         old_y = self.device.current_y
         self.device.current_x = x
@@ -749,18 +1317,15 @@ class LhymicroInterpreter(Interpreter):
         self.device.signal('interpreter;position', (self.device.current_x, self.device.current_y, old_x, old_y))
 
     def lock_rail(self):
-        controller = self.pipe
         self.ensure_rapid_mode()
-        controller.write(b'IS1P\n')
+        self.write(b'IS1P\n')
 
     def unlock_rail(self, abort=False):
-        controller = self.pipe
         self.ensure_rapid_mode()
-        controller.write(b'IS2P\n')
+        self.write(b'IS2P\n')
 
     def abort(self):
-        controller = self.pipe
-        controller.write(b'I\n')
+        self.write(b'I\n')
 
     def check_bounds(self):
         self.min_x = min(self.min_x, self.device.current_x)
@@ -775,9 +1340,9 @@ class LhymicroInterpreter(Interpreter):
     def goto_x(self, dx):
         if dx == 0:
             if self.is_prop(DIRECTION_FLAG_LEFT):
-                self.pipe.write(self.CODE_LEFT)
+                self.write(self.CODE_LEFT)
             else:
-                self.pipe.write(self.CODE_RIGHT)
+                self.write(self.CODE_RIGHT)
         elif dx > 0:
             self.move_right(dx)
         else:
@@ -786,46 +1351,44 @@ class LhymicroInterpreter(Interpreter):
     def goto_y(self, dy):
         if dy == 0:
             if self.is_prop(DIRECTION_FLAG_TOP):
-                self.pipe.write(self.CODE_TOP)
+                self.write(self.CODE_TOP)
             else:
-                self.pipe.write(self.CODE_BOTTOM)
+                self.write(self.CODE_BOTTOM)
         elif dy > 0:
             self.move_bottom(dy)
         else:
             self.move_top(dy)
 
     def goto_angle(self, dx, dy):
-        controller = self.pipe
         if abs(dx) != abs(dy):
             raise ValueError('abs(dx) must equal abs(dy)')
         self.set_prop(DIRECTION_FLAG_X)  # Set both on
         self.set_prop(DIRECTION_FLAG_Y)
         if dx > 0:  # Moving right
             if self.is_prop(DIRECTION_FLAG_LEFT):
-                controller.write(self.CODE_RIGHT)
+                self.write(self.CODE_RIGHT)
                 self.unset_prop(DIRECTION_FLAG_LEFT)
         else:  # Moving left
             if not self.is_prop(DIRECTION_FLAG_LEFT):
-                controller.write(self.CODE_LEFT)
+                self.write(self.CODE_LEFT)
                 self.set_prop(DIRECTION_FLAG_LEFT)
         if dy > 0:  # Moving bottom
             if self.is_prop(DIRECTION_FLAG_TOP):
-                controller.write(self.CODE_BOTTOM)
+                self.write(self.CODE_BOTTOM)
                 self.unset_prop(DIRECTION_FLAG_TOP)
         else:  # Moving top
             if not self.is_prop(DIRECTION_FLAG_TOP):
-                controller.write(self.CODE_TOP)
+                self.write(self.CODE_TOP)
                 self.set_prop(DIRECTION_FLAG_TOP)
         self.device.current_x += dx
         self.device.current_y += dy
         self.check_bounds()
-        controller.write(self.CODE_ANGLE + lhymicro_distance(abs(dy)))
+        self.write(self.CODE_ANGLE + lhymicro_distance(abs(dy)))
 
     def declare_directions(self):
         """Declare direction declares raster directions of left, top, with the primary momentum direction going last.
         You cannot declare a diagonal direction."""
-        controller = self.pipe
-        controller.write(self.code_declare_directions())
+        self.write(self.code_declare_directions())
 
     def code_declare_directions(self):
         if self.is_prop(DIRECTION_FLAG_LEFT):
@@ -891,43 +1454,39 @@ class LhymicroInterpreter(Interpreter):
         self.unset_prop(DIRECTION_FLAG_TOP)
 
     def move_right(self, dx=0):
-        controller = self.pipe
         self.device.current_x += dx
         if not self.is_right or self.state != INTERPRETER_STATE_PROGRAM:
-            controller.write(self.CODE_RIGHT)
+            self.write(self.CODE_RIGHT)
             self.set_right()
         if dx != 0:
-            controller.write(lhymicro_distance(abs(dx)))
+            self.write(lhymicro_distance(abs(dx)))
             self.check_bounds()
 
     def move_left(self, dx=0):
-        controller = self.pipe
         self.device.current_x -= abs(dx)
         if not self.is_left or self.state != INTERPRETER_STATE_PROGRAM:
-            controller.write(self.CODE_LEFT)
+            self.write(self.CODE_LEFT)
             self.set_left()
         if dx != 0:
-            controller.write(lhymicro_distance(abs(dx)))
+            self.write(lhymicro_distance(abs(dx)))
             self.check_bounds()
 
     def move_bottom(self, dy=0):
-        controller = self.pipe
         self.device.current_y += dy
         if not self.is_bottom or self.state != INTERPRETER_STATE_PROGRAM:
-            controller.write(self.CODE_BOTTOM)
+            self.write(self.CODE_BOTTOM)
             self.set_bottom()
         if dy != 0:
-            controller.write(lhymicro_distance(abs(dy)))
+            self.write(lhymicro_distance(abs(dy)))
             self.check_bounds()
 
     def move_top(self, dy=0):
-        controller = self.pipe
         self.device.current_y -= abs(dy)
         if not self.is_top or self.state != INTERPRETER_STATE_PROGRAM:
-            controller.write(self.CODE_TOP)
+            self.write(self.CODE_TOP)
             self.set_top()
         if dy != 0:
-            controller.write(lhymicro_distance(abs(dy)))
+            self.write(lhymicro_distance(abs(dy)))
             self.check_bounds()
 
     def convert_to_wrapped_plot(self, generate, cut, sx, sy):
@@ -948,6 +1507,85 @@ class LhymicroInterpreter(Interpreter):
             generate = ZinglPlotter.off(generate)
         return ZinglPlotter.groups(sx, sy, generate)
 
+    def convert_to_raster_runs(self, generate, sx, sy):
+        """
+        Converts the orthogonal spans of a raster plot directly into grouped plots. This gives the same plots as
+        convert_to_wrapped_plot(ZinglPlotter.singles(generate), True, sx, sy) without expanding each span into single
+        steps and merging them back together.
+
+        PPI is applied per span. Spans at full or zero power are a single run, only spans with fractional power count
+        their pulses step by step.
+
+        :param generate: generator of x, y, on orthogonal or diagonal spans.
+        :param sx: Start x position
+        :param sy: Start y position
+        :return: Grouped plots.
+        """
+        last_x = sx
+        last_y = sy
+        last_on = 0
+        dx = 0
+        dy = 0
+        current_x = None
+        current_y = None
+        for next_x, next_y, value in generate:
+            if current_x is None:
+                # The first plot is a single event at its position.
+                step_x = next_x - sx
+                step_y = next_y - sy
+                count = 1
+            else:
+                total_dx = next_x - current_x
+                total_dy = next_y - current_y
+                step_x = (total_dx > 0) - (total_dx < 0)
+                step_y = (total_dy > 0) - (total_dy < 0)
+                if total_dy * step_x != total_dx * step_y:
+                    raise ValueError("Must be uniformly diagonal or orthogonal: (%d, %d) is not." % (total_dx, total_dy))
+                count = max(abs(total_dx), abs(total_dy))
+            current_x = next_x
+            current_y = next_y
+            if count == 0:
+                continue
+
+            pulse = self.current_ppi() * value
+            pulse_total = self.pulse_total
+            if pulse == 0 and pulse_total < 1000.0:
+                runs = ((count, 0),)
+            elif pulse == 1000.0 and pulse_total == 0.0:
+                runs = ((count, 1),)
+            else:
+                runs = []
+                run = 0
+                run_on = None
+                for i in range(count):
+                    pulse_total += pulse
+                    if pulse_total >= 1000.0:
+                        on = 1
+                        pulse_total -= 1000.0
+                    else:
+                        on = 0
+                    if on == run_on:
+                        run += 1
+                        continue
+                    if run:
+                        runs.append((run, run_on))
+                    run = 1
+                    run_on = on
+                runs.append((run, run_on))
+                self.pulse_total = pulse_total
+
+            for run, on in runs:
+                if step_x != dx or step_y != dy or on != last_on:
+                    yield last_x, last_y, last_on
+                    if abs(step_x) > 1 or abs(step_y) > 1:
+                        raise ValueError("dx(%d) or dy(%d) exceeds 1" % (step_x, step_y))
+                    dx = step_x
+                    dy = step_y
+                    last_on = on
+                last_x += step_x * run
+                last_y += step_y * run
+        yield last_x, last_y, last_on
+
     def current_ppi(self):
         """
         This is recalculated repeatedly because there is a change the value of the power
@@ -1040,6 +1678,334 @@ def onewire_crc_lookup(line):
     return crc
 
 
+# Full byte table, folding both nibble lookups of crc_table into a single lookup.
+crc_table_256 = [crc_table[i & 0x0f] ^ crc_table[16 + ((i >> 4) & 0x0f)] for i in range(256)]
+
+
+def onewire_crc_frames(packets):
+    """
+    Bulk builds the USB frames for a list of 30 byte packets.
+
+    Each frame is b'\\x00' + packet + crc, with the crc calculated by onewire_crc_lookup.
+
+    :param packets: list of 30 byte packets.
+    :return: list of 32 byte frames.
+    """
+    table = crc_table_256
+    frames = []
+    for packet in packets:
+        crc = 0
+        for b in packet:
+            crc = table[crc ^ b]
+        frames.append(b'\x00' + packet + bytes((crc,)))
+    return frames
+
+
+def open_driver(index=-1, bus=-1, address=-1, serial=-1, chipv=-1, mock=False, board='M2', state_listener=None):
+    """
+    Finds and opens a driver matching the criteria. The simulated board is used for mock, otherwise libusb is tried
+    followed by the windll CH341 driver.
+
+    :return: driver, driver state, chip version. The driver is None if no driver could be opened.
+    """
+    if state_listener is None:
+        state_listener = lambda code: None
+    if mock:
+        from CH341MockDriver import CH341Driver
+        driver = CH341Driver(index=index, bus=bus, address=address, serial=serial, chipv=chipv,
+                             state_listener=state_listener, board=board)
+        driver.open()
+        return driver, STATE_DRIVER_MOCK, driver.get_chip_version()
+    try:
+        from CH341LibusbDriver import CH341Driver
+        driver = CH341Driver(index=index, bus=bus, address=address, serial=serial, chipv=chipv,
+                             state_listener=state_listener)
+        driver.open()
+        return driver, STATE_DRIVER_LIBUSB, driver.get_chip_version()
+    except ConnectionRefusedError:
+        pass
+    except ImportError:
+        state_listener(STATE_DRIVER_NO_LIBUSB)
+    try:
+        from CH341WindllDriver import CH341Driver
+        driver = CH341Driver(index=index, bus=bus, address=address, serial=serial, chipv=chipv,
+                             state_listener=state_listener)
+        driver.open()
+        return driver, STATE_DRIVER_CH341, driver.get_chip_version()
+    except ConnectionRefusedError:
+        pass
+    return None, None, None
+
+
+def confirm_packet(read_status, poller, first=None):
+    """
+    Reads the status until the packet just sent is confirmed. This is tried 300 times, the first read is immediate
+    and the rest are paced by the poller. The first read may have been made along with the write.
+
+    A final status of OK confirms the packet. ERROR is a rejection if every read was flawless, otherwise the channel
+    had the error and the packet is assumed good. A status of 0 means no status could be read at all.
+
+    :param read_status: function returning the current status byte, may raise ConnectionError.
+    :param poller: StatusPoller pacing the reads.
+    :param first: status byte read along with the write, 0 if that read failed.
+    :return: final status, whether every read was flawless, whether FINISH was seen, whether BUSY was seen.
+    """
+    status = 0
+    flawless = True
+    finished = False
+    busy = False
+    poller.begin()
+    for attempts in range(300):
+        if attempts != 0:
+            poller.delay(status)
+        if attempts == 0 and first is not None:
+            if first == 0:
+                flawless = False
+                continue
+            status = first
+        else:
+            try:
+                status = read_status()
+            except ConnectionError:
+                # Errors are ignored, must confirm packet.
+                flawless = False
+                continue
+        if status == STATUS_OK:
+            # Packet was fine.
+            poller.record()
+            break
+        elif status == STATUS_ERROR:
+            break
+        elif status == STATUS_FINISH:
+            # We finished. This is not a confirmation.
+            finished = True
+        elif status == STATUS_BUSY:
+            # The board holds the packet until it has room for it.
+            busy = True
+        # Status 0 we did not read a status. Busy, we still do not have our confirmation.
+    return status, flawless, finished, busy
+
+
+class StatusPoller:
+    """
+    Paces the status reads made to the board.
+
+    Polling starts at the interval floor and backs off exponentially, up to the maximum interval, while the board
+    reports BUSY or has not yet reported FINISH. The floor adapts to a fraction of the median observed confirm
+    latency so that status reads are spent where the confirmation is likely to be. Confirm latencies are kept
+    for inspection.
+    """
+
+    def __init__(self, minimum=0.0002, maximum=0.02, backoff=2.0, history=512):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.floor = minimum
+        self.latencies = deque(maxlen=history)
+        self.polls = 0
+        self._interval = 0.0
+        self._start = 0.0
+        self._recorded = 0
+
+    def begin(self):
+        """
+        Starts a new wait, from the interval floor.
+        """
+        self._start = time.perf_counter()
+        self._interval = 0.0
+
+    def delay(self, status=STATUS_BUSY):
+        """
+        Sleeps before the next status read. Backs off while the board is busy or pending finish.
+
+        :param status: last status read.
+        """
+        if status in (STATUS_BUSY, STATUS_FINISH) or self._interval == 0.0:
+            self._interval = min(max(self._interval * self.backoff, self.floor), self.maximum)
+        else:
+            self._interval = self.floor
+        self.polls += 1
+        time.sleep(self._interval)
+
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def record(self):
+        """
+        Records the latency of the current wait, and periodically retunes the interval floor.
+        """
+        self.latencies.append(self.elapsed())
+        self._recorded += 1
+        if self._recorded % 32 == 0:
+            self.floor = min(max(self.percentile(50) / 4.0, self.minimum), self.maximum)
+
+    def percentile(self, percent):
+        if len(self.latencies) == 0:
+            return 0.0
+        latencies = sorted(self.latencies)
+        index = int(round((len(latencies) - 1) * percent / 100.0))
+        return latencies[index]
+
+
+class ControllerMetrics:
+    """
+    Rolling throughput and latency figures of the LhystudioController.
+
+    Rates are measured over the last window seconds. Confirm latencies are kept as a histogram. Time spent waiting on
+    the board is split into BUSY, waiting for the board to accept packets, and WAIT, waiting for the board to finish.
+    Underrun is the time the controller had nothing to send while a job was still active, meaning the host did not
+    produce data fast enough. The drain rate is the bytes per second the board takes while the controller has data
+    ready for it.
+    """
+
+    LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1)
+
+    def __init__(self, window=5.0):
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.started = time.perf_counter()
+        self.packets = 0
+        self.bytes = 0
+        self.latency_histogram = [0] * (len(self.LATENCY_BUCKETS) + 1)
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.busy_time = 0.0
+        self.wait_time = 0.0
+        self.underrun_time = 0.0
+        self.underruns = 0
+        self.drain_rate = None
+        self._drain_time = None
+        self._drain_bytes = 0
+        self._drain_pending = False
+        self.reconnects = 0
+        self.reconnect_time = 0.0
+        self.reconnect_max = 0.0
+        self._underrun_start = None
+        self._sent = deque()  # (time, bytes) of the packets within the window.
+
+    def packet(self, length, latency=None):
+        """
+        Records a confirmed packet.
+
+        :param length: buffer bytes held by the packet.
+        :param latency: seconds from the write until the packet was confirmed.
+        """
+        now = time.perf_counter()
+        self.packets += 1
+        self.bytes += length
+        sent = self._sent
+        sent.append((now, length))
+        while sent[0][0] < now - self.window:
+            sent.popleft()
+        if latency is not None:
+            self.latency_histogram[bisect_left(self.LATENCY_BUCKETS, latency)] += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+
+    def reconnected(self, seconds):
+        """
+        Records a reconnect, taking the given seconds from the connection error.
+        """
+        self.reconnects += 1
+        self.reconnect_time += seconds
+        self.reconnect_max = max(self.reconnect_max, seconds)
+
+    def underrun(self, empty):
+        """
+        Called with whether the controller was starved of data while a job was active.
+
+        :return: whether this began a new underrun.
+        """
+        if empty:
+            if self._underrun_start is None:
+                self._underrun_start = time.perf_counter()
+                self.underruns += 1
+                return True
+        elif self._underrun_start is not None:
+            self.underrun_time += time.perf_counter() - self._underrun_start
+            self._underrun_start = None
+        return False
+
+    def sample_drain(self, pending):
+        """
+        Samples the drain rate, called at a regular interval. Only intervals that began with data pending are
+        measured, a starved controller drains only as fast as the host writes.
+
+        :param pending: whether the controller is actively sending and holds data.
+        """
+        now = time.perf_counter()
+        if self._drain_pending:
+            elapsed = now - self._drain_time
+            if elapsed > 0:
+                rate = (self.bytes - self._drain_bytes) / elapsed
+                if self.drain_rate is None:
+                    self.drain_rate = rate
+                else:
+                    self.drain_rate += 0.2 * (rate - self.drain_rate)
+        self._drain_time = now
+        self._drain_bytes = self.bytes
+        self._drain_pending = pending
+
+    def rates(self):
+        """
+        :return: packets per second and bytes per second over the window.
+        """
+        now = time.perf_counter()
+        sent = [s for s in self._sent if s[0] >= now - self.window]
+        span = min(self.window, now - self.started)
+        if len(sent) == 0 or span <= 0:
+            return 0.0, 0.0
+        return len(sent) / span, sum(s[1] for s in sent) / span
+
+    def snapshot(self):
+        packets_per_second, bytes_per_second = self.rates()
+        underrun_time = self.underrun_time
+        if self._underrun_start is not None:
+            underrun_time += time.perf_counter() - self._underrun_start
+        count = sum(self.latency_histogram)
+        return {
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'packets_per_second': packets_per_second,
+            'bytes_per_second': bytes_per_second,
+            'latency_histogram': list(zip(self.LATENCY_BUCKETS + (float('inf'),), self.latency_histogram)),
+            'latency_mean': self.latency_total / count if count else 0.0,
+            'latency_max': self.latency_max,
+            'busy_time': self.busy_time,
+            'wait_time': self.wait_time,
+            'underrun_time': underrun_time,
+            'underruns': self.underruns,
+            'drain_rate': self.drain_rate,
+            'reconnects': self.reconnects,
+            'reconnect_time': self.reconnect_time,
+            'reconnect_max': self.reconnect_max,
+            'elapsed': time.perf_counter() - self.started,
+        }
+
+    def report(self):
+        """
+        :return: lines describing the current metrics.
+        """
+        m = self.snapshot()
+        yield 'Packets: %d (%.1f/s)' % (m['packets'], m['packets_per_second'])
+        yield 'Bytes: %d (%.1f/s)' % (m['bytes'], m['bytes_per_second'])
+        yield 'Confirm latency: mean %.2fms, max %.2fms' % (m['latency_mean'] * 1000.0, m['latency_max'] * 1000.0)
+        for edge, count in m['latency_histogram']:
+            if count:
+                if edge == float('inf'):
+                    yield '    >= %gms: %d' % (self.LATENCY_BUCKETS[-1] * 1000.0, count)
+                else:
+                    yield '    < %gms: %d' % (edge * 1000.0, count)
+        yield 'Busy: %.2fs, Wait: %.2fs, Underrun: %.2fs (%d times) of %.2fs' % \
+              (m['busy_time'], m['wait_time'], m['underrun_time'], m['underruns'], m['elapsed'])
+        if m['drain_rate'] is not None:
+            yield 'Drain rate: %.1f bytes/s' % m['drain_rate']
+        yield 'Reconnects: %d (%.1fms total, %.1fms max)' % \
+              (m['reconnects'], m['reconnect_time'] * 1000.0, m['reconnect_max'] * 1000.0)
+
+
 class LhystudioController(Module, Pipe):
     """
     K40 Controller controls the Lhystudios boards sending any queued data to the USB when the signal is not busy.
@@ -1061,32 +2027,63 @@ class LhystudioController(Module, Pipe):
         self.is_shutdown = False
 
         self._thread = None
-        self._buffer = b''  # Threadsafe buffered commands to be sent to controller.
-        self._realtime_buffer = b''  # Threadsafe realtime buffered commands to be sent to the controller.
-        self._queue = b''  # Thread-unsafe additional commands to append.
-        self._preempt = b''  # Thread-unsafe preempt commands to prepend to the buffer.
+        self._buffer = ChunkedBuffer()  # Threadsafe buffered commands to be sent to controller.
+        self._realtime_buffer = ChunkedBuffer()  # Threadsafe realtime buffered commands to be sent to the controller.
+        self._queue = ChunkedBuffer()  # Thread-unsafe additional commands to append.
+        self._preempt = ChunkedBuffer()  # Thread-unsafe preempt commands to prepend to the buffer.
         self._queue_lock = threading.Lock()
         self._preempt_lock = threading.Lock()
         self._main_lock = threading.Lock()
 
+        # Packetizer stage, turns the buffer into ready frames ahead of the send thread.
+        self._packetizer_thread = None
+        self._frames = deque()  # (packet, frame, length, pre_send_command, post_send_command)
+        self._frames_length = 0  # Number of buffer bytes held within the frames.
+        self._frames_lock = threading.Lock()
+        self._packetize_lock = threading.Lock()
+        self._packetize_event = threading.Event()
+        self._frame_event = threading.Event()
+        self.frames_max = 1024
+
         self._status = [0] * 6
         self._usb_state = -1
 
         self.driver = None
+        self.driver_mock = False
+        self.sender = None  # Sender process, when the send loop runs out of process.
+        self._sender_thread = None
+        self._sender_wait_state = None
+        self._disconnected = None  # Time of the last connection error, until reconnected.
         self.max_attempts = 5
         self.refuse_counts = 0
         self.connection_errors = 0
         self.count = 0
         self.pre_ok = False
+        self.confirm_poller = StatusPoller(minimum=0.0002, maximum=0.02)
+        self.wait_poller = StatusPoller(minimum=0.001, maximum=0.05)
+        self.finish_poller = StatusPoller(minimum=0.005, maximum=0.1)
+        self.metrics = ControllerMetrics()
+        self.watermark = None  # Auto-tuned buffer watermark, None until the drain rate is known.
+        self.drain_listener = None  # Called with the buffer length as the buffer changes.
 
         self.abort_waiting = False
         self.send_channel = None
         self.recv_channel = None
         self.pipe_channel = None
 
+        # Telemetry is coalesced and signalled by the scheduled job at a fixed rate.
+        self.process = self.update_telemetry
+        self.interval = 1.0 / 15.0
+        self._buffer_dirty = False
+        self._packet_dirty = False
+        self._status_dirty = False
+        self._last_packet = None
+        self._metrics_signalled = 0.0
+
     def initialize(self, channel=None):
         self.device.setting(int, 'packet_count', 0)
         self.device.setting(int, 'rejected_count', 0)
+        self.device.setting(bool, 'process_sender', False)
 
         self.device.control_instance_add("Connect_USB", self.open)
         self.device.control_instance_add("Disconnect_USB", self.close)
@@ -1099,6 +2096,8 @@ class LhystudioController(Module, Pipe):
 
         def abort_wait():
             self.abort_waiting = True
+            if self.sender is not None:
+                self.sender.abort_wait()
 
         self.device.control_instance_add("Wait Abort", abort_wait)
 
@@ -1113,8 +2112,14 @@ class LhystudioController(Module, Pipe):
             self.start()
 
         self.device.control_instance_add("Resume", resume_k40)
+        self.schedule()
+
+    def finalize(self, channel=None):
+        self.unschedule()
 
     def shutdown(self, channel=None):
+        self.close_sender()
+        self.update_telemetry()
         Module.shutdown(self, channel=channel)
 
     def __repr__(self):
@@ -1122,10 +2127,24 @@ class LhystudioController(Module, Pipe):
 
     def __len__(self):
         """Provides the length of the buffer of this device."""
-        return len(self._buffer) + len(self._queue) + len(self._preempt)
+        length = len(self._buffer) + len(self._queue) + len(self._preempt) + self._frames_length
+        if self.sender is not None:
+            length += self.sender.pending_bytes()
+        return length
 
     def open(self):
         self.pipe_channel("open()")
+        if self.device.process_sender:
+            if self.sender is None or not self.sender.is_alive():
+                self.open_sender()
+            if self.sender is not None:
+                return
+        elif self.sender is not None:
+            self.close_sender()
+        if self.driver is not None and self.driver_mock != self.device.mock:
+            # Mock setting changed, the driver must be replaced.
+            self.close()
+            self.driver = None
         if self.driver is None:
             self.detect_driver_and_open()
         else:
@@ -1138,11 +2157,130 @@ class LhystudioController(Module, Pipe):
             self.driver.open()
         if self.driver is None:
             raise ConnectionRefusedError
+        if self._disconnected is not None:
+            self.reconnected(time.perf_counter() - self._disconnected)
+
+    def reconnect(self):
+        """
+        Attempts the fast reconnect of the driver after a connection error. This reclaims the cached device without
+        enumerating or resetting the USB, so the head is not left idle for seconds mid-job.
+
+        :return: whether the driver reconnected, otherwise it must be closed and opened again.
+        """
+        self._disconnected = time.perf_counter()
+        if self.driver is None:
+            return False
+        try:
+            self.driver.reconnect()
+        except (ConnectionError, AttributeError):
+            return False
+        self.reconnected(time.perf_counter() - self._disconnected, True)
+        return True
+
+    def reconnected(self, seconds, fast=False):
+        self._disconnected = None
+        self.metrics.reconnected(seconds)
+        if fast:
+            self.usb_log("Reconnected in %.1fms." % (seconds * 1000.0))
+        else:
+            self.usb_log("Reopened in %.1fms." % (seconds * 1000.0))
 
     def close(self):
         self.pipe_channel("close()")
+        self.close_sender()
+        if self.driver is not None:
+            self.driver.close()
+
+    def open_sender(self):
+        """
+        Starts the sender process, which opens the driver and performs the send and confirm loop out of process.
+        Falls back to sending within this process if the sender cannot be started.
+        """
+        self.close_sender()
+        try:
+            from LhystudiosSender import SenderProcess
+        except ImportError:
+            self.usb_log("Sender process requires multiprocessing.shared_memory.")
+            return
         if self.driver is not None:
             self.driver.close()
+            self.driver = None
+        criteria = dict(index=self.device.usb_index, bus=self.device.usb_bus, address=self.device.usb_address,
+                        serial=self.device.usb_serial, chipv=self.device.usb_version,
+                        mock=self.device.mock, board=self.device.board)
+        sender = SenderProcess(criteria)
+        try:
+            sender.start()
+        except ConnectionRefusedError:
+            self.usb_log("Sender process could not be started.")
+            return
+        sender.set_paused(self.state in (STATE_PAUSE, STATE_BUSY))
+        self.sender = sender
+        self._sender_thread = self.device.threaded(self._thread_sender_receive)
+
+    def close_sender(self):
+        sender = self.sender
+        if sender is None:
+            return
+        self.sender = None
+        sender.stop()
+        if self._sender_thread is not None and self._sender_thread is not threading.current_thread():
+            self._sender_thread.join()
+        self._sender_thread = None
+
+    def _thread_sender_receive(self):
+        """
+        Threaded function relaying the messages of the sender process.
+        """
+        sender = self.sender
+        while sender is self.sender and sender.is_alive():
+            message = sender.receive(0.5)
+            if message is not None:
+                self.sender_message(*message)
+        while True:
+            message = sender.receive(0)
+            if message is None:
+                break
+            self.sender_message(*message)
+
+    def sender_message(self, message, *values):
+        if message == 'packet':
+            packet, length, latency, busy = values
+            self.device.packet_count += 1
+            self.metrics.packet(length, latency)
+            self.metrics.busy_time += busy
+            self.update_packet(packet)
+            self.update_buffer()
+        elif message == 'status':
+            self._status = values[0]
+            self._status_dirty = True
+            if self.is_watched('recv'):
+                self.recv_channel(str(self._status))
+        elif message == 'rejected':
+            self.device.rejected_count += 1
+        elif message == 'wait':
+            self.device.signal('pipe;wait', *values)
+        elif message == 'waiting':
+            if values[0]:
+                self._sender_wait_state = self.state
+                self.update_state(STATE_WAIT)
+            else:
+                self.metrics.wait_time += values[1]
+                if self._sender_wait_state is not None:
+                    self.update_state(self._sender_wait_state)
+                    self._sender_wait_state = None
+        elif message == 'usb':
+            self.update_usb_state(values[0])
+        elif message == 'chipv':
+            self.device.signal('pipe;chipv', values[0])
+        elif message == 'reconnected':
+            self.reconnected(values[0], values[1])
+        elif message == 'connection_error':
+            self.connection_errors += 1
+        elif message == 'error':
+            # Sender was refused too many times.
+            self.update_state(STATE_TERMINATE)
+            self.device.signal('pipe;error', values[0])
 
     def write(self, bytes_to_write):
         """
@@ -1151,11 +2289,13 @@ class LhystudioController(Module, Pipe):
         :param bytes_to_write: data to write to the queue.
         :return:
         """
-        self.pipe_channel("write(%s)" % str(bytes_to_write))
+        if self.is_watched('pipe'):
+            self.pipe_channel("write(%s)" % str(bytes_to_write))
         self._queue_lock.acquire(True)
-        self._queue += bytes_to_write
+        self._queue.append(bytes_to_write)
         self._queue_lock.release()
         self.start()
+        self._packetize_event.set()
         self.update_buffer()
         return self
 
@@ -1167,11 +2307,13 @@ class LhystudioController(Module, Pipe):
         :param bytes_to_write: data to write to the front of the queue.
         :return:
         """
-        self.pipe_channel("realtime_write(%s)" % str(bytes_to_write))
+        if self.is_watched('pipe'):
+            self.pipe_channel("realtime_write(%s)" % str(bytes_to_write))
         self._preempt_lock.acquire(True)
-        self._preempt = bytes_to_write + self._preempt
+        self._preempt.prepend(bytes_to_write)
         self._preempt_lock.release()
         self.start()
+        self._frame_event.set()
         self.update_buffer()
         return self
 
@@ -1183,6 +2325,8 @@ class LhystudioController(Module, Pipe):
         if self._thread is None or not self._thread.is_alive():
             self._thread = self.device.threaded(self._thread_data_send)
             self.update_state(STATE_INITIALIZE)
+        if self._packetizer_thread is None or not self._packetizer_thread.is_alive():
+            self._packetizer_thread = self.device.threaded(self._thread_packetizer)
 
     def _pause_busy(self):
         """
@@ -1226,11 +2370,25 @@ class LhystudioController(Module, Pipe):
             self.update_state(STATE_ACTIVE)
 
     def abort(self):
-        self._buffer = b''
-        self._queue = b''
-        self.device.signal('pipe;buffer', 0)
+        self.clear_buffers()
+        self.update_buffer()
         self.update_state(STATE_TERMINATE)
 
+    def clear_buffers(self):
+        """
+        Clears the buffer, queue and any frames the packetizer has already built.
+        """
+        with self._packetize_lock:
+            self._queue_lock.acquire(True)
+            self._queue.clear()
+            self._queue_lock.release()
+            self._buffer.clear()
+            with self._frames_lock:
+                self._frames.clear()
+                self._frames_length = 0
+            if self.sender is not None:
+                self.sender.discard()
+
     def reset(self):
         self.update_state(STATE_INITIALIZE)
         self.device.signal('pipe;thread', self.state)
@@ -1266,55 +2424,95 @@ class LhystudioController(Module, Pipe):
             self.usb_log(str(code))
 
     def detect_driver_and_open(self):
-        index = self.device.usb_index
-        bus = self.device.usb_bus
-        address = self.device.usb_address
-        serial = self.device.usb_serial
-        chipv = self.device.usb_version
-
-        try:
-            from CH341LibusbDriver import CH341Driver
-            self.driver = driver = CH341Driver(index=index, bus=bus, address=address, serial=serial, chipv=chipv,
-                                               state_listener=self.update_usb_state)
-            driver.open()
-            chip_version = driver.get_chip_version()
-            self.update_usb_state(INFO_USB_CHIP_VERSION | chip_version)
-            self.device.signal('pipe;chipv', chip_version)
-            self.update_usb_state(INFO_USB_DRIVER | STATE_DRIVER_LIBUSB)
-            self.update_usb_state(STATE_CONNECTED)
+        self.driver_mock = self.device.mock
+        self.driver, driver_state, chip_version = open_driver(index=self.device.usb_index,
+                                                              bus=self.device.usb_bus,
+                                                              address=self.device.usb_address,
+                                                              serial=self.device.usb_serial,
+                                                              chipv=self.device.usb_version,
+                                                              mock=self.device.mock,
+                                                              board=self.device.board,
+                                                              state_listener=self.update_usb_state)
+        if self.driver is None:
             return
-        except ConnectionRefusedError:
-            self.driver = None
-        except ImportError:
-            self.update_usb_state(STATE_DRIVER_NO_LIBUSB)
-
-        try:
-            from CH341WindllDriver import CH341Driver
-            self.driver = driver = CH341Driver(index=index, bus=bus, address=address, serial=serial, chipv=chipv,
-                                               state_listener=self.update_usb_state)
-            driver.open()
-            chip_version = driver.get_chip_version()
-            self.update_usb_state(INFO_USB_CHIP_VERSION | chip_version)
-            self.device.signal('pipe;chipv', chip_version)
-            self.update_usb_state(INFO_USB_DRIVER | STATE_DRIVER_CH341)
-            self.update_usb_state(STATE_CONNECTED)
-        except ConnectionRefusedError:
-            self.driver = None
+        self.update_usb_state(INFO_USB_CHIP_VERSION | chip_version)
+        self.device.signal('pipe;chipv', chip_version)
+        self.update_usb_state(INFO_USB_DRIVER | driver_state)
+        self.update_usb_state(STATE_CONNECTED)
 
     def update_state(self, state):
         self.state = state
+        if self.sender is not None:
+            self.sender.set_paused(state in (STATE_PAUSE, STATE_BUSY))
         if self.device is not None:
             self.device.signal('pipe;thread', self.state)
 
+    def is_watched(self, channel):
+        """
+        Whether anything watches the given channel, so messages for it are only formatted when they will be seen.
+        """
+        return self.device is not None and len(self.device.watchers.get(channel, ())) != 0
+
     def update_buffer(self):
-        if self.device is not None:
-            self.device.signal('pipe;buffer', len(self._realtime_buffer) + len(self._buffer) + len(self._queue))
+        self._buffer_dirty = True
+        listener = self.drain_listener
+        if listener is not None:
+            listener(len(self))
 
     def update_packet(self, packet):
-        if self.device is not None:
+        self._last_packet = packet
+        self._packet_dirty = True
+        if self.is_watched('send'):
+            self.send_channel(str(packet))
+
+    def update_telemetry(self):
+        """
+        Signals the buffer, packet and status changes since the last call.
+
+        This is the scheduled job of the controller, so bursts of packets and status reads become a single snapshot
+        at the job rate. Flags are cleared before the values are read, so a change made while signalling is sent on
+        the next call and the final state is always delivered.
+        """
+        if self.device is None:
+            return
+        if self._buffer_dirty:
+            self._buffer_dirty = False
+            self.device.signal('pipe;buffer', len(self._realtime_buffer) + len(self._buffer) + len(self._queue)
+                               + self._frames_length)
+        if self._packet_dirty:
+            self._packet_dirty = False
+            packet = self._last_packet
             self.device.signal('pipe;packet', convert_to_list_bytes(packet))
             self.device.signal('pipe;packet_text', packet)
-            self.send_channel(str(packet))
+        if self._status_dirty:
+            self._status_dirty = False
+            self.device.signal('pipe;status', self._status)
+        self.metrics.sample_drain(self.state == STATE_ACTIVE and len(self) > 0)
+        self.update_watermark()
+        now = time.time()
+        if now - self._metrics_signalled >= 1.0:
+            self._metrics_signalled = now
+            self.device.signal('pipe;metrics', self.metrics.snapshot())
+
+    def update_watermark(self):
+        """
+        Sets the buffer watermark the interpreter holds at, to keep buffer_target_ms of work queued at the measured
+        drain rate. Too little starves the board, too much makes pause and abort lag.
+        """
+        rate = self.metrics.drain_rate
+        if rate is None or rate <= 0:
+            return
+        watermark = int(rate * self.device.buffer_target_ms / 1000.0)
+        self.watermark = min(max(watermark, WATERMARK_MIN), WATERMARK_MAX)
+
+    def job_active(self):
+        """
+        Whether the interpreter is still working on a job, or the spooler holds more.
+        """
+        try:
+            return self.device.interpreter.spooled_item is not None or self.device.spooler.peek() is not None
+        except AttributeError:
+            return False
 
     def _thread_data_send(self):
         """
@@ -1352,14 +2550,16 @@ class LhystudioController(Module, Pipe):
                     break
                 continue
             except ConnectionError:
-                # There was an error with the connection, close it and try again.
+                # There was an error with the connection, reclaim it or close it and try again.
                 self.connection_errors += 1
                 self.pre_ok = False
-                time.sleep(0.5)
-                self.close()
+                if not self.reconnect():
+                    time.sleep(0.5)
+                    self.close()
                 continue
             if queue_processed:
                 # Packet was sent.
+                self.metrics.underrun(False)
                 if self.state not in (STATE_PAUSE, STATE_BUSY, STATE_ACTIVE, STATE_TERMINATE):
                     self.update_state(STATE_ACTIVE)
                 self.count = 0
@@ -1368,24 +2568,80 @@ class LhystudioController(Module, Pipe):
                 # No packet could be sent.
                 if self.state not in (STATE_PAUSE, STATE_BUSY, STATE_BUSY, STATE_TERMINATE):
                     self.update_state(STATE_IDLE)
+                    if self.metrics.underrun(len(self._frames) == 0 and self.job_active() and
+                                             (self.sender is None or self.sender.pending_bytes() == 0)):
+                        self.device.signal('pipe;underrun', self.metrics.underruns)
+                        if self.is_watched('pipe'):
+                            self.pipe_channel("underrun(%d)" % self.metrics.underruns)
+                else:
+                    self.metrics.underrun(False)
                 if self.count > 50:
                     self.count = 50
-                time.sleep(0.02 * self.count)
-                # will tick up to 1 second waits if there's never a queue.
+                self._frame_event.wait(0.02 * self.count)
+                self._frame_event.clear()
+                # will tick up to 1 second waits if there's never a queue, waking early for new frames.
                 self.count += 1
         self._main_lock.release()
         self._thread = None
+        self._packetize_event.set()  # Let the packetizer see the send thread ended.
+        self.update_telemetry()
         self.update_state(STATE_END)
         self.is_shutdown = False
         self.pre_ok = False
 
-    def process_queue(self):
+    def _thread_packetizer(self):
         """
-        Attempts to process the buffer/queue
-        Will fail on ConnectionRefusedError at open, 'process_queue_pause = True' (anytime before packet sent),
-        self._buffer is empty, or a failure to produce packet.
+        Threaded producer for the send thread. Waits for written data and converts the buffer into ready frames.
+        Exits once the send thread has ended.
+        """
+        while self._thread is not None:
+            self._packetize_event.wait(1.0)
+            self._packetize_event.clear()
+            self.packetize()
+
+    def packetize(self):
+        """
+        Moves the queue into the buffer and converts as much of the buffer as possible into frames.
 
-        Buffer will not be changed unless packet is successfully sent, or pipe commands are processed.
+        Each frame holds the 30 byte packet, the USB frame with crc, the number of buffer bytes it consumed and the
+        pipe commands to be performed before and after it is sent. A trailing partial packet is left in the buffer
+        until more data or a line end arrives.
+
+        :return: number of frames created.
+        """
+        with self._packetize_lock:
+            if len(self._queue):  # check for and append queue
+                self._queue_lock.acquire(True)
+                self._buffer.extend(self._queue)
+                self._queue_lock.release()
+            buffer = self._buffer
+            created = []
+            available = self.frames_max - len(self._frames)
+            while len(buffer) and len(created) < available:
+                packet, length, pre_send_command, post_send_command = self.create_packet(buffer.peek(31))
+                if len(packet) != 0 and len(packet) != 30:
+                    break  # Partial packet, requires more data.
+                buffer.consume(length)
+                created.append((packet, length, pre_send_command, post_send_command))
+            if len(created) == 0:
+                return 0
+            frames = onewire_crc_frames([c[0] for c in created if len(c[0]) == 30])
+            frames.reverse()
+            ready = []
+            total = 0
+            for packet, length, pre_send_command, post_send_command in created:
+                frame = frames.pop() if len(packet) == 30 else None
+                ready.append((packet, frame, length, pre_send_command, post_send_command))
+                total += length
+            with self._frames_lock:
+                self._frames.extend(ready)
+                self._frames_length += total
+        self._frame_event.set()
+        return len(ready)
+
+    def create_packet(self, head):
+        """
+        Creates a packet from the head of a buffer.
 
         - : tells the system to require wait finish at the end of the queue processing.
         * : tells the system to clear the buffers, and abort the thread.
@@ -1393,45 +2649,22 @@ class LhystudioController(Module, Pipe):
         & : tells the system to resume.
         \x18 : tells the system to quit.
 
-        :return: queue process success.
+        :param head: first 31 bytes of the buffer.
+        :return: packet, length of buffer used, pre-send command, post-send command
         """
-        if len(self._queue):  # check for and append queue
-            self._queue_lock.acquire(True)
-            self._buffer += self._queue
-            self._queue = b''
-            self._queue_lock.release()
-            self.update_buffer()
-
-        if len(self._preempt):  # check for and prepend preempt
-            self._preempt_lock.acquire(True)
-            self._realtime_buffer += self._preempt
-            self._preempt = b''
-            self._preempt_lock.release()
-            self.update_buffer()
-
-        if len(self._realtime_buffer) > 0:
-            buffer = self._realtime_buffer
-            realtime = True
-        else:
-            if len(self._buffer) > 0:
-                buffer = self._buffer
-                realtime = False
-            else:
-                # The buffer and realtime buffers are empty. No packet creation possible.
-                return False
-
         # Find buffer of 30 or containing '\n'.
-        find = buffer.find(b'\n', 0, 30)
+        find = head.find(b'\n', 0, 30)
         if find == -1:  # No end found.
-            length = min(30, len(buffer))
+            length = min(30, len(head))
         else:  # Line end found.
-            length = min(30, len(buffer), find + 1)
-        packet = buffer[:length]
+            length = min(30, len(head), find + 1)
+        packet = head[:length]
 
         # edge condition of catching only pipe command without '\n'
         if packet.endswith((b'-', b'*', b'&', b'!', b'#', b'\x18')):
-            packet += buffer[length:length + 1]
+            packet += head[length:length + 1]
             length += 1
+        pre_send_command = None
         post_send_command = None
 
         # find pipe commands.
@@ -1444,14 +2677,13 @@ class LhystudioController(Module, Pipe):
                 post_send_command = self.abort
                 packet = packet[:-1]
             elif packet.endswith(b'&'):  # resume
-                self._resume_busy()
+                pre_send_command = self._resume_busy
                 packet = packet[:-1]
             elif packet.endswith(b'!'):  # pause
-                self._pause_busy()
+                pre_send_command = self._pause_busy
                 packet = packet[:-1]
             elif packet.endswith(b'\x18'):
-                self.state = STATE_TERMINATE
-                self.is_shutdown = True
+                pre_send_command = self._quit_send
                 packet = packet[:-1]
             if len(packet) != 0:
                 if packet.endswith(b'#'):
@@ -1463,58 +2695,104 @@ class LhystudioController(Module, Pipe):
                     packet += bytes([c]) * (30 - len(packet))  # Padding. '\n'
                 else:
                     packet += b'F' * (30 - len(packet))  # Padding. '\n'
+        return packet, length, pre_send_command, post_send_command
+
+    def _quit_send(self):
+        self.state = STATE_TERMINATE
+        self.is_shutdown = True
+
+    def process_queue(self):
+        """
+        Attempts to process the realtime buffer or the next frame.
+        Will fail on ConnectionRefusedError at open, 'process_queue_pause = True' (anytime before packet sent),
+        there being no frame or realtime data, or a failure to produce packet.
+
+        Frames are built by the packetizer. Realtime data is packetized here, since it must skip ahead of any frames.
+        Neither will be changed unless packet is successfully sent, or pipe commands are processed.
+
+        :return: queue process success.
+        """
+        if len(self._preempt):  # check for and prepend preempt
+            self._preempt_lock.acquire(True)
+            self._realtime_buffer.extend(self._preempt)
+            self._preempt_lock.release()
+            self.update_buffer()
+
+        item = None
+        if len(self._realtime_buffer) > 0:
+            packet, length, pre_send_command, post_send_command = \
+                self.create_packet(self._realtime_buffer.peek(31))
+            frame = None
+            realtime = True
+        else:
+            if len(self._frames) == 0:
+                if len(self._buffer) or len(self._queue):
+                    if self._packetizer_thread is None or not self._packetizer_thread.is_alive():
+                        self.packetize()  # Packetizer thread is not running, do the work here.
+                    else:
+                        self._packetize_event.set()
+                # The frames and realtime buffers are empty. No packet creation possible.
+                return False
+            item = self._frames[0]
+            packet, frame, length, pre_send_command, post_send_command = item
+            realtime = False
+
+        if pre_send_command is not None:
+            pre_send_command()
         if not realtime and self.state in (STATE_PAUSE, STATE_BUSY):
             return False  # Processing normal queue, PAUSE and BUSY apply.
 
         # Packet is prepared and ready to send. Open Channel.
-        if self.device.mock:
-            self.update_usb_state(STATE_DRIVER_MOCK)
-        else:
-            self.open()
-
-        if len(packet) == 30:
+        self.open()
+
+        if self.sender is not None:
+            # The sender process sends and confirms the packet.
+            if len(packet) == 30:
+                if frame is None:
+                    frame = b'\x00' + packet + bytes([onewire_crc_lookup(packet)])
+                opcode = OP_FRAME_WAIT if post_send_command == self.wait_finished else OP_FRAME
+            elif len(packet) != 0:
+                return False  # Partial packet.
+            elif post_send_command == self.wait_finished:
+                opcode = OP_WAIT
+            else:
+                opcode = None
+            if opcode is not None:
+                if not self.sender.push(opcode, frame if frame is not None else b'', realtime, length):
+                    # Ring is full. The sender process is busy, remain active.
+                    time.sleep(0.005)
+                    return True
+            if post_send_command == self.wait_finished:
+                post_send_command = None  # The sender process waits.
+
+        elif len(packet) == 30:
             # We have a sendable packet.
             if not self.pre_ok:
                 self.wait_until_accepting_packets()
-            self.send_packet(packet)
+            sent = time.perf_counter()
+            first = self.send_packet(packet, frame)
 
             # Packet is sent, trying to confirm.
-            status = 0
-            flawless = True
-            for attempts in range(300):
-                # We'll try to confirm this at 300 times.
-                try:
-                    self.update_status()
-                    status = self._status[1]
-                except ConnectionError:
-                    # Errors are ignored, must confirm packet.
-                    flawless = False
-                    continue
-                if status == 0:
-                    # We did not read a status.
-                    continue
-                elif status == STATUS_OK:
-                    # Packet was fine.
-                    self.pre_ok = True
-                    break
-                elif status == STATUS_BUSY:
-                    # Busy. We still do not have our confirmation. BUSY comes before ERROR or OK.
-                    continue
-                elif status == STATUS_ERROR:
-                    self.device.rejected_count += 1
-                    if flawless:  # Packet was rejected. The CRC failed.
-                        return False
-                    else:
-                        # The channel had the error, assuming packet was actually good.
-                        break
-                elif status == STATUS_FINISH:
-                    # We finished. If we were going to wait for that, we no longer need to.
-                    if post_send_command == self.wait_finished:
-                        post_send_command = None
-                    continue  # This is not a confirmation.
-            if status == 0:  # After 300 attempts we could only get status = 0.
+            status, flawless, finished, busy = confirm_packet(self.read_status, self.confirm_poller, first)
+            if finished and post_send_command == self.wait_finished:
+                # We finished. If we were going to wait for that, we no longer need to.
+                post_send_command = None
+            if status == STATUS_OK:
+                self.pre_ok = True
+            elif status == STATUS_ERROR:
+                self.device.rejected_count += 1
+                if flawless:  # Packet was rejected. The CRC failed.
+                    return False
+                # The channel had the error, assuming packet was actually good.
+            elif status == 0:  # After 300 attempts we could only get status = 0.
                 raise ConnectionError  # Broken pipe. 300 attempts. Could not confirm packet.
             self.device.packet_count += 1  # Our packet is confirmed or assumed confirmed.
+            if busy:
+                # The wait was on the board making room, not the confirmation.
+                self.metrics.busy_time += time.perf_counter() - sent
+                self.metrics.packet(length)
+            else:
+                self.metrics.packet(length, time.perf_counter() - sent if status == STATUS_OK else None)
         else:
             if len(packet) != 0:
                 # We could only generate a partial packet, throw it back
@@ -1523,9 +2801,14 @@ class LhystudioController(Module, Pipe):
 
         # Packet was processed. Remove that data.
         if realtime:
-            self._realtime_buffer = self._realtime_buffer[length:]
+            self._realtime_buffer.consume(length)
         else:
-            self._buffer = self._buffer[length:]
+            with self._frames_lock:
+                if len(self._frames) and self._frames[0] is item:
+                    self._frames.popleft()
+                    self._frames_length -= length
+            if len(self._frames) < self.frames_max // 2:
+                self._packetize_event.set()
         self.update_buffer()
 
         if post_send_command is not None:
@@ -1537,31 +2820,45 @@ class LhystudioController(Module, Pipe):
                 pass
         return True  # A packet was prepped and sent correctly.
 
-    def send_packet(self, packet):
-        if self.device.mock:
-            time.sleep(0.04)
-        else:
-            packet = b'\x00' + packet + bytes([onewire_crc_lookup(packet)])
-            self.driver.write(packet)
-        self.update_packet(packet)
-        self.pre_ok = False
+    def send_packet(self, packet, frame=None):
+        """
+        Writes the packet. Drivers able to read the status along with the write do so.
 
-    def update_status(self):
-        if self.device.mock:
-            from random import randint
-            if randint(0, 500) == 0:
-                self._status = [255, STATUS_ERROR, 0, 0, 0, 1]
+        :return: status byte read with the write, 0 if that read failed, None if the driver did not read it.
+        """
+        if frame is None:
+            frame = b'\x00' + packet + bytes([onewire_crc_lookup(packet)])
+        status = None
+        write_status = getattr(self.driver, 'write_status', None)
+        if write_status is not None:
+            status = write_status(frame)
+            if status is not None:
+                self.update_status(status)
+                status = status[1]
             else:
-                self._status = [255, STATUS_OK, 0, 0, 0, 1]
-            time.sleep(0.01)
+                status = 0
         else:
-            self._status = self.driver.get_status()
-        if self.device is not None:
-            self.device.signal('pipe;status', self._status)
+            self.driver.write(frame)
+        self.update_packet(packet)
+        self.pre_ok = False
+        return status
+
+    def read_status(self):
+        self.update_status()
+        return self._status[1]
+
+    def update_status(self, status=None):
+        if status is None:
+            status = self.driver.get_status()
+        self._status = status
+        self._status_dirty = True
+        if self.is_watched('recv'):
             self.recv_channel(str(self._status))
 
     def wait_until_accepting_packets(self):
         i = 0
+        poller = self.wait_poller
+        poller.begin()
         while self.state != STATE_TERMINATE:
             self.update_status()
             status = self._status[1]
@@ -1572,13 +2869,15 @@ class LhystudioController(Module, Pipe):
                 break
             if status == STATUS_ERROR:
                 break
-            time.sleep(0.05)
+            poller.delay(status)
             if self.device is not None:
                 self.device.signal('pipe;wait', STATUS_OK, i)
             i += 1
             if self.abort_waiting:
                 self.abort_waiting = False
-                return  # Wait abort was requested.
+                break  # Wait abort was requested.
+        if i != 0:
+            self.metrics.busy_time += poller.elapsed()
 
     def wait_finished(self):
         i = 0
@@ -1586,12 +2885,12 @@ class LhystudioController(Module, Pipe):
         if self.state != STATE_PAUSE:
             self.pause()
 
+        poller = self.finish_poller
+        poller.begin()
         while True:
             if self.state != STATE_WAIT:
                 self.update_state(STATE_WAIT)
             self.update_status()
-            if self.device.mock:  # Mock controller
-                self._status = [255, STATUS_FINISH, 0, 0, 0, 1]
             status = self._status[1]
             if status == 0:
                 self.update_state(original_state)
@@ -1600,6 +2899,7 @@ class LhystudioController(Module, Pipe):
                 self.device.rejected_count += 1
             if status & 0x02 == 0:
                 # StateBitPEMP = 0x00000200, Finished = 0xEC, 11101100, 236
+                poller.record()
                 break
             if self.device is not None:
                 self.device.signal('pipe;wait', status, i)
@@ -1607,6 +2907,8 @@ class LhystudioController(Module, Pipe):
             if self.abort_waiting:
                 self.abort_waiting = False
                 break  # Wait abort was requested.
+            poller.delay(STATUS_FINISH)  # Finish is still pending.
+        self.metrics.wait_time += poller.elapsed()
         self.update_state(original_state)
 
 
@@ -0,0 +1,473 @@
+import json
+import os
+import struct
+import subprocess
+import sys
+import time
+from multiprocessing import shared_memory
+from multiprocessing.connection import Client, Listener, arbitrary_address, default_family
+
+from CH341DriverBase import *
+from LhystudiosDevice import StatusPoller, confirm_packet, open_driver, STATUS_OK, STATUS_ERROR, STATUS_FINISH, \
+    OP_FRAME_WAIT, OP_WAIT
+
+"""
+LhystudiosSender runs the send and confirm loop of the LhystudioController in a separate process.
+
+The controller still packetizes the data. Ready frames are passed to the sender process through a pair of single
+producer, single consumer rings in shared memory, one for realtime frames and one for the regular frames. The sender
+process owns the driver, confirms each packet and reports status, sent packets and state changes back through a
+multiprocessing connection, which also carries the wake up notices to the idle sender. Since the process has its own
+interpreter, status confirmation is not held up by the GUI, the signaler or job compilation in the main process.
+"""
+
+SLOT_SIZE = 40  # opcode, frame length, 32 byte frame, buffer length.
+HEADER_SIZE = 64
+
+OFFSET_WRITE = (0, 16)  # Write index of the regular and realtime rings.
+OFFSET_READ = (8, 24)  # Read index of the regular and realtime rings.
+OFFSET_DISCARD = 32  # Regular frames before this index are discarded.
+FLAG_PAUSE = 40
+FLAG_QUIT = 41
+FLAG_ABORT_WAIT = 42
+
+_index = struct.Struct('<Q')
+_length = struct.Struct('<I')
+
+
+class SenderRing:
+    """
+    Frame rings within a shared memory block. The controller is the only writer of the write indexes and the
+    sender process is the only writer of the read indexes.
+    """
+
+    def __init__(self, shm, slots=256, realtime_slots=16):
+        self.shm = shm
+        self.buf = shm.buf
+        self.slots = (slots, realtime_slots)
+        self.offsets = (HEADER_SIZE, HEADER_SIZE + slots * SLOT_SIZE)
+
+    @staticmethod
+    def size(slots, realtime_slots):
+        return HEADER_SIZE + (slots + realtime_slots) * SLOT_SIZE
+
+    def _get(self, offset):
+        return _index.unpack_from(self.buf, offset)[0]
+
+    def _set(self, offset, value):
+        _index.pack_into(self.buf, offset, value)
+
+    def get_flag(self, offset):
+        return self.buf[offset]
+
+    def set_flag(self, offset, value):
+        self.buf[offset] = 1 if value else 0
+
+    def pending(self, realtime=False):
+        r = int(realtime)
+        read = self._get(OFFSET_READ[r])
+        if not realtime:
+            read = max(read, self._get(OFFSET_DISCARD))
+        return self._get(OFFSET_WRITE[r]) - read
+
+    def push(self, opcode, frame=b'', realtime=False, length=0):
+        """
+        Writes a frame to the ring.
+
+        :param length: buffer bytes held by the frame, reported back once it is sent.
+        :return: whether there was room for the frame.
+        """
+        r = int(realtime)
+        write = self._get(OFFSET_WRITE[r])
+        if write - self._get(OFFSET_READ[r]) >= self.slots[r]:
+            return False
+        position = self.offsets[r] + (write % self.slots[r]) * SLOT_SIZE
+        size = len(frame)
+        self.buf[position] = opcode
+        self.buf[position + 1] = size
+        self.buf[position + 2:position + 2 + size] = frame
+        _length.pack_into(self.buf, position + 34, length)
+        self._set(OFFSET_WRITE[r], write + 1)
+        return True
+
+    def pop(self, realtime=False):
+        """
+        Reads the next frame from the ring.
+
+        :return: opcode, frame, buffer length or None if the ring is empty.
+        """
+        r = int(realtime)
+        read = self._get(OFFSET_READ[r])
+        if not realtime:
+            discard = self._get(OFFSET_DISCARD)
+            if discard > read:
+                # Discarded slots are only released here, so they are never overwritten while being read.
+                read = discard
+                self._set(OFFSET_READ[r], read)
+        if read >= self._get(OFFSET_WRITE[r]):
+            return None
+        position = self.offsets[r] + (read % self.slots[r]) * SLOT_SIZE
+        opcode = self.buf[position]
+        size = self.buf[position + 1]
+        frame = bytes(self.buf[position + 2:position + 2 + size])
+        length = _length.unpack_from(self.buf, position + 34)[0]
+        self._set(OFFSET_READ[r], read + 1)
+        return opcode, frame, length
+
+    def discard(self):
+        """
+        Discards all regular frames not yet read by the sender process.
+        """
+        self._set(OFFSET_DISCARD, self._get(OFFSET_WRITE[0]))
+
+
+class SenderProcess:
+    """
+    Controller side handle of the sender process.
+
+    The process is started as a fresh interpreter running this module, so it does not depend upon the main module of
+    the application being safe to import.
+    """
+
+    def __init__(self, criteria, slots=256, realtime_slots=16):
+        self.criteria = criteria
+        self.slots = slots
+        self.realtime_slots = realtime_slots
+        self.shm = None
+        self.ring = None
+        self.process = None
+        self.connection = None
+
+    def start(self, timeout=10.0):
+        """
+        Starts the sender process and connects to it.
+
+        :raise ConnectionRefusedError: if the sender process could not be connected.
+        """
+        if getattr(sys, 'frozen', False):
+            # A frozen build has no Python to run this module with, sys.executable is the application itself.
+            raise ConnectionRefusedError
+        size = SenderRing.size(self.slots, self.realtime_slots)
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.shm.buf[:size] = bytes(size)
+        self.ring = SenderRing(self.shm, self.slots, self.realtime_slots)
+        address = arbitrary_address(default_family)
+        authkey = os.urandom(16)
+        config = dict(name=self.shm.name, slots=self.slots, realtime_slots=self.realtime_slots,
+                      address=address, authkey=authkey.hex(), criteria=self.criteria)
+        directory = os.path.dirname(os.path.abspath(__file__))
+        self.process = subprocess.Popen([sys.executable, '-c',
+                                         'import sys; sys.path.insert(0, %r); '
+                                         'import LhystudiosSender; LhystudiosSender.main()' % directory],
+                                        stdin=subprocess.PIPE)
+        self.process.stdin.write((json.dumps(config) + '\n').encode())
+        self.process.stdin.close()
+        start = time.time()
+        while self.connection is None:
+            try:
+                self.connection = Client(address, authkey=authkey)
+            except OSError:
+                if self.process.poll() is not None or time.time() - start > timeout:
+                    self.stop()
+                    raise ConnectionRefusedError
+                time.sleep(0.05)
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def push(self, opcode, frame=b'', realtime=False, length=0):
+        idle = self.ring.pending(False) == 0 and self.ring.pending(True) == 0
+        if not self.ring.push(opcode, frame, realtime, length):
+            return False
+        if idle:
+            self.wake()
+        return True
+
+    def wake(self):
+        try:
+            self.connection.send(None)
+        except (OSError, ValueError):
+            pass
+
+    def pending_bytes(self):
+        if self.ring is None:
+            return 0
+        return (self.ring.pending(False) + self.ring.pending(True)) * 30
+
+    def discard(self):
+        if self.ring is not None:
+            self.ring.discard()
+
+    def set_paused(self, paused):
+        if self.ring is not None:
+            self.ring.set_flag(FLAG_PAUSE, paused)
+            self.wake()
+
+    def abort_wait(self):
+        if self.ring is not None:
+            self.ring.set_flag(FLAG_ABORT_WAIT, True)
+
+    def receive(self, timeout):
+        """
+        :return: next message from the sender process, or None if there was none within the timeout.
+        """
+        try:
+            if self.connection.poll(timeout):
+                return self.connection.recv()
+        except (EOFError, OSError, ValueError):
+            time.sleep(timeout)
+        return None
+
+    def stop(self):
+        if self.ring is not None:
+            self.ring.set_flag(FLAG_QUIT, True)
+        if self.connection is not None:
+            self.wake()
+        if self.process is not None:
+            try:
+                self.process.wait(2.0)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self.connection is not None:
+            self.connection.close()
+        if self.shm is not None:
+            self.ring = None
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+class LhystudioSender:
+    """
+    Sender process side. Owns the driver and performs the send, confirm and wait for finish of each frame.
+    """
+
+    def __init__(self, ring, connection, criteria):
+        self.ring = ring
+        self.connection = connection
+        self.criteria = criteria
+        self.driver = None
+        self.pre_ok = False
+        self.last_status = None
+        self.disconnected = None  # Time of the last connection error, until reconnected.
+        self.max_attempts = 5
+        self.confirm_poller = StatusPoller(minimum=0.0002, maximum=0.02)
+        self.wait_poller = StatusPoller(minimum=0.001, maximum=0.05)
+        self.finish_poller = StatusPoller(minimum=0.005, maximum=0.1)
+
+    def send(self, *message):
+        try:
+            self.connection.send(message)
+        except (OSError, ValueError):
+            pass  # Controller has gone away.
+
+    def wait(self, timeout):
+        """
+        Waits for the controller to wake this process, or the timeout.
+
+        :raise EOFError: the controller closed the connection.
+        """
+        connection = self.connection
+        if connection.poll(timeout):
+            while connection.poll(0):
+                connection.recv()
+
+    def open(self):
+        if self.driver is not None:
+            return
+        self.driver, driver_state, chip_version = open_driver(state_listener=lambda code: self.send('usb', code),
+                                                              **self.criteria)
+        if self.driver is None:
+            raise ConnectionRefusedError
+        self.send('usb', INFO_USB_CHIP_VERSION | chip_version)
+        self.send('chipv', chip_version)
+        self.send('usb', INFO_USB_DRIVER | driver_state)
+        self.send('usb', STATE_CONNECTED)
+        if self.disconnected is not None:
+            self.send('reconnected', time.perf_counter() - self.disconnected, False)
+            self.disconnected = None
+
+    def reconnect(self):
+        """
+        Attempts the fast reconnect of the driver after a connection error.
+
+        :return: whether the driver reconnected, otherwise it must be closed and opened again.
+        """
+        self.disconnected = time.perf_counter()
+        if self.driver is None:
+            return False
+        try:
+            self.driver.reconnect()
+        except (ConnectionError, AttributeError):
+            return False
+        self.send('reconnected', time.perf_counter() - self.disconnected, True)
+        self.disconnected = None
+        return True
+
+    def close(self):
+        if self.driver is not None:
+            try:
+                self.driver.close()
+            except ConnectionError:
+                pass
+        self.driver = None
+        self.pre_ok = False
+
+    def read_status(self):
+        return self.update_status(self.driver.get_status())
+
+    def update_status(self, status):
+        if status != self.last_status:
+            self.last_status = status
+            self.send('status', status)
+        return status[1]
+
+    def run(self):
+        ring = self.ring
+        item = None
+        refuse_counts = 0
+        while not ring.get_flag(FLAG_QUIT):
+            if item is None:
+                item = ring.pop(True)
+            if item is None and not ring.get_flag(FLAG_PAUSE):
+                item = ring.pop(False)
+            if item is None:
+                self.wait(0.05)
+                continue
+            try:
+                if self.process(*item):
+                    item = None
+                refuse_counts = 0
+            except ConnectionRefusedError:
+                refuse_counts += 1
+                self.pre_ok = False
+                if refuse_counts >= self.max_attempts:
+                    self.send('error', refuse_counts)
+                    item = None
+                    refuse_counts = 0
+                    ring.discard()
+                    continue
+                time.sleep(3)  # 3 second sleep on failed connection attempt.
+            except ConnectionError:
+                self.send('connection_error')
+                self.pre_ok = False
+                if not self.reconnect():
+                    time.sleep(0.5)
+                    self.close()
+        self.close()
+
+    def process(self, opcode, frame, length):
+        """
+        :return: whether the frame was processed, False if it must be sent again.
+        """
+        self.open()
+        if opcode == OP_WAIT:
+            self.wait_finished()
+            return True
+        busy = 0.0
+        if not self.pre_ok:
+            busy = self.wait_until_accepting_packets()
+        sent = time.perf_counter()
+        first = None
+        write_status = getattr(self.driver, 'write_status', None)
+        if write_status is not None:
+            first = write_status(frame)
+            first = self.update_status(first) if first is not None else 0
+        else:
+            self.driver.write(frame)
+        self.pre_ok = False
+        status, flawless, finished, board_busy = confirm_packet(self.read_status, self.confirm_poller, first)
+        if status == STATUS_OK:
+            self.pre_ok = True
+        elif status == STATUS_ERROR:
+            self.send('rejected')
+            if flawless:
+                return False
+        elif status == 0:
+            raise ConnectionError
+        latency = time.perf_counter() - sent if status == STATUS_OK else None
+        if board_busy:
+            # The wait was on the board making room, not the confirmation.
+            busy += time.perf_counter() - sent
+            latency = None
+        self.send('packet', frame[1:31], length, latency, busy)
+        if opcode == OP_FRAME_WAIT and not finished:
+            try:
+                self.wait_finished()
+            except ConnectionError:
+                pass  # The packet was already sent.
+        return True
+
+    def wait_until_accepting_packets(self):
+        """
+        :return: seconds spent while the board was busy.
+        """
+        poller = self.wait_poller
+        poller.begin()
+        i = 0
+        while not self.ring.get_flag(FLAG_QUIT):
+            status = self.read_status()
+            if status == 0:
+                raise ConnectionError
+            if status == STATUS_OK:
+                self.pre_ok = True
+                break
+            if status == STATUS_ERROR:
+                break
+            poller.delay(status)
+            self.send('wait', STATUS_OK, i)
+            i += 1
+            if self.ring.get_flag(FLAG_ABORT_WAIT):
+                self.ring.set_flag(FLAG_ABORT_WAIT, False)
+                break
+        return poller.elapsed() if i != 0 else 0.0
+
+    def wait_finished(self):
+        poller = self.finish_poller
+        poller.begin()
+        i = 0
+        self.send('waiting', True)
+        try:
+            while not self.ring.get_flag(FLAG_QUIT):
+                status = self.read_status()
+                if status == 0:
+                    raise ConnectionError
+                if status == STATUS_ERROR:
+                    self.send('rejected')
+                if status & 0x02 == 0:
+                    poller.record()
+                    break
+                self.send('wait', status, i)
+                i += 1
+                if self.ring.get_flag(FLAG_ABORT_WAIT):
+                    self.ring.set_flag(FLAG_ABORT_WAIT, False)
+                    break
+                poller.delay(STATUS_FINISH)
+        finally:
+            self.send('waiting', False, poller.elapsed())
+
+
+def main():
+    """
+    Entry point of the sender process. The configuration is read as a line of json from stdin.
+    """
+    config = json.loads(sys.stdin.readline())
+    listener = Listener(config['address'], authkey=bytes.fromhex(config['authkey']))
+    connection = listener.accept()
+    listener.close()
+    shm = shared_memory.SharedMemory(name=config['name'])
+    if os.name == 'posix':
+        # The controller owns the shared memory, this process must not unlink it at exit.
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    ring = SenderRing(shm, config['slots'], config['realtime_slots'])
+    try:
+        LhystudioSender(ring, connection, config['criteria']).run()
+    except (EOFError, OSError):
+        pass  # Controller has gone away.
+    finally:
+        ring.buf = None
+        ring.shm = None
+        shm.close()
+        connection.close()
@@ -4,6 +4,7 @@ from svgelements import *
 from LaserCommandConstants import *
 from LaserOperation import LaserOperation
 from LaserRender import LaserRender
+from RasterStore import TiledRaster, STORE_PIXELS
 
 
 class OperationPreprocessor:
@@ -253,6 +254,9 @@ class OperationPreprocessor:
         [b d f]
 
         Pil requires a, c, e, b, d, f accordingly.
+
+        Large 1-bit and 8-bit images are transformed a tile at a time into a TiledRaster, which is kept as the
+        raster_store of the element, and the element's image is taken from it.
         """
         if not isinstance(image_element, SVGImage):
             return
@@ -281,22 +285,36 @@ class OperationPreprocessor:
             # If we are rotating an image without alpha, we need to convert it, or the rotation invents black pixels.
             pil_image = pil_image.convert('RGBA')
 
-        pil_image = pil_image.transform((element_width, element_height), Image.AFFINE,
-                                        (matrix.a, matrix.c, matrix.e, matrix.b, matrix.d, matrix.f),
-                                        resample=Image.BICUBIC)
+        store = None
+        if pil_image.mode in ('1', 'L') and element_width * element_height > STORE_PIXELS:
+            store = TiledRaster.transformed(pil_image, (element_width, element_height),
+                                            (matrix.a, matrix.c, matrix.e, matrix.b, matrix.d, matrix.f),
+                                            Image.BICUBIC)
+        else:
+            pil_image = pil_image.transform((element_width, element_height), Image.AFFINE,
+                                            (matrix.a, matrix.c, matrix.e, matrix.b, matrix.d, matrix.f),
+                                            resample=Image.BICUBIC)
         image_element.image_width, image_element.image_height = (element_width, element_height)
         matrix.reset()
 
-        box = pil_image.getbbox()
+        box = pil_image.getbbox() if store is None else store.getbbox()
         width = box[2] - box[0]
         height = box[3] - box[1]
         if width != element_width and height != element_height:
             image_element.image_width, image_element.image_height = (width, height)
-            pil_image = pil_image.crop(box)
+            if store is None:
+                pil_image = pil_image.crop(box)
+            else:
+                cropped = store.crop(box)
+                store.close()
+                store = cropped
             matrix.post_translate(box[0], box[1])
         # step level requires the new actualized matrix be scaled up.
         matrix.post_scale(step_level, step_level)
         matrix.post_translate(tx, ty)
+        if store is not None:
+            pil_image = store.image()
+        image_element.raster_store = store
         image_element.image = pil_image
 
     @staticmethod
@@ -35,7 +35,8 @@ class OperationProperty(wx.Frame, Module):
         self.text_overscan = wx.TextCtrl(self.raster_panel, wx.ID_ANY, "20")
         self.combo_raster_direction = wx.ComboBox(self.raster_panel, wx.ID_ANY,
                                                   choices=[_("Top To Bottom"), _("Bottom To Top"), _("Right To Left"),
-                                                           _("Left To Right"), _("Crosshatch")], style=wx.CB_DROPDOWN)
+                                                           _("Left To Right"), _("Crosshatch"), _("Auto")],
+                                                  style=wx.CB_DROPDOWN)
         self.radio_directional_raster = wx.RadioBox(self.raster_panel, wx.ID_ANY, _("Directional Raster"),
                                                     choices=[_("Bidirectional"), _("Unidirectional")], majorDimension=1,
                                                     style=wx.RA_SPECIFY_ROWS)
@@ -542,7 +543,7 @@ class OperationProperty(wx.Frame, Module):
 
     def on_text_overscan(self, event):  # wxGlade: OperationProperty.<event_handler>
         overscan = self.text_overscan.GetValue()
-        if not overscan.endswith('%'):
+        if not overscan.endswith('%') and overscan != 'auto':
             try:
                 overscan = int(overscan)
             except ValueError:
@@ -1,3 +1,13 @@
+from array import array
+from bisect import bisect_right
+
+from RasterStore import TiledRaster
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 X_AXIS = 0
 TOP = 0
 LEFT = 0
@@ -25,13 +35,277 @@ The TOP, RIGHT, LEFT, BOTTOM combined give you the starting corner.
 
 The rasters can either be BIDIRECTIONAL or UNIDIRECTIONAL meaning they raster on both swings
 or only on forward swing.
+
+The pixels are read through a RasterIndex, which holds for each row and column the first and last pixel that is not
+skipped and the positions where the pixel value changes. The plotter finds the bounds and runs of a scanline by lookup
+rather than rescanning its pixels each time they are needed. Data held in a TiledRaster is indexed a tile at a time
+and its rows and columns are streamed from the mapped file when they are looked up.
 """
 
 
+class ArrayPixels:
+    """
+    Pixel access to a 2d numpy array indexed [y, x], read as data[x, y] like the pixel access of an image.
+
+    With a lookup table the array holds indexes into the table, which holds the pixel values.
+    """
+
+    def __init__(self, array, lut=None):
+        self.array = array
+        self.lut = lut
+
+    def __getitem__(self, key):
+        x, y = key
+        value = self.array.item(y, x)
+        if self.lut is not None:
+            return self.lut[value]
+        return value
+
+
+class RasterIndex:
+    """
+    Bounds and value changes of each row and column of the filtered pixel data.
+
+    Each row or column is a tuple of the first and last position that is not the skip pixel, None when it is all skip
+    pixels, and the sorted positions at which the pixel value differs from the one before.
+
+    With numpy the filtered data is encoded once into an array of value codes, equal values sharing a code, and the
+    bounds of every row and column are computed from it in bulk. Without numpy each row or column is read and scanned
+    once, when first asked for.
+
+    A TiledRaster is never loaded whole. With numpy its raw values are coded through a table of the 256 possible
+    values, the bounds are computed a tile at a time and the changes of a row, or of a block of columns, are read from
+    the raster when first asked for.
+    """
+
+    COLUMN_BLOCK = 256  # Columns of a TiledRaster read together.
+
+    def __init__(self, data, width, height, skip_pixel=0, filter=None):
+        self.data = data
+        self.width = width
+        self.height = height
+        self.skip_pixel = skip_pixel
+        self.filter = filter
+        self.codes = None
+        self.store = None
+        self._rows = [None] * height
+        self._columns = [None] * width
+        self._runs = {}
+        if np is not None and width > 0 and height > 0:
+            if isinstance(data, TiledRaster):
+                self.store = data
+                self.stream()
+            else:
+                self.codes, skip = self.encode()
+                if self.codes is not None:
+                    self.row_bounds = self.bounds(skip, 1)
+                    self.column_bounds = self.bounds(skip, 0)
+
+    def encode(self):
+        """
+        :return: array of value codes indexed [y, x] and the mask of the pixels that are not skipped.
+        """
+        data = self.data
+        if isinstance(data, ArrayPixels) and self.filter is None:
+            if data.lut is None:
+                return data.array, data.array != self.skip_pixel
+            array = data.array
+            lut = data.lut
+        else:
+            # Code the raw pixels, the filter is applied once per distinct raw pixel.
+            codes = {}
+            array = np.empty((self.height, self.width), dtype=np.uint8)
+            try:
+                for y in range(self.height):
+                    row = [codes.setdefault(data[x, y], len(codes)) for x in range(self.width)]
+                    if len(codes) > 256 and array.dtype == np.uint8:
+                        array = array.astype(np.uint32)
+                    array[y] = row
+            except TypeError:
+                return None, None  # Unhashable pixel values.
+            lut = list(codes)
+            if self.filter is not None:
+                lut = [self.filter(v) for v in lut]
+        codes = {}
+        remap = [codes.setdefault(v, len(codes)) for v in lut]
+        if len(codes) != len(lut):
+            array = np.array(remap, dtype=array.dtype)[array]  # Equal values share a code.
+        values = list(codes)
+        skipped = [code for code, value in enumerate(values) if not value != self.skip_pixel]
+        return array, ~np.isin(array, skipped)
+
+    def stream(self):
+        """
+        Codes the 256 raw values of the TiledRaster and computes the bounds of each row and column tile by tile.
+        """
+        values = list(range(256))
+        if self.filter is not None:
+            values = [self.filter(v) for v in values]
+        codes = {}
+        self.remap = np.array([codes.setdefault(v, len(codes)) for v in values], dtype=np.uint8)
+        skipped = np.array([not v != self.skip_pixel for v in values])
+        store = self.store
+        self.row_bounds = []
+        found = np.zeros(self.width, dtype=bool)
+        first = np.zeros(self.width, dtype=np.int64)
+        last = np.zeros(self.width, dtype=np.int64)
+        for y0, y1 in store.tiles():
+            mask = ~skipped[store.rows(y0, y1)]
+            self.row_bounds.extend(self.bounds(mask, 1))
+            any_tile = mask.any(axis=0)
+            first = np.where(found, first, mask.argmax(axis=0) + y0)
+            last = np.where(any_tile, y1 - 1 - np.flip(mask, axis=0).argmax(axis=0), last)
+            found |= any_tile
+        self.column_bounds = [(f, l) if a else (None, None)
+                              for f, l, a in zip(first.tolist(), last.tolist(), found.tolist())]
+
+    def read_block(self, x):
+        """
+        Streams the block of columns holding column x from the TiledRaster and finds the changes of each.
+        """
+        store = self.store
+        x0 = x - x % self.COLUMN_BLOCK
+        x1 = min(x0 + self.COLUMN_BLOCK, self.width)
+        strip = np.empty((self.height, x1 - x0), dtype=np.uint8)
+        for y0, y1 in store.tiles():
+            strip[y0:y1] = self.remap[store.rows(y0, y1)[:, x0:x1]]
+        for i in range(x1 - x0):
+            if self._columns[x0 + i] is None:
+                first, last = self.column_bounds[x0 + i]
+                self._columns[x0 + i] = first, last, self.changes(strip[:, i])
+
+    @staticmethod
+    def bounds(mask, axis):
+        """
+        :return: list of the first and last position that is not skipped, along the given axis of the mask. Reducing
+        axis 1 gives the bounds of each row, axis 0 those of each column.
+        """
+        length = mask.shape[axis]
+        found = mask.any(axis=axis).tolist()
+        first = mask.argmax(axis=axis).tolist()
+        last = (length - 1 - np.flip(mask, axis=axis).argmax(axis=axis)).tolist()
+        return [(f, l) if a else (None, None) for f, l, a in zip(first, last, found)]
+
+    def read_row(self, y):
+        data = self.data
+        if isinstance(data, TiledRaster):
+            values = data.row(y)
+            return values if self.filter is None else [self.filter(v) for v in values]
+        if self.filter is None:
+            return [data[x, y] for x in range(self.width)]
+        f = self.filter
+        return [f(data[x, y]) for x in range(self.width)]
+
+    def read_column(self, x):
+        data = self.data
+        if isinstance(data, TiledRaster):
+            values = data.column(x)
+            return values if self.filter is None else [self.filter(v) for v in values]
+        if self.filter is None:
+            return [data[x, y] for y in range(self.height)]
+        f = self.filter
+        return [f(data[x, y]) for y in range(self.height)]
+
+    def scan(self, values):
+        skip_pixel = self.skip_pixel
+        first = None
+        last = None
+        for i, v in enumerate(values):
+            if v != skip_pixel:
+                first = i
+                break
+        if first is not None:
+            for i in range(len(values) - 1, first - 1, -1):
+                if values[i] != skip_pixel:
+                    last = i
+                    break
+        changes = [i for i in range(1, len(values)) if values[i] != values[i - 1]]
+        return first, last, changes
+
+    @staticmethod
+    def changes(line):
+        # Held as a C int array, a dithered bed holds tens of millions of changes.
+        return array('i', (np.flatnonzero(line[1:] != line[:-1]) + 1).astype(np.intc).tobytes())
+
+    def row(self, y):
+        """
+        :return: first, last, changes of row y.
+        """
+        if not 0 <= y < self.height:
+            raise IndexError
+        row = self._rows[y]
+        if row is None:
+            if self.codes is not None:
+                first, last = self.row_bounds[y]
+                row = first, last, self.changes(self.codes[y])
+            elif self.store is not None:
+                first, last = self.row_bounds[y]
+                row = first, last, self.changes(self.remap[self.store.rows(y, y + 1)[0]])
+            else:
+                row = self.scan(self.read_row(y))
+            self._rows[y] = row
+        return row
+
+    def column(self, x):
+        """
+        :return: first, last, changes of column x.
+        """
+        if not 0 <= x < self.width:
+            raise IndexError
+        column = self._columns[x]
+        if column is None:
+            if self.codes is not None:
+                first, last = self.column_bounds[x]
+                column = first, last, self.changes(self.codes[:, x])
+            elif self.store is not None:
+                self.read_block(x)
+                return self._columns[x]
+            else:
+                column = self.scan(self.read_column(x))
+            self._columns[x] = column
+        return column
+
+    def runs(self, axis):
+        """
+        :return: list of the number of value changes of each row, for axis 1, or of each column, for axis 0.
+        """
+        runs = self._runs.get(axis)
+        if runs is not None:
+            return runs
+        if self.codes is not None:
+            runs = self.count_changes(self.codes, axis)
+        elif self.store is not None:
+            runs = []
+            store = self.store
+            previous = None
+            for y0, y1 in store.tiles():
+                codes = self.remap[store.rows(y0, y1)]
+                if axis == 1:
+                    runs.extend(self.count_changes(codes, 1))
+                    continue
+                if previous is not None:
+                    codes = np.concatenate((previous, codes))
+                counts = self.count_changes(codes, 0)
+                runs = counts if not runs else [a + b for a, b in zip(runs, counts)]
+                previous = codes[-1:]
+        elif axis == 1:
+            runs = [len(self.row(y)[2]) for y in range(self.height)]
+        else:
+            runs = [len(self.column(x)[2]) for x in range(self.width)]
+        self._runs[axis] = runs
+        return runs
+
+    @staticmethod
+    def count_changes(codes, axis):
+        if axis == 1:
+            return np.count_nonzero(codes[:, 1:] != codes[:, :-1], axis=1).tolist()
+        return np.count_nonzero(codes[1:] != codes[:-1], axis=0).tolist()
+
+
 class RasterPlotter:
 
     def __init__(self, data, width, height, traversal=0, skip_pixel=0, overscan=0,
-                 offset_x=0, offset_y=0, step=1, filter=None, alt_filter=None):
+                 offset_x=0, offset_y=0, step=1, filter=None, alt_filter=None, index=None, jumps=False):
         """
         Initialization for the Raster Plotter function. This should set all the needed parameters for plotting.
 
@@ -52,6 +326,9 @@ class RasterPlotter:
                             static. But, an alternative backswing filter could allow for that some plotting to occur
                             on the backswing based on a different criteria than forward swing. By default this returns
                             skip pixels, which will not plot anything.
+        :param index: RasterIndex of the same data and filter, shared with another plotter of the image.
+        :param jumps: Scanlines more than a step apart are reached by a jump. The scanline before a jump only overscans
+                            its own bounds, and the jump is followed by a blank move to the start of the next scanline.
         """
         self.data = data
         self.width = width
@@ -74,6 +351,10 @@ class RasterPlotter:
         self.filter = filter
         self.main_filter = filter
         self.alt_filter = alt_filter
+        self.jumps = jumps
+        self._indexes = {}
+        if index is not None:
+            self._indexes[filter] = index
         self.initial_x, self.initial_y = self.calculate_first_pixel()
 
     def swap(self):
@@ -100,17 +381,24 @@ class RasterPlotter:
             return self.filter(self.data[x, y])
         raise IndexError
 
+    @property
+    def index(self):
+        """
+        RasterIndex of the data with the current filter, built when first needed.
+        """
+        index = self._indexes.get(self.filter)
+        if index is None:
+            index = self._indexes[self.filter] = RasterIndex(self.data, self.width, self.height, self.skip_pixel,
+                                                             self.filter)
+        return index
+
     def leftmost_not_equal(self, y):
         """"
         Determine the leftmost pixel that is not equal to the skip_pixel value.
 
         if all pixels skipped returns None
         """
-        for x in range(0, self.width):
-            pixel = self.px(x, y)
-            if pixel != self.skip_pixel:
-                return x
-        return None
+        return self.index.row(y)[0]
 
     def topmost_not_equal(self, x):
         """
@@ -118,11 +406,7 @@ class RasterPlotter:
 
         if all pixels skipped returns None
         """
-        for y in range(0, self.height):
-            pixel = self.px(x, y)
-            if pixel != self.skip_pixel:
-                return y
-        return None
+        return self.index.column(x)[0]
 
     def rightmost_not_equal(self, y):
         """
@@ -130,11 +414,7 @@ class RasterPlotter:
 
         if all pixels skipped returns None
         """
-        for x in range(self.width - 1, -1, -1):
-            pixel = self.px(x, y)
-            if pixel != self.skip_pixel:
-                return x
-        return None
+        return self.index.row(y)[1]
 
     def bottommost_not_equal(self, x):
         """
@@ -142,11 +422,7 @@ class RasterPlotter:
 
         if all pixels skipped returns None
         """
-        for y in range(self.height - 1, -1, -1):
-            pixel = self.px(x, y)
-            if pixel != self.skip_pixel:
-                return y
-        return None
+        return self.index.column(x)[1]
 
     def nextcolor_left(self, x, y, default=None):
         """
@@ -162,12 +438,11 @@ class RasterPlotter:
         if self.width < x:
             return self.width
 
-        v = self.px(x, y)
-        for ix in range(x, -1, -1):
-            pixel = self.px(ix, y)
-            if pixel != v:
-                return ix
-        return 0
+        changes = self.index.row(y)[2]
+        i = bisect_right(changes, x)
+        if i == 0:
+            return 0
+        return changes[i - 1] - 1
 
     def nextcolor_top(self, x, y, default=None):
         """
@@ -183,12 +458,11 @@ class RasterPlotter:
         if self.height < y:
             return self.height
 
-        v = self.px(x, y)
-        for iy in range(y, -1, -1):
-            pixel = self.px(x, iy)
-            if pixel != v:
-                return iy
-        return 0
+        changes = self.index.column(x)[2]
+        i = bisect_right(changes, y)
+        if i == 0:
+            return 0
+        return changes[i - 1] - 1
 
     def nextcolor_right(self, x, y, default=None):
         """
@@ -204,12 +478,11 @@ class RasterPlotter:
         if self.width <= x:
             return default
 
-        v = self.px(x, y)
-        for ix in range(x, self.width):
-            pixel = self.px(ix, y)
-            if pixel != v:
-                return ix
-        return self.width - 1
+        changes = self.index.row(y)[2]
+        i = bisect_right(changes, x)
+        if i == len(changes):
+            return self.width - 1
+        return changes[i]
 
     def nextcolor_bottom(self, x, y, default=None):
         """
@@ -225,12 +498,11 @@ class RasterPlotter:
         if self.height <= y:
             return default
 
-        v = self.px(x, y)
-        for iy in range(y, self.height):
-            pixel = self.px(x, iy)
-            if pixel != v:
-                return iy
-        return self.height - 1
+        changes = self.index.column(x)[2]
+        i = bisect_right(changes, y)
+        if i == len(changes):
+            return self.height - 1
+        return changes[i]
 
     def calculate_next_horizontal_pixel(self, y, dy=1, rightside=False):
         """
@@ -342,6 +614,69 @@ class RasterPlotter:
         t = self.traversal
         return bool(t & RIGHT), bool(t & BOTTOM), not bool(t & Y_AXIS), bool(t & Y_AXIS)
 
+    def travel(self):
+        """
+        Follows the traversal of plot() by the bounds of the scanlines alone, without reading their pixels.
+
+        :return: list of the distance scanned, the value changes, the distance stepped to the next scanline and the
+        distance moved along it to its start after a jump, in pixels, of each scanline rastered.
+        """
+        if self.initial_x is None:
+            return []
+        x, y = self.initial_position()
+        if self.traversal & Y_AXIS:
+            along, line, count = y, x, self.width
+            forward = not self.traversal & BOTTOM
+            dl = -1 if self.traversal & RIGHT else 1
+            first, last = self.topmost_not_equal, self.bottommost_not_equal
+            runs = self.index.runs(0)
+
+            def next_pixel(n, dn, side):
+                next_x, next_y = self.calculate_next_vertical_pixel(n, dn, side)
+                return next_y, next_x
+        else:
+            along, line, count = x, y, self.height
+            forward = not self.traversal & RIGHT
+            dl = -1 if self.traversal & BOTTOM else 1
+            first, last = self.leftmost_not_equal, self.rightmost_not_equal
+            runs = self.index.runs(1)
+            next_pixel = self.calculate_next_horizontal_pixel
+        travel = []
+        while 0 <= line < count:
+            lower_bound = first(line)
+            if lower_bound is None:
+                line += dl
+                continue
+            upper_bound = last(line)
+            next_along, next_line = next_pixel(line + dl, dl, forward)
+            jump = self.jumps and next_line is not None and abs(next_line - line) > 1
+            if next_along is not None:
+                if jump:
+                    upper_bound += self.overscan
+                    lower_bound -= self.overscan
+                else:
+                    upper_bound = max(next_along, upper_bound) + self.overscan
+                    lower_bound = min(next_along, lower_bound) - self.overscan
+            scanned = 0
+            if forward and along <= upper_bound:
+                scanned = upper_bound - along
+                along = upper_bound
+            elif not forward and lower_bound <= along:
+                scanned = along - lower_bound
+                along = lower_bound
+            if next_line is None:
+                travel.append((scanned, runs[line], 0, 0))
+                break
+            moved = 0
+            if jump:
+                start = next_along + self.overscan if forward else next_along - self.overscan
+                moved = abs(start - along)
+                along = start
+            travel.append((scanned, runs[line], abs(next_line - line), moved))
+            line = next_line
+            forward = not forward
+        return travel
+
     def plot(self):
         """
         Plot the values yielded by following the given raster plotter in the traversal defined.
@@ -377,9 +712,15 @@ class RasterPlotter:
                 upper_bound = self.bottommost_not_equal(x)
 
                 next_x, next_y = self.calculate_next_vertical_pixel(x + dx, dx, dy > 0)  # y + dy, dy, dx > 0
+                jump = self.jumps and next_x is not None and abs(next_x - x) > 1
                 if next_y is not None:
-                    upper_bound = max(next_y, upper_bound) + self.overscan
-                    lower_bound = min(next_y, lower_bound) - self.overscan
+                    if jump:
+                        # The next scanline is reached by a jump, this one only needs to stop.
+                        upper_bound += self.overscan
+                        lower_bound -= self.overscan
+                    else:
+                        upper_bound = max(next_y, upper_bound) + self.overscan
+                        lower_bound = min(next_y, lower_bound) - self.overscan
 
                 while (dy > 0 and y <= upper_bound) or (dy < 0 and lower_bound <= y):
                     if dy > 0:  # going right
@@ -409,6 +750,11 @@ class RasterPlotter:
                     break
                 x = next_x
                 yield offset_x + x * step, offset_y + y * step, 0
+                if jump:
+                    start = next_y + self.overscan if dy > 0 else next_y - self.overscan
+                    if start != y:
+                        y = start
+                        yield offset_x + x * step, offset_y + y * step, 0
                 dy = -dy
         else:
             # This code is left<->right row rastering.
@@ -421,9 +767,15 @@ class RasterPlotter:
                 upper_bound = self.rightmost_not_equal(y)
 
                 next_x, next_y = self.calculate_next_horizontal_pixel(y + dy, dy, dx > 0)
+                jump = self.jumps and next_y is not None and abs(next_y - y) > 1
                 if next_x is not None:
-                    upper_bound = max(next_x, upper_bound) + self.overscan
-                    lower_bound = min(next_x, lower_bound) - self.overscan
+                    if jump:
+                        # The next scanline is reached by a jump, this one only needs to stop.
+                        upper_bound += self.overscan
+                        lower_bound -= self.overscan
+                    else:
+                        upper_bound = max(next_x, upper_bound) + self.overscan
+                        lower_bound = min(next_x, lower_bound) - self.overscan
 
                 while (dx > 0 and x <= upper_bound) or (dx < 0 and lower_bound <= x):
                     if dx > 0:  # going right
@@ -453,4 +805,9 @@ class RasterPlotter:
                     break
                 y = next_y
                 yield offset_x + x * step, offset_y + y * step, 0
+                if jump:
+                    start = next_x + self.overscan if dx > 0 else next_x - self.overscan
+                    if start != x:
+                        x = start
+                        yield offset_x + x * step, offset_y + y * step, 0
                 dx = -dx
@@ -0,0 +1,243 @@
+import mmap
+import os
+import tempfile
+import weakref
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+"""
+TiledRaster holds a large 1-bit or 8-bit raster in a memory mapped temporary file rather than in memory.
+
+A full bed at the native 1000 dpi of the stepper motors is over a hundred million pixels. Decoded by Pillow, and copied
+again by each step preparing the raster, such an image takes gigabytes. A TiledRaster stores the rows packed in order,
+8 pixels to a byte for 1-bit and a byte per pixel for 8-bit, each row padded to whole bytes as in Pillow's raw '1' and
+'L' modes. The rows are grouped into tiles of full width, the unit in which the raster is written and streamed. Written
+tiles are released from memory, and rows are read from the file without mapping them in, so only the rows in use take
+memory.
+
+An 8-bit raster is taken as a Pillow image sharing the mapped file. Pillow cannot map packed bits, so the image of a
+1-bit raster is decoded into memory when asked for.
+"""
+
+TILE_HEIGHT = 256  # Rows per tile.
+STORE_PIXELS = 16000000  # Actualized images with more pixels are stored in a TiledRaster.
+
+
+class TiledRaster:
+    """
+    Memory mapped raster of mode '1' or 'L'.
+
+    Pixels are read as data[x, y] like the pixel access of an image, 1-bit pixels read as 0 or 255.
+    """
+
+    def __init__(self, width, height, mode='L', tile_height=TILE_HEIGHT):
+        if mode not in ('1', 'L'):
+            raise ValueError("TiledRaster holds mode '1' or 'L' rasters.")
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.tile_height = tile_height
+        self.stride = (width + 7) // 8 if mode == '1' else width
+        length = max(1, self.stride * height)
+        self._file = tempfile.TemporaryFile(prefix='meerk40t-raster-')
+        self._file.truncate(length)
+        self.buffer = mmap.mmap(self._file.fileno(), length)
+        self._image = None
+        self._row = (None, None)  # Last row read by pixel, as a byte per pixel.
+
+    def __repr__(self):
+        return "TiledRaster(%d, %d, '%s')" % (self.width, self.height, self.mode)
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    def tiles(self):
+        """
+        :return: the first and end row of each tile.
+        """
+        for y in range(0, self.height, self.tile_height):
+            yield y, min(y + self.tile_height, self.height)
+
+    def close(self):
+        self.buffer.close()
+        self._file.close()
+
+    def release(self, y0, y1):
+        """
+        Releases the memory paged in for the rows, they are read back from the file when next needed.
+        """
+        if not hasattr(self.buffer, 'madvise'):
+            return
+        start = (y0 * self.stride) // mmap.PAGESIZE * mmap.PAGESIZE
+        end = y1 * self.stride
+        if end > start:
+            self.buffer.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+    def write(self, y, image):
+        """
+        Writes the rows of the image, of the same mode and width, starting at row y.
+        """
+        if image.mode != self.mode or image.size[0] != self.width:
+            raise ValueError
+        data = image.tobytes()
+        self.buffer[y * self.stride:y * self.stride + len(data)] = data
+        self._row = (None, None)
+
+    def read(self, y0, y1):
+        """
+        :return: packed bytes of rows y0 to y1.
+        """
+        if hasattr(os, 'pread'):
+            return os.pread(self._file.fileno(), (y1 - y0) * self.stride, y0 * self.stride)
+        return self.buffer[y0 * self.stride:y1 * self.stride]
+
+    def band(self, y0, y1):
+        """
+        :return: Pillow image of the rows y0 to y1.
+        """
+        from PIL import Image
+        return Image.frombytes(self.mode, (self.width, y1 - y0), self.read(y0, y1))
+
+    def rows(self, y0, y1):
+        """
+        :return: numpy array of the pixel values of rows y0 to y1, indexed [y, x].
+        """
+        array = np.frombuffer(self.read(y0, y1), dtype=np.uint8).reshape((y1 - y0, self.stride))
+        if self.mode == '1':
+            return np.unpackbits(array, axis=1)[:, :self.width] * np.uint8(255)
+        return array
+
+    def row(self, y):
+        """
+        :return: list of the pixel values of row y.
+        """
+        data = self.read(y, y + 1)
+        if self.mode == 'L':
+            return list(data)
+        return [255 if data[x >> 3] & (0x80 >> (x & 7)) else 0 for x in range(self.width)]
+
+    def column(self, x):
+        """
+        :return: list of the pixel values of column x.
+        """
+        column = []
+        for y0, y1 in self.tiles():
+            column.extend(self.read(y0, y1)[x if self.mode == 'L' else x >> 3::self.stride])
+        if self.mode == 'L':
+            return column
+        bit = 0x80 >> (x & 7)
+        return [255 if v & bit else 0 for v in column]
+
+    def __getitem__(self, key):
+        x, y = key
+        row = self._row
+        if row[0] != y:
+            if self.mode == 'L':
+                row = self._row = (y, self.read(y, y + 1))
+            elif np is not None:
+                row = self._row = (y, self.rows(y, y + 1).tobytes())
+            else:
+                row = self._row = (y, bytes(self.row(y)))
+        return row[1][x]
+
+    def getbbox(self):
+        """
+        :return: bounding box of the non-zero pixels, as Pillow's getbbox(), or None when there are none.
+        """
+        box = None
+        for y0, y1 in self.tiles():
+            b = self.band(y0, y1).getbbox()
+            if b is None:
+                continue
+            b = (b[0], b[1] + y0, b[2], b[3] + y0)
+            if box is None:
+                box = b
+            else:
+                box = (min(box[0], b[0]), box[1], max(box[2], b[2]), b[3])
+        return box
+
+    def crop(self, box):
+        """
+        :return: new TiledRaster of the box within this raster.
+        """
+        left, upper, right, lower = box
+        raster = TiledRaster(right - left, lower - upper, self.mode, self.tile_height)
+        for y0, y1 in raster.tiles():
+            raster.write(y0, self.band(upper + y0, upper + y1).crop((left, 0, right, y1 - y0)))
+            raster.release(y0, y1)
+        return raster
+
+    def image(self):
+        """
+        :return: Pillow image of the raster. For 8-bit rasters the image shares the mapped file.
+        """
+        image = self._image() if self._image is not None else None
+        if image is None:
+            from PIL import Image
+            image = Image.frombuffer(self.mode, self.size, self.buffer, 'raw', self.mode, 0, 1)
+            self._image = weakref.ref(image)
+        return image
+
+    def backs(self, image):
+        """
+        :return: whether the image is the image of this raster.
+        """
+        return self._image is not None and self._image() is image
+
+    def thumbnail(self, width, height):
+        """
+        :return: Pillow image of the raster resized to width and height, resized tile by tile.
+        """
+        from PIL import Image
+        thumbnail = Image.new(self.mode if self.mode != '1' else 'L', (width, height))
+        scale = height / float(self.height)
+        for y0, y1 in self.tiles():
+            top = int(round(y0 * scale))
+            bottom = int(round(y1 * scale))
+            if bottom > top:
+                band = self.band(y0, y1)
+                if band.mode != thumbnail.mode:
+                    band = band.convert(thumbnail.mode)
+                thumbnail.paste(band.resize((width, bottom - top)), (0, top))
+        return thumbnail
+
+    @classmethod
+    def from_image(cls, image, mode=None, tile_height=TILE_HEIGHT):
+        """
+        :return: TiledRaster of the image, converted to mode '1' or 'L' a tile at a time.
+        """
+        if mode is None:
+            mode = '1' if image.mode == '1' else 'L'
+        width, height = image.size
+        raster = cls(width, height, mode, tile_height)
+        for y0, y1 in raster.tiles():
+            band = image.crop((0, y0, width, y1))
+            if band.mode != mode:
+                band = band.convert(mode)
+            raster.write(y0, band)
+            raster.release(y0, y1)
+        return raster
+
+    @classmethod
+    def transformed(cls, image, size, coefficients, resample, tile_height=TILE_HEIGHT):
+        """
+        Transforms the mode '1' or 'L' image with an affine transform into a TiledRaster, a tile at a time. Each tile
+        is the same as the rows of image.transform(size, Image.AFFINE, coefficients, resample).
+
+        :return: TiledRaster of the transformed image.
+        """
+        from PIL import Image
+        width, height = size
+        a, b, c, d, e, f = coefficients
+        raster = cls(width, height, image.mode, tile_height)
+        for y0, y1 in raster.tiles():
+            # Output row y of the tile is row y0 + y of the whole transform.
+            band = image.transform((width, y1 - y0), Image.AFFINE, (a, b, c + b * y0, d, e, f + e * y0),
+                                   resample=resample)
+            raster.write(y0, band)
+            raster.release(y0, y1)
+        return raster
@@ -111,81 +111,40 @@ class RuidaInterpreter(Interpreter):
     def unlock_rail(self):
         pass
 
-    def command(self, command, values=None):
-        if command == COMMAND_LASER_OFF:
-            self.laser_off()
-        elif command == COMMAND_LASER_ON:
-            self.laser_on()
-        elif command == COMMAND_MOVE:
-            x, y = values
-            self.move(x, y)
-        elif command == COMMAND_HOME:
-            self.home()
-        elif command == COMMAND_LOCK:
-            self.lock_rail()
-        elif command == COMMAND_UNLOCK:
-            self.unlock_rail()
-        elif command == COMMAND_PLOT:
-            path = values
-            if len(path) == 0:
-                return
-            first_point = path.first_point
-            self.move_absolute(first_point[0], first_point[1])
-            for x, y, on in ZinglPlotter.plot_path(path):
-                self.move_absolute(x, y)
-        elif command == COMMAND_RASTER:
-            raster = values
-            for x, y, on in raster.plot():
-                if on:
-                    self.laser_on()
-                else:
-                    self.laser_off()
-                self.move_absolute(x, y)
-        elif command == COMMAND_SET_SPEED:
-            speed = values
-            self.set_speed(speed)
-        elif command == COMMAND_SET_POWER:
-            power = values
-            self.set_power(power)
-        elif command == COMMAND_SET_STEP:
-            step = values
-            self.set_step(step)
-        elif command == COMMAND_SET_D_RATIO:
-            pass
-        elif command == COMMAND_SET_DIRECTION:
-            pass
-        elif command == COMMAND_SET_INCREMENTAL:
-            self.is_relative = True
-        elif command == COMMAND_SET_ABSOLUTE:
-            self.is_relative = False
-        elif command == COMMAND_SET_POSITION:
-            x, y = values
-            self.device.current_x = x
-            self.device.current_y = y
-        elif command == COMMAND_MODE_PROGRAM:
-            pass
-        elif command == COMMAND_MODE_RAPID:
-            self.default_mode()
-        elif command == COMMAND_MODE_RAPID:
-            pass
-        elif command == COMMAND_MODE_FINISHED:
-            pass
-        elif command == COMMAND_WAIT:
-            t = values
-            self.next_run = t
-        elif command == COMMAND_WAIT_FINISH:
-            self.extra_hold = lambda e: len(self.pipe) == 0
-        elif command == COMMAND_BEEP:
-            print('\a')  # Beep.
-        elif command == COMMAND_FUNCTION:
-            t = values
-            if callable(t):
-                t()
-        elif command == COMMAND_SIGNAL:
-            if isinstance(values, str):
-                self.device.signal(values, None)
-            elif len(values) >= 2:
-                self.device.signal(values[0], *values[1:])
+    @classmethod
+    def build_command_table(cls):
+        table = Interpreter.build_command_table()
+        no_operation = lambda s, v: None
+        table.update({
+            COMMAND_SET_D_RATIO: no_operation,
+            COMMAND_SET_DIRECTION: no_operation,
+            COMMAND_MODE_PROGRAM: no_operation,
+            COMMAND_MODE_FINISHED: no_operation,
+            COMMAND_MODE_RAPID: lambda s, v: s.default_mode(),
+        })
+        for command in (COMMAND_LASER_DISABLE, COMMAND_LASER_ENABLE, COMMAND_CUT, COMMAND_JOG, COMMAND_JOG_SWITCH,
+                        COMMAND_JOG_FINISH, COMMAND_JOG_AUTO, COMMAND_SET_PPI, COMMAND_SET_OVERSCAN, COMMAND_SET_ACCELERATION):
+            del table[command]  # Not supported by the Ruida.
+        return table
+
+    def plot_path(self, path):
+        if len(path) == 0:
+            return
+        first_point = path.first_point
+        self.move_absolute(first_point[0], first_point[1])
+        for x, y, on in ZinglPlotter.plot_path(path):
+            self.move_absolute(x, y)
+
+    def plot_raster(self, raster):
+        for x, y, on in raster.plot():
+            if on:
+                self.laser_on()
+            else:
+                self.laser_off()
+            self.move_absolute(x, y)
+
+    def beep(self, *values):
+        print('\a')  # Beep.
 
     def realtime_command(self, command, values=None):
         if command == COMMAND_SET_SPEED:
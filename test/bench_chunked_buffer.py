@@ -0,0 +1,67 @@
+"""
+Benchmark of the controller packet rate against the amount of data queued, for the ChunkedBuffer queues and for the
+bytes queues they replaced. It is not part of the test suite, run it as a script:
+
+    python test/bench_chunked_buffer.py
+
+Each packet peeks at the head of the queue for a line end and consumes up to 30 bytes, as the controller does.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ChunkedBuffer import ChunkedBuffer
+
+LINE = b'IB100RA100LB100TA100' * 3 + b'\n'
+
+
+class BytesBuffer:
+    """
+    Immutable bytes queue, every consume copies the bytes that remain.
+    """
+
+    def __init__(self):
+        self.data = b''
+
+    def __len__(self):
+        return len(self.data)
+
+    def append(self, data):
+        self.data += data
+
+    def peek(self, length):
+        return self.data[:length]
+
+    def consume(self, length):
+        self.data = self.data[length:]
+
+
+def fill(buffer, queued):
+    lines = LINE * (queued // len(LINE) + 1)
+    buffer.append(lines[:queued])
+    return buffer
+
+
+def packets_per_second(buffer, packets):
+    start = time.perf_counter()
+    for i in range(packets):
+        head = buffer.peek(31)
+        find = head.find(b'\n', 0, 30)
+        buffer.consume(30 if find == -1 else find + 1)
+    return packets / (time.perf_counter() - start)
+
+
+def main():
+    print("%-10s %16s %16s" % ("queued", "ChunkedBuffer", "bytes"))
+    for queued in (100000, 1000000, 10000000):
+        chunked = max(packets_per_second(fill(ChunkedBuffer(), queued), 3000) for i in range(3))
+        copied = max(packets_per_second(fill(BytesBuffer(), queued), 100) for i in range(3))
+        print("%-10s %14d/s %14d/s" % ("%dkB" % (queued // 1000), chunked, copied))
+
+
+if __name__ == "__main__":
+    main()
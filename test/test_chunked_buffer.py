@@ -0,0 +1,97 @@
+from __future__ import print_function
+
+import unittest
+
+from ChunkedBuffer import ChunkedBuffer
+
+
+class Chunk(bytes):
+    """
+    Chunk recording its index in touched whenever it is read or measured.
+    """
+
+    def __new__(cls, data, index, touched):
+        chunk = bytes.__new__(cls, data)
+        chunk.index = index
+        chunk.touched = touched
+        return chunk
+
+    def __len__(self):
+        self.touched.add(self.index)
+        return bytes.__len__(self)
+
+    def __getitem__(self, key):
+        self.touched.add(self.index)
+        return bytes.__getitem__(self, key)
+
+
+class TestChunkedBuffer(unittest.TestCase):
+
+    def test_append_consume(self):
+        buffer = ChunkedBuffer(chunk_size=8)
+        expected = b''
+        for i in range(100):
+            data = (b'%d,' % i) * (i % 7)
+            buffer.append(data)
+            expected += data
+            if i % 3 == 0:
+                buffer.consume(5)
+                expected = expected[5:]
+            self.assertEqual(len(buffer), len(expected))
+            self.assertEqual(bytes(buffer), expected)
+            self.assertEqual(buffer.peek(30), expected[:30])
+
+    def test_prepend(self):
+        buffer = ChunkedBuffer(b'abcdefgh')
+        buffer.consume(3)
+        buffer.prepend(b'PN!\n')
+        self.assertEqual(bytes(buffer), b'PN!\ndefgh')
+        buffer.prepend(b'I*\n')
+        self.assertEqual(buffer.peek(5), b'I*\nPN')
+
+    def test_extend(self):
+        buffer = ChunkedBuffer(b'123')
+        queue = ChunkedBuffer(b'456789')
+        queue.consume(2)
+        buffer.extend(queue)
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(bytes(buffer), b'1236789')
+        queue.append(b'ab')
+        self.assertEqual(bytes(buffer), b'1236789')
+        self.assertEqual(bytes(queue), b'ab')
+
+    def test_consume_past_end(self):
+        buffer = ChunkedBuffer(b'abc')
+        buffer.consume(10)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(buffer.peek(30), b'')
+        buffer.append(b'xyz')
+        self.assertEqual(buffer.peek(30), b'xyz')
+
+    def test_find(self):
+        buffer = ChunkedBuffer(chunk_size=4)
+        for c in (b'ab', b'cd', b'e\n', b'fg'):
+            buffer.append(c)
+        self.assertEqual(buffer.find(b'\n', 0, 30), 5)
+        self.assertEqual(buffer.find(b'\n', 0, 5), -1)
+
+    def test_packets_touch_head(self):
+        """
+        Sending a packet must not depend on the amount of data queued behind it, only the head chunks are touched.
+        """
+        line = b'IB100RA100LB100TA100' * 3 + b'\n'
+        for queued in (100, 10000):
+            touched = set()
+            buffer = ChunkedBuffer(chunk_size=64)
+            for i in range(queued):
+                buffer.append(line)
+            buffer._chunks = type(buffer._chunks)(Chunk(c, i, touched) for i, c in enumerate(buffer._chunks))
+            sent = 0
+            for i in range(50):
+                head = buffer.peek(31)
+                find = head.find(b'\n', 0, 30)
+                packet = 30 if find == -1 else find + 1
+                buffer.consume(packet)
+                sent += packet
+            self.assertEqual(len(buffer), queued * len(line) - sent)
+            self.assertLessEqual(max(touched), sent // 64 + 2)
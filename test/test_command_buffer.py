@@ -0,0 +1,84 @@
+from __future__ import print_function
+
+import unittest
+
+from CommandBuffer import CommandBuffer
+from Kernel import Interpreter
+from LaserCommandConstants import *
+from svgelements import Path, Rect
+
+
+class Device:
+    opt_jog_minimum = 127
+
+
+class RecordingInterpreter(Interpreter):
+    def __init__(self):
+        Interpreter.__init__(self)
+        self.device = Device()
+        self.calls = []
+
+    def jog(self, x, y, mode=0, min_jog=127):
+        self.calls.append(('jog', x, y, mode, min_jog))
+
+    def plot_path(self, path):
+        self.calls.append(('plot', path))
+
+    def set_speed(self, speed=None):
+        self.calls.append(('speed', speed))
+
+    def set_directions(self, left, top, x_dir, y_dir):
+        self.calls.append(('directions', left, top, x_dir, y_dir))
+
+    def ensure_program_mode(self, *values):
+        self.calls.append(('program',))
+
+
+def commands():
+    path = Path(Rect(0, 0, 10, 10))
+    return [(COMMAND_SET_SPEED, 25), (COMMAND_SET_DIRECTION, False, True, True, False), (COMMAND_MODE_PROGRAM,),
+            (COMMAND_JOG_SWITCH, 10.5, 20.25), (COMMAND_PLOT, path), (COMMAND_SET_SPEED, None), (9999, 1, 2)]
+
+
+class TestCommandBuffer(unittest.TestCase):
+
+    def test_round_trip(self):
+        buffer = CommandBuffer()
+        for command in commands():
+            buffer.append(*command)
+        self.assertEqual(len(buffer), len(commands()))
+        self.assertEqual(list(buffer), commands())
+        self.assertEqual([type(v) for v in list(buffer)[3]], [int, float, float])
+        self.assertEqual([type(v) for v in list(buffer)[1]], [int, bool, bool, bool, bool])
+        buffer.clear()
+        self.assertEqual(len(buffer), 0)
+
+    def test_execute(self):
+        def spooled():
+            for command in commands():
+                yield command
+
+        def buffered():
+            buffer = CommandBuffer()
+            for command in commands():
+                buffer.append(*command)
+            yield COMMAND_SET_SPEED, 1
+            yield CommandBuffer()
+            yield buffer
+            yield COMMAND_SET_SPEED, 2
+
+        results = []
+        for generator in (spooled(), buffered()):
+            interpreter = RecordingInterpreter()
+            interpreter.spooled_item = generator
+            while interpreter.spooled_item is not None:
+                interpreter.execute()
+            results.append(interpreter.calls)
+        self.assertEqual(results[0], results[1][1:-1])
+        self.assertEqual(results[1][0], ('speed', 1))
+        self.assertEqual(results[1][-1], ('speed', 2))
+        self.assertEqual(results[0][3], ('jog', 10.5, 20.25, 1, 127))
+
+    def test_command_table(self):
+        self.assertIs(RecordingInterpreter.command_table(), RecordingInterpreter().dispatch_table)
+        self.assertIsNot(RecordingInterpreter.command_table(), Interpreter.command_table())
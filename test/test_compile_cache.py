@@ -0,0 +1,60 @@
+from __future__ import print_function
+
+import os
+import tempfile
+import time
+import unittest
+
+from CompileCache import CompileCache
+from LaserOperation import LaserOperation
+from LhystudiosCompiler import compile_key
+from svgelements import Path, Rect, Circle
+
+
+def operation(r=800, speed=15):
+    op = LaserOperation(operation='Cut', speed=speed, power=1000)
+    op.append(Path(Rect(500, 500, 2000, 1000)))
+    op.append(Path(Circle(3000, 3000, r)))
+    return op
+
+
+class TestCompileCache(unittest.TestCase):
+
+    def test_lru(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = CompileCache(directory, max_size=3000)
+            self.assertIsNone(cache.get('a'))
+            cache.put('a', b'A' * 900, dict(state=1))
+            cache.put('b', b'B' * 900, dict(state=2))
+            cache.put('c', b'C' * 900, dict(state=3))
+            self.assertEqual(cache.get('a'), (b'A' * 900, dict(state=1)))  # b is now least recently used.
+            cache.put('d', b'D' * 900, dict(state=4))
+            self.assertIsNone(cache.get('b'))
+            self.assertEqual(len(cache), 3)
+            self.assertLessEqual(cache.size, 3000)
+            self.assertEqual((cache.hits, cache.misses, cache.stores, cache.evictions), (1, 2, 4, 1))
+            cache.put('e', b'E' * 4000, dict(state=5))  # Larger than the cache.
+            self.assertEqual(len(cache), 3)
+
+            path = cache.path('a')
+            os.utime(path, (time.time() + 10, time.time() + 10))
+            reopened = CompileCache(directory, max_size=3000)
+            self.assertEqual(list(reopened.entries), ['c', 'd', 'a'])
+            self.assertEqual(reopened.size, cache.size)
+            self.assertTrue(list(reopened.report()))
+            reopened.clear()
+            self.assertEqual(len(reopened), 0)
+            self.assertEqual([f for f in os.listdir(directory)], [])
+
+    def test_compile_key(self):
+        state = dict(current_x=0, current_y=0, speed=30)
+        settings = dict(board='M2', swap_xy=False)
+        key = compile_key(operation(), state, settings)
+        self.assertEqual(key, compile_key(operation(), state, settings))
+        self.assertNotEqual(key, compile_key(operation(r=801), state, settings))
+        self.assertNotEqual(key, compile_key(operation(speed=16), state, settings))
+        self.assertNotEqual(key, compile_key(operation(), dict(state, current_x=1), settings))
+        self.assertNotEqual(key, compile_key(operation(), state, dict(settings, swap_xy=True)))
+        moved = operation()
+        moved[1] *= 'translate(1,0)'
+        self.assertNotEqual(key, compile_key(moved, state, settings))
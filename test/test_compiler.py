@@ -0,0 +1,89 @@
+from __future__ import print_function
+
+import sys
+import time
+import unittest
+
+from LaserOperation import LaserOperation
+from LhystudiosCompiler import CompilerProcess, CompilerDevice, LhymicroCompiler, interpreter_state
+from LhystudiosDevice import LhymicroInterpreter
+from svgelements import Path, Rect, Circle
+
+SETTINGS = dict(board='M2', autolock=True, swap_xy=False, flip_x=False, flip_y=False, home_right=False,
+                home_bottom=False, home_adjust_x=0, home_adjust_y=0, bed_width=320, bed_height=220,
+                opt_rapid_between=True, opt_jog_mode=0, opt_jog_minimum=127, opt_peephole=False,
+                jog_rapid_speed=150.0, jog_event_time=10, jog_switch_time=30, jog_finish_time=250)
+
+
+class Connection:
+    def __init__(self):
+        self.messages = []
+
+    def send(self, message):
+        self.messages.append(message)
+
+    def poll(self):
+        return False
+
+
+def operations():
+    cut = LaserOperation(operation='Cut', speed=15, power=1000)
+    cut.append(Path(Rect(500, 500, 2000, 1000)))
+    engrave = LaserOperation(operation='Engrave', speed=35, power=600)
+    engrave.append(Path(Circle(3000, 3000, 800)))
+    return cut, engrave
+
+
+def initial_state():
+    device = CompilerDevice(SETTINGS)
+    device.current_x = 100
+    device.current_y = 200
+    interpreter = LhymicroInterpreter(None)
+    interpreter.device = device
+    for name in ('next', 'max', 'min', 'start'):
+        setattr(interpreter, name + '_x', device.current_x)
+        setattr(interpreter, name + '_y', device.current_y)
+    return interpreter_state(interpreter)
+
+
+class TestCompiler(unittest.TestCase):
+
+    def test_compile(self):
+        state = initial_state()
+        connection = Connection()
+        compiler = LhymicroCompiler(connection)
+        expected = []
+        for operation in operations():
+            del connection.messages[:]
+            state = compiler.compile(1, operation, state, SETTINGS)
+            expected.append((b''.join(m[2] for m in connection.messages if m[0] == 'data'), state))
+        self.assertTrue(expected[0][0].startswith(b'I'))
+        self.assertEqual((expected[1][1]['current_x'], expected[1][1]['current_y']), (3800, 3000))
+
+        process = CompilerProcess()
+        process.start()
+        try:
+            state = initial_state()
+            for operation, (data, final_state) in zip(operations(), expected):
+                job = process.compile(operation, state, SETTINGS)
+                start = time.time()
+                while job.state is None and job.error is None and time.time() - start < 20:
+                    self.assertTrue(process.receive(job))
+                    time.sleep(0.01)
+                self.assertIsNone(job.error)
+                self.assertEqual(job.read(len(job.data)), data)
+                self.assertTrue(job.finished())
+                self.assertEqual(job.state, final_state)
+                state = job.state
+        finally:
+            process.stop()
+        self.assertFalse(process.is_alive())
+
+    def test_frozen(self):
+        sys.frozen = True  # The executable of a frozen build cannot run the compiler module.
+        try:
+            process = CompilerProcess()
+            self.assertRaises(ConnectionRefusedError, process.start)
+            self.assertIsNone(process.process)
+        finally:
+            del sys.frozen
@@ -0,0 +1,74 @@
+from __future__ import print_function
+
+import gc
+import unittest
+
+from GeometryCache import GeometryCache
+from LaserOperation import LaserOperation
+from svgelements import Path, Rect, Circle, Matrix
+
+
+def spooled(operation):
+    commands = []
+    for command in operation.generate(rapid=True, jog=0):
+        if isinstance(command, int):
+            commands.append((command,))
+        elif isinstance(command, tuple):
+            commands.append(command)
+        else:
+            commands.extend(command)
+    return [tuple(str(v) if isinstance(v, Path) else v for v in command) for command in commands]
+
+
+def element():
+    path = Path(Rect(0, 0, 1000, 500)) + Path(Circle(3000, 3000, 800))
+    path *= 'rotate(30)'
+    return path
+
+
+class TestGeometryCache(unittest.TestCase):
+
+    def test_cache(self):
+        cache = GeometryCache()
+        path = element()
+        subpaths = cache.subpaths(path)
+        self.assertEqual(len(subpaths), 2)
+        self.assertIs(cache.subpaths(path), subpaths)
+        self.assertIs(cache.plot(path), cache.plot(path))
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.segments, len(cache.plot(path)) + sum(len(p) for p in subpaths))
+        path *= 'scale(2)'  # Transform changed.
+        self.assertIsNot(cache.subpaths(path), subpaths)
+        subpaths = cache.subpaths(path)
+        path.geometry_version = 1  # Altered.
+        self.assertIsNot(cache.subpaths(path), subpaths)
+        self.assertEqual(cache.misses, 3)
+        self.assertEqual(len(cache), 1)
+        cache.discard(path)
+        self.assertEqual((len(cache), cache.segments), (0, 0))
+
+    def test_limit(self):
+        cache = GeometryCache(max_segments=30)
+        paths = [element() for i in range(4)]
+        for path in paths:
+            cache.plot(path)
+        self.assertLessEqual(cache.segments, 30)
+        self.assertLess(len(cache), 4)
+        cache.plot(paths[-1])
+        self.assertEqual(cache.hits, 1)  # Most recent is kept.
+        del paths, path
+        gc.collect()
+        self.assertEqual((len(cache), cache.segments), (0, 0))
+
+    def test_generate(self):
+        operation = LaserOperation(operation='Engrave', speed=35, power=600)
+        operation.append(element())
+        operation.append(element() * 'translate(500,500)')
+        cache = LaserOperation.geometry_cache
+        cache.clear()
+        expected = spooled(operation)
+        hits = cache.hits
+        self.assertEqual(spooled(operation), expected)
+        self.assertGreater(cache.hits, hits)
+        operation[0] *= Matrix('translate(100,0)')
+        self.assertNotEqual(spooled(operation), expected)
@@ -0,0 +1,42 @@
+from __future__ import print_function
+
+import unittest
+
+from LaserOperation import LaserOperation
+from LhystudiosCompiler import LhymicroCompiler
+from LhystudiosDevice import JogCostModel
+from svgelements import Path, Rect
+from test_compiler import Connection, SETTINGS, initial_state
+
+
+class TestJog(unittest.TestCase):
+
+    def test_choose(self):
+        model = JogCostModel()
+        speed, accel = model.program_speed('M2', 15.0)
+        self.assertAlmostEqual(speed, 15.0, delta=0.5)
+        self.assertEqual(accel, 1)
+        self.assertEqual(model.choose(200, speed, accel), 0)  # Short hop, stays in compact mode.
+        self.assertEqual(model.choose(10000, speed, accel), 2)  # Long jog, faster at rapid speed.
+        speed, accel = model.program_speed('M2', 200.0)
+        self.assertEqual(accel, 4)
+        self.assertEqual(model.choose(10000, speed, accel), 0)  # Cuts faster than rapid speed.
+        jogs, estimate, totals = model.summary()
+        self.assertEqual(jogs, 3)
+        self.assertLess(estimate, min(totals[0], totals[2]))
+        self.assertLessEqual(totals[0], totals[1])
+        model.reset()
+        self.assertEqual(model.summary(), (0, 0.0, (0.0, 0.0, 0.0)))
+
+    def test_compile(self):
+        operation = LaserOperation(operation='Cut', speed=15, power=1000)
+        path = Path(Rect(0, 0, 500, 500)) + Path(Rect(0, 150, 500, 500)) + Path(Rect(10000, 0, 500, 500))
+        operation.append(path)
+        settings = dict(SETTINGS)
+        settings['opt_jog_mode'] = 3
+        connection = Connection()
+        state = LhymicroCompiler(connection).compile(1, operation, initial_state(), settings)
+        code = b''.join(m[2] for m in connection.messages if m[0] == 'data')
+        self.assertEqual(code.count(b'FNSE-'), 2)  # The far jog and leaving program mode after the cut.
+        self.assertEqual(state['jog'][0], 2)
+        self.assertLess(state['jog'][1], state['jog'][2][0])
@@ -0,0 +1,179 @@
+from __future__ import print_function
+
+import random
+import unittest
+
+from LhystudiosDevice import LhystudioController, StatusPoller, ControllerMetrics, onewire_crc_lookup, \
+    onewire_crc_frames, STATUS_BUSY, STATUS_OK
+
+
+class TestLhystudioPacketizer(unittest.TestCase):
+
+    def test_crc_frames(self):
+        random.seed(30)
+        packets = [bytes([random.randrange(256) for i in range(30)]) for j in range(200)]
+        frames = onewire_crc_frames(packets)
+        for packet, frame in zip(packets, frames):
+            self.assertEqual(frame, b'\x00' + packet + bytes([onewire_crc_lookup(packet)]))
+
+    def test_packetize_pipe_commands(self):
+        controller = LhystudioController()
+        controller.write = controller._queue.append
+        controller.write(b'A' * 45 + b'\n')
+        controller.write(b'AB#\n')
+        controller.write(b'CD-\n')
+        controller.write(b'PN!\n')
+        controller.write(b'*\n')
+        controller.write(b'EF')
+        controller.packetize()
+        frames = list(controller._frames)
+        self.assertEqual([f[0] for f in frames], [
+            b'A' * 30,
+            b'A' * 15 + b'F' * 15,
+            b'AB' + b'B' * 28,
+            b'CD' + b'F' * 28,
+            b'PN' + b'F' * 28,
+            b'',
+        ])
+        self.assertEqual(frames[3][4], controller.wait_finished)
+        self.assertEqual(frames[4][3], controller._pause_busy)
+        self.assertEqual(frames[5][4], controller.abort)
+        self.assertIsNone(frames[5][1])
+        self.assertEqual(sum(f[2] for f in frames), controller._frames_length)
+        self.assertEqual(bytes(controller._buffer), b'EF')  # Partial packet waits for more data.
+        self.assertEqual(len(controller), 2 + controller._frames_length)
+
+    def test_telemetry_coalesced(self):
+        signals = []
+
+        class Device:
+            watchers = {}
+
+            def signal(self, code, *message):
+                signals.append((code, message))
+
+        controller = LhystudioController(device=Device())
+        for i in range(100):
+            controller.update_packet(b'%030d' % i)
+            controller.update_buffer()
+        controller.update_telemetry()
+        self.assertEqual([code for code, message in signals],
+                         ['pipe;buffer', 'pipe;packet', 'pipe;packet_text', 'pipe;metrics'])
+        self.assertEqual(signals[2][1], (b'%030d' % 99,))
+        del signals[:]
+        controller.update_telemetry()
+        self.assertEqual(signals, [])  # Nothing changed, metrics are signalled once a second.
+
+    def test_fast_reconnect(self):
+        from CH341MockDriver import CH341Driver
+        controller = LhystudioController()
+        controller.usb_log = lambda e: None
+        self.assertFalse(controller.reconnect())  # No driver to reclaim.
+        controller._disconnected = None
+        controller.driver = CH341Driver()
+        controller.driver.open()
+        controller.driver.close()
+        self.assertTrue(controller.reconnect())
+        self.assertTrue(controller.driver.is_open)
+        self.assertEqual(controller.metrics.reconnects, 1)
+        self.assertIsNone(controller._disconnected)
+
+
+class TestStatusPoller(unittest.TestCase):
+
+    def test_backoff(self):
+        poller = StatusPoller(minimum=0.00001, maximum=0.00008)
+        poller.begin()
+        intervals = []
+        for i in range(5):
+            poller.delay(STATUS_BUSY)
+            intervals.append(poller._interval)
+        self.assertEqual(intervals, [0.00001, 0.00002, 0.00004, 0.00008, 0.00008])
+        poller.delay(STATUS_OK)
+        self.assertEqual(poller._interval, 0.00001)
+
+    def test_floor_adapts(self):
+        poller = StatusPoller(minimum=0.00001, maximum=0.01)
+        for i in range(32):
+            poller.begin()
+            poller._start -= 0.004
+            poller.record()
+        self.assertEqual(len(poller.latencies), 32)
+        self.assertAlmostEqual(poller.floor, poller.percentile(50) / 4.0)
+        self.assertGreater(poller.floor, 0.0009)
+
+
+class TestControllerMetrics(unittest.TestCase):
+
+    def test_metrics(self):
+        metrics = ControllerMetrics()
+        for latency in (0.0003, 0.0008, 0.0008, 0.003, 0.2):
+            metrics.packet(30, latency)
+        metrics.packet(12)
+        metrics.reconnected(0.002)
+        metrics.underrun(True)
+        metrics.underrun(False)
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['packets'], 6)
+        self.assertEqual(snapshot['bytes'], 162)
+        histogram = dict(snapshot['latency_histogram'])
+        self.assertEqual(histogram[0.0005], 1)
+        self.assertEqual(histogram[0.001], 2)
+        self.assertEqual(histogram[0.005], 1)
+        self.assertEqual(histogram[float('inf')], 1)
+        self.assertAlmostEqual(snapshot['latency_max'], 0.2)
+        self.assertEqual(snapshot['reconnects'], 1)
+        self.assertGreater(snapshot['packets_per_second'], 0)
+        self.assertGreater(snapshot['underrun_time'], 0)
+        self.assertTrue(list(metrics.report()))
+
+    def test_drain_rate_watermark(self):
+        class Device:
+            buffer_target_ms = 500
+
+        controller = LhystudioController(device=Device())
+        metrics = controller.metrics
+        metrics.sample_drain(True)
+        metrics._drain_time -= 0.5
+        metrics.bytes += 1000
+        metrics.sample_drain(False)
+        self.assertAlmostEqual(metrics.drain_rate, 2000, delta=50)
+        metrics._drain_time -= 0.5
+        metrics.bytes += 10  # Starved interval, not sampled.
+        metrics.sample_drain(True)
+        self.assertAlmostEqual(metrics.drain_rate, 2000, delta=50)
+        controller.update_watermark()
+        self.assertAlmostEqual(controller.watermark, 1000, delta=25)
+        self.assertTrue(metrics.underrun(True))
+        self.assertFalse(metrics.underrun(True))
+        metrics.underrun(False)
+        self.assertEqual(metrics.underruns, 1)
+
+
+class TestSenderRing(unittest.TestCase):
+
+    def test_push_pop_discard(self):
+        from multiprocessing import shared_memory
+        from LhystudiosSender import SenderRing
+        from LhystudiosDevice import OP_FRAME, OP_WAIT
+        shm = shared_memory.SharedMemory(create=True, size=SenderRing.size(4, 2))
+        try:
+            shm.buf[:shm.size] = bytes(shm.size)
+            ring = SenderRing(shm, 4, 2)
+            frames = onewire_crc_frames([bytes([65 + i]) * 30 for i in range(6)])
+            self.assertTrue(all(ring.push(OP_FRAME, frame) for frame in frames[:4]))
+            self.assertFalse(ring.push(OP_FRAME, frames[4]))
+            self.assertTrue(ring.push(OP_WAIT, realtime=True))
+            self.assertEqual(ring.pop(True), (OP_WAIT, b'', 0))
+            self.assertEqual(ring.pop(), (OP_FRAME, frames[0], 0))
+            self.assertTrue(ring.push(OP_FRAME, frames[4]))
+            self.assertEqual(ring.pending(), 4)
+            ring.discard()
+            self.assertEqual(ring.pending(), 0)
+            self.assertIsNone(ring.pop())
+            self.assertTrue(ring.push(OP_FRAME, frames[5], length=29))
+            self.assertEqual(ring.pop(), (OP_FRAME, frames[5], 29))
+            ring.buf = None
+        finally:
+            shm.close()
+            shm.unlink()
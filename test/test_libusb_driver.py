@@ -0,0 +1,70 @@
+from __future__ import print_function
+
+import unittest
+
+try:
+    import usb.core
+    from CH341LibusbDriver import CH341LibusbDriver, mCH341_PARA_CMD_W0, mCH341_PARA_CMD_STS, BULK_WRITE_ENDPOINT
+except ImportError:
+    usb = None
+
+
+class FakeDevice:
+    """
+    Stands in for a pyusb device with a CH341 attached, recording the transfers.
+    """
+
+    def __init__(self, status=(255, 206, 0, 0, 0, 1), fail_read=False):
+        self.status = status
+        self.fail_read = fail_read
+        self.writes = []
+
+    def write(self, endpoint, data, timeout=None):
+        self.writes.append((endpoint, bytes(data)))
+        return len(data)
+
+    def read(self, endpoint, size_or_buffer, timeout=None):
+        if self.fail_read:
+            raise usb.core.USBError('timeout')
+        size_or_buffer[:] = type(size_or_buffer)('B', self.status)
+        return len(self.status)
+
+
+@unittest.skipIf(usb is None, "pyusb is not installed")
+class TestLibusbDriver(unittest.TestCase):
+
+    def driver(self, device, packet_size):
+        driver = CH341LibusbDriver(state_listener=lambda code: None)
+        driver.devices[0] = device
+        driver.packet_size[0] = packet_size
+        return driver
+
+    def test_write_packets(self):
+        frame = bytes(range(32))
+        expected = bytes([mCH341_PARA_CMD_W0]) + frame[:31] + bytes([mCH341_PARA_CMD_W0]) + frame[31:]
+        device = FakeDevice()
+        driver = self.driver(device, 0)
+        driver.CH341EppWriteData(0, frame, 32)
+        self.assertEqual(device.writes, [(BULK_WRITE_ENDPOINT, expected[:32]), (BULK_WRITE_ENDPOINT, expected[32:])])
+
+        device = FakeDevice()
+        driver = self.driver(device, 32)
+        driver.CH341EppWriteData(0, frame, 32)
+        driver.CH341EppWriteData(0, frame, 32)
+        self.assertEqual(device.writes, [(BULK_WRITE_ENDPOINT, expected)] * 2)
+        self.assertEqual(driver.timing['write'].count, 2)
+
+    def test_write_status(self):
+        device = FakeDevice()
+        driver = self.driver(device, 32)
+        status = driver.CH341EppWriteStatus(0, bytes(32), 32)
+        self.assertEqual(status, [255, 206, 0, 0, 0, 1])
+        self.assertEqual(device.writes[-1], (BULK_WRITE_ENDPOINT, bytes([mCH341_PARA_CMD_STS])))
+        self.assertEqual(driver.CH341GetStatus(0), status)
+        self.assertIsNot(driver.CH341GetStatus(0), status)  # Results are not the reused buffer.
+        self.assertEqual(driver.timing['write_status'].count, 1)
+        self.assertGreater(driver.timing['status'].minimum, 0.0)
+
+        device.fail_read = True
+        self.assertIsNone(driver.CH341EppWriteStatus(0, bytes(32), 32))  # Data was written.
+        self.assertRaises(ConnectionError, driver.CH341GetStatus, 0)
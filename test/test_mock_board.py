@@ -0,0 +1,49 @@
+from __future__ import print_function
+
+import time
+import unittest
+
+from CH341MockDriver import LhystudioBoard, STEPS_PER_MM
+from LaserSpeed import LaserSpeed
+from LhystudiosDevice import onewire_crc_frames, lhymicro_distance, STATUS_OK, STATUS_BUSY, STATUS_ERROR, \
+    STATUS_FINISH
+
+
+def frames(data):
+    packets = [data[i:i + 30] for i in range(0, len(data), 30)]
+    packets[-1] += b'F' * (30 - len(packets[-1]))
+    return onewire_crc_frames(packets)
+
+
+class TestMockBoard(unittest.TestCase):
+
+    def test_motion_time(self):
+        board = LhystudioBoard(mode_change_time=0, status_latency=0, write_latency=0)
+        speed_code = LaserSpeed('M2', 20.0, fix_limit=True).speedcode.encode()
+        data = speed_code + b'NRBS1E' + b'B' + lhymicro_distance(2000) + b'FNSE'
+        duration = sum(board.parse(frame[1:31]) for frame in frames(data))
+        self.assertAlmostEqual(duration, 2000 / (20.0 * STEPS_PER_MM), delta=0.02)
+        self.assertEqual(board.steps, 2000)
+
+        duration = board.parse(b'IB|zR052S1P' + b'F' * 19)
+        self.assertAlmostEqual(duration, (51 + 52) / (board.rapid_speed * STEPS_PER_MM))
+
+    def test_status(self):
+        board = LhystudioBoard(buffer_size=2, mode_change_time=0, status_latency=0, write_latency=0)
+        move = frames(b'IB' + lhymicro_distance(400) + b'S1P')[0]
+        bad = move[:31] + bytes([move[31] ^ 0xFF])
+        board.write(bad)
+        self.assertEqual(board.status(), STATUS_ERROR)
+        board.write(move)
+        board.write(move)
+        board.write(move)
+        self.assertEqual(board.status(), STATUS_OK)
+        board.write(move)
+        self.assertEqual(board.status(), STATUS_BUSY)
+        time.sleep(4 * 400 / (board.rapid_speed * STEPS_PER_MM) + 0.02)
+        self.assertEqual(board.status(), STATUS_FINISH)
+        self.assertEqual(board.status(), STATUS_FINISH)  # Until the next packet.
+        board.write(move)
+        self.assertEqual(board.status(), STATUS_OK)
+        self.assertEqual(board.packets_accepted, 5)
+        self.assertEqual(board.packets_rejected, 1)
@@ -0,0 +1,52 @@
+from __future__ import print_function
+
+import random
+import unittest
+
+from LhystudiosDevice import PeepholeOptimizer
+
+PROGRAM = b'ICV2231611S1E'
+
+
+def optimize(data):
+    return PeepholeOptimizer().feed(data, True)
+
+
+class TestPeephole(unittest.TestCase):
+
+    def test_rules(self):
+        self.assertEqual(optimize(PROGRAM + b'BaBbRc'), PROGRAM + b'BcRc')
+        self.assertEqual(optimize(PROGRAM + b'MaMaMa'), PROGRAM + b'Mc')
+        self.assertEqual(optimize(PROGRAM + b'TBcLMa'), PROGRAM + b'BcLMa')
+        self.assertEqual(optimize(PROGRAM + b'DDaUUb'), PROGRAM + b'DaUb')
+        self.assertEqual(optimize(PROGRAM + b'Bzz001ab'), PROGRAM + b'Bzzd')
+        self.assertEqual(optimize(PROGRAM + b'B|c|c'), PROGRAM + b'B056')
+
+    def test_modes(self):
+        self.assertEqual(optimize(b'IBaBbS1P\n'), b'IBaBbS1P\n')  # Rapid mode.
+        self.assertEqual(optimize(PROGRAM + b'@NSEBaBb'), PROGRAM + b'@NSEBaBb')  # Program mode left.
+        self.assertEqual(optimize(PROGRAM + b'UNRzSEBaBb'), PROGRAM + b'UNRzSEBc')  # Back in program mode after a jog.
+        raster = b'ICV1552121016001079G002S1E'
+        self.assertEqual(optimize(raster + b'BaBbDDa'), raster + b'BaBbDDa')
+        self.assertEqual(optimize(raster + b'Ba|c|c'), raster + b'B057')
+
+    def test_chunks(self):
+        random.seed(3)
+        code = bytearray(PROGRAM)
+        for i in range(2000):
+            code += random.choice((b'B', b'T', b'L', b'R', b'M', b'D', b'U', b'@NSE', b'S1E', b'N', b'SE'))
+            code += random.choice((b'', b'a', b'y', b'z', b'|c', b'100', b'zz052'))
+        code = bytes(code)
+        whole = PeepholeOptimizer()
+        expected = whole.feed(code, True)
+        self.assertLess(len(expected), len(code))
+        chunked = PeepholeOptimizer()
+        data = bytearray()
+        position = 0
+        while position < len(code):
+            size = random.randint(1, 50)
+            data += chunked.feed(code[position:position + size])
+            position += size
+        data += chunked.feed(b'', True)
+        self.assertEqual(bytes(data), expected)
+        self.assertEqual((chunked.bytes_in, chunked.bytes_out), (len(code), len(expected)))
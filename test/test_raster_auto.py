@@ -0,0 +1,105 @@
+from __future__ import print_function
+
+import unittest
+from math import ceil
+
+from LaserCommandConstants import COMMAND_RASTER, COMMAND_SET_OVERSCAN
+from LaserOperation import LaserOperation
+from RasterPlotter import Y_AXIS
+from svgelements import SVGImage, Matrix
+
+try:
+    from PIL import Image, ImageDraw
+except ImportError:
+    Image = None
+
+
+def element(width, height):
+    """
+    Image of black stripes along its longer side.
+    """
+    image = Image.new('L', (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    for i in range(0, min(width, height), 6):
+        if width > height:
+            draw.line((0, i, width - 1, i), fill=0, width=2)
+        else:
+            draw.line((i, 0, i, height - 1), fill=0, width=2)
+    svg_image = SVGImage()
+    svg_image.image = image
+    svg_image.image_width, svg_image.image_height = image.size
+    svg_image.transform = Matrix('translate(100,100)')
+    return svg_image
+
+
+def rasters(operation):
+    return [command[1] for command in operation.generate()
+            if isinstance(command, tuple) and command[0] == COMMAND_RASTER]
+
+
+@unittest.skipIf(Image is None, "Pillow is not installed")
+class TestRasterAuto(unittest.TestCase):
+
+    def test_auto(self):
+        operation = LaserOperation(operation='Image', speed=100, power=1000, raster_direction=5)
+        operation.append(element(300, 40))
+        operation.append(element(40, 300))
+        self.assertIsNone(operation.raster_estimate(compute=False))  # Not estimated yet.
+        estimates = operation.raster_estimates()
+        self.assertEqual(operation.raster_estimates(compute=False), estimates)
+        self.assertLess(estimates[0][0], estimates[0][3])  # Lines along the wide image are rastered across it.
+        self.assertLess(estimates[1][3], estimates[1][0])
+        wide, tall = rasters(operation)
+        self.assertFalse(wide.traversal & Y_AXIS)
+        self.assertTrue(tall.traversal & Y_AXIS)
+        self.assertIn("T2B", operation.raster_estimate())
+        self.assertIn("Auto", str(operation))
+        self.assertIs(operation.raster_estimates()[0], estimates[0])  # Kept on the image.
+        operation.speed = 50
+        self.assertGreater(operation.raster_estimates()[0][0], estimates[0][0])
+        operation[0].image = element(40, 300).image  # A new image with the same settings is estimated afresh.
+        self.assertLess(operation.raster_estimates()[0][3], operation.raster_estimates()[0][0])
+
+    def test_fixed(self):
+        for direction in range(4):
+            operation = LaserOperation(operation='Image', speed=100, power=1000, raster_direction=direction)
+            operation.append(element(300, 40))
+            raster, = rasters(operation)
+            self.assertEqual(bool(raster.traversal & Y_AXIS), direction in (2, 3))
+
+    def test_overscan(self):
+        for step in (1, 2, 3):
+            operation = LaserOperation(operation='Image', speed=300, power=1000, overscan='auto')
+            self.assertEqual(operation.overscan, 'auto')
+            image = element(300, 40)
+            image.values['raster_step'] = step
+            operation.append(image)
+            overscan = operation.minimum_overscan()
+            commands = list(operation.generate())
+            set_overscan, = [command[1] for command in commands
+                             if isinstance(command, tuple) and command[0] == COMMAND_SET_OVERSCAN]
+            self.assertGreaterEqual(set_overscan, overscan)  # In mils, the overscan of the raster is in steps.
+            self.assertLess(set_overscan, overscan + step)
+            operation.speed = 400
+            self.assertGreater(operation.minimum_overscan(), overscan)  # Faster speeds take longer to ramp.
+            operation.speed = 60
+            self.assertLess(operation.minimum_overscan(), 20)
+            set_overscan, = [command[1] for command in operation.generate()
+                             if isinstance(command, tuple) and command[0] == COMMAND_SET_OVERSCAN]
+            self.assertEqual(set_overscan, step * ceil(20.0 / step))  # Never below the default.
+        operation = LaserOperation(operation='Image', speed=60, power=1000, overscan=30)
+        operation.append(element(300, 40))
+        self.assertIn((COMMAND_SET_OVERSCAN, 30), list(operation.generate()))
+
+    def test_jumps(self):
+        for direction in (4, 5):
+            operation = LaserOperation(operation='Image', speed=100, power=1000, raster_direction=direction)
+            operation.append(element(300, 40))
+            self.assertTrue(all(raster.jumps for raster in rasters(operation)))
+            estimate = operation.raster_estimates()[0]
+            operation.speed = 200
+            self.assertFalse(any(raster.jumps for raster in rasters(operation)))
+            operation.speed = 100
+            self.assertFalse(any(command[1].jumps for command in operation.generate(rapid_speed=100)
+                                 if isinstance(command, tuple) and command[0] == COMMAND_RASTER))
+            self.assertIsNot(operation.raster_estimates(100)[0], estimate)  # Estimated without jumps.
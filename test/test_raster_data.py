@@ -0,0 +1,71 @@
+from __future__ import print_function
+
+import random
+import unittest
+
+import LaserOperation as laser_operation
+from LaserOperation import LaserOperation
+from RasterPlotter import RasterPlotter, Y_AXIS
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+def reference_filter(image):
+    """
+    Per pixel filters of each image mode.
+    """
+    if image.mode == "P":
+        p = image.getpalette()
+        return lambda pixel: 1.0 - (p[pixel * 3] + p[pixel * 3 + 1] + p[pixel * 3 + 2]) / 765.0
+    if image.mode == "RGB":
+        return lambda pixel: 1.0 - (pixel[0] + pixel[1] + pixel[2]) / 765.0
+    if image.mode == "RGBA":
+        return lambda pixel: (1.0 - (pixel[0] + pixel[1] + pixel[2]) / 765.0) * pixel[3] / 255.0
+    return lambda pixel: (255 - pixel) / 255.0
+
+
+def images(width, height):
+    random.seed(5)
+    rgba = Image.new("RGBA", (width, height), (255, 255, 255, 255))
+    for y in range(height):
+        for x in range(width):
+            if (x // 4 + y // 3) % 3:
+                rgba.putpixel((x, y), tuple(random.choice((0, 90, 255)) for i in range(3)) +
+                              (random.choice((0, 128, 255)),))
+    return [rgba, rgba.convert("RGB"), rgba.convert("L"), rgba.convert("1"), rgba.convert("RGB").convert("P"),
+            rgba.convert("LA")]
+
+
+@unittest.skipIf(Image is None, "Pillow is not installed")
+class TestRasterData(unittest.TestCase):
+
+    def check(self):
+        for image in images(30, 20):
+            data, image_filter = LaserOperation.raster_data(image)
+            if laser_operation.np is not None:
+                self.assertIsNone(image_filter)  # Converted in bulk.
+            converted = image if image.mode != "LA" else image.convert("RGBA")
+            reference = converted.load()
+            expected = reference_filter(converted)
+            for traversal in (0, Y_AXIS):
+                raster = RasterPlotter(data, 30, 20, traversal, 0, 3, 10, 10, 1, image_filter)
+                for y in range(20):
+                    for x in range(30):
+                        self.assertEqual(raster.px(x, y), expected(reference[x, y]))
+                plot = list(raster.plot())
+                self.assertEqual(plot, list(RasterPlotter(reference, 30, 20, traversal, 0, 3, 10, 10, 1,
+                                                          expected).plot()))
+
+    def test_raster_data(self):
+        self.check()
+
+    def test_raster_data_fallback(self):
+        saved = laser_operation.np
+        laser_operation.np = None
+        try:
+            self.check()
+        finally:
+            laser_operation.np = saved
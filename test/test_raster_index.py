@@ -0,0 +1,142 @@
+from __future__ import print_function
+
+import random
+import unittest
+
+import RasterPlotter as raster_plotter
+from RasterPlotter import RasterPlotter, ArrayPixels, Y_AXIS, BOTTOM, RIGHT
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def image(width, height, levels, seed):
+    random.seed(seed)
+    data = {}
+    for y in range(height):
+        for x in range(width):
+            if y % 9 == 4 or x % 13 == 6:
+                data[x, y] = 255  # Blank rows and columns.
+            else:
+                data[x, y] = random.choice(levels)
+    return data
+
+
+def image_filter(pixel):
+    return (255 - pixel) / 255.0
+
+
+def burned(plot, axis):
+    """
+    Pixels plotted with a value, along the scanlines of the axis.
+    """
+    pixels = set()
+    for last, event in zip(plot, plot[1:]):
+        if event[2] and last[1 - axis] == event[1 - axis]:
+            a, b = sorted((last[axis], event[axis]))
+            for n in range(a, b + 1):
+                pixels.add((event[1 - axis], n, event[2]))
+    return pixels
+
+
+def scan_next(px, x, y, dx, dy, default):
+    """
+    Reference scan for the next pixel change from (x, y) in the direction (dx, dy).
+    """
+    v = px(x, y)
+    while True:
+        if px(x, y) != v:
+            return x if dx else y
+        if not (0 <= x + dx < 40 and 0 <= y + dy < 30):
+            return default
+        x += dx
+        y += dy
+
+
+class TestRasterIndex(unittest.TestCase):
+
+    def plotters(self, data, traversal):
+        plotters = [RasterPlotter(data, 40, 30, traversal, 0, 5, 100, 200, 1, image_filter)]
+        if np is not None:
+            values = np.array([[image_filter(data[x, y]) for x in range(40)] for y in range(30)])
+            plotters.append(RasterPlotter(ArrayPixels(values), 40, 30, traversal, 0, 5, 100, 200, 1))
+            lut = [image_filter(v) for v in range(256)]
+            codes = np.array([[data[x, y] for x in range(40)] for y in range(30)], dtype=np.uint8)
+            plotters.append(RasterPlotter(ArrayPixels(codes, lut), 40, 30, traversal, 0, 5, 100, 200, 1))
+        saved = raster_plotter.np
+        raster_plotter.np = None  # Index built by scanning.
+        try:
+            plotters.append(RasterPlotter(data, 40, 30, traversal, 0, 5, 100, 200, 1, image_filter))
+        finally:
+            raster_plotter.np = saved
+        return plotters
+
+    def test_lookups(self):
+        data = image(40, 30, (0, 128, 255), 1)
+        for raster in self.plotters(data, 0):
+            px = raster.px
+            for y in range(30):
+                values = [px(x, y) for x in range(40)]
+                marked = [x for x in range(40) if values[x] != 0]
+                self.assertEqual(raster.leftmost_not_equal(y), marked[0] if marked else None)
+                self.assertEqual(raster.rightmost_not_equal(y), marked[-1] if marked else None)
+                for x in range(1, 39):
+                    self.assertEqual(raster.nextcolor_right(x, y), scan_next(px, x, y, 1, 0, 39))
+                    self.assertEqual(raster.nextcolor_left(x, y), scan_next(px, x, y, -1, 0, 0))
+            for x in range(40):
+                marked = [y for y in range(30) if px(x, y) != 0]
+                self.assertEqual(raster.topmost_not_equal(x), marked[0] if marked else None)
+                self.assertEqual(raster.bottommost_not_equal(x), marked[-1] if marked else None)
+                for y in range(1, 29):
+                    self.assertEqual(raster.nextcolor_bottom(x, y), scan_next(px, x, y, 0, 1, 29))
+                    self.assertEqual(raster.nextcolor_top(x, y), scan_next(px, x, y, 0, -1, 0))
+            self.assertRaises(IndexError, raster.leftmost_not_equal, -1)
+            self.assertRaises(IndexError, raster.topmost_not_equal, 40)
+
+    def test_plot(self):
+        data = image(40, 30, (0, 100, 255), 2)
+        for traversal in (0, BOTTOM, RIGHT, Y_AXIS, Y_AXIS | RIGHT | BOTTOM):
+            plots = [list(raster.plot()) for raster in self.plotters(data, traversal)]
+            self.assertGreater(len(plots[0]), 100)
+            for plot in plots[1:]:
+                self.assertEqual(plot, plots[0])
+
+    def test_shared_index(self):
+        data = image(40, 30, (0, 255), 3)
+        raster = RasterPlotter(data, 40, 30, 0, 0, 5, 0, 0, 1, image_filter)
+        cross = RasterPlotter(data, 40, 30, Y_AXIS, 0, 5, 0, 0, 1, image_filter, index=raster.index)
+        self.assertIs(cross.index, raster.index)
+        alone = RasterPlotter(data, 40, 30, Y_AXIS, 0, 5, 0, 0, 1, image_filter)
+        self.assertEqual(list(cross.plot()), list(alone.plot()))
+
+    def test_travel(self):
+        data = image(40, 30, (0, 128, 255), 4)
+        for traversal in (0, BOTTOM, RIGHT, Y_AXIS, Y_AXIS | RIGHT | BOTTOM):
+            axis = 1 if traversal & Y_AXIS else 0
+            for raster in self.plotters(data, traversal):
+                for raster.jumps in (False, True):
+                    plot = list(raster.plot())
+                    travel = raster.travel()
+                    scanned = sum(abs(plot[i][axis] - plot[i - 1][axis]) for i in range(1, len(plot)))
+                    stepped = sum(abs(plot[i][1 - axis] - plot[i - 1][1 - axis]) for i in range(1, len(plot)))
+                    self.assertEqual(sum(t[0] + t[3] for t in travel), scanned)
+                    self.assertEqual(sum(t[2] for t in travel), stepped)
+                runs = raster.index.runs(0 if traversal & Y_AXIS else 1)
+                line = raster.index.column if traversal & Y_AXIS else raster.index.row
+                self.assertEqual(runs, [len(line(i)[2]) for i in range(len(runs))])
+
+    def test_jumps(self):
+        data = image(40, 30, (0, 128, 255), 5)
+        for x, y in data:
+            if not (2 <= x <= 10 and 2 <= y <= 8 or 28 <= x <= 37 and 18 <= y <= 26):
+                data[x, y] = 255  # Opposite corners with a blank band between them.
+        for traversal in (0, BOTTOM, RIGHT, Y_AXIS, Y_AXIS | RIGHT | BOTTOM):
+            axis = 1 if traversal & Y_AXIS else 0
+            raster = RasterPlotter(data, 40, 30, traversal, 0, 5, 100, 200, 1, image_filter)
+            jumps = RasterPlotter(data, 40, 30, traversal, 0, 5, 100, 200, 1, image_filter, jumps=True)
+            self.assertEqual(burned(list(jumps.plot()), axis), burned(list(raster.plot()), axis))
+            travel = jumps.travel()
+            self.assertLess(sum(t[0] for t in travel), sum(t[0] for t in raster.travel()))  # Scanned less.
+            self.assertGreater(sum(t[3] for t in travel), 0)
@@ -0,0 +1,90 @@
+from __future__ import print_function
+
+import re
+import unittest
+
+from LaserCommandConstants import COMMAND_RASTER
+from LaserOperation import LaserOperation
+from LhystudiosCompiler import LhymicroCompiler
+from RasterPlotter import Y_AXIS
+from svgelements import SVGImage, Matrix
+from test_compiler import Connection, SETTINGS, initial_state
+
+try:
+    from PIL import Image, ImageDraw
+except ImportError:
+    Image = None
+
+
+def element():
+    """
+    Image of small marks with gaps of several pixels between their rows and between their columns.
+    """
+    image = Image.new('L', (60, 40), 255)
+    draw = ImageDraw.Draw(image)
+    for y in (0, 1, 2, 9, 10, 20, 30, 31):
+        for x in (3, 4, 12, 25, 26, 27, 40, 50):
+            draw.point((x + y % 3, y), fill=0)
+    svg_image = SVGImage()
+    svg_image.image = image
+    svg_image.image_width, svg_image.image_height = image.size
+    svg_image.transform = Matrix('translate(100,100)')
+    return svg_image
+
+
+def lateral_steps(code, codes):
+    """
+    Reads the code as the board does. In program mode, each change of the direction along the scanlines steps the
+    head to the next scanline. Each time program mode is entered again, after a jump, the direction declared must be
+    the direction of the scanline before the jump.
+
+    :param codes: the two direction codes along the scanlines.
+    :return: count of lateral steps and count of jumps declaring another direction.
+    """
+    program = False
+    direction = None
+    swept = None
+    steps = 0
+    mismatched = 0
+    previous = b''
+    for match in re.finditer(br'([A-Z@])([0-9a-z|]*)', code):
+        command = match.group(1)
+        if command == b'E' and previous == b'S1':
+            program = True
+            if swept is not None and direction != swept:
+                mismatched += 1
+        elif program and command == b'@':
+            program = False
+            swept = direction  # Jumps leave program mode with @NSE.
+        elif program and command == b'N' and previous[:1] == b'F':
+            program = False
+            swept = None
+        if command in codes:
+            if program and direction is not None and command != direction:
+                steps += 1
+            direction = command
+        previous = match.group(0)
+    return steps, mismatched
+
+
+@unittest.skipIf(Image is None, "Pillow is not installed")
+class TestRasterJumps(unittest.TestCase):
+
+    def test_directions(self):
+        for direction in range(5):
+            for speed in (100, 200):  # Rastered with jumps, and without, below and above the rapid speed.
+                operation = LaserOperation(operation='Image', speed=speed, power=1000, raster_direction=direction)
+                operation.append(element())
+                rasters = [command[1] for command in operation.generate(rapid_speed=SETTINGS['jog_rapid_speed'])
+                           if isinstance(command, tuple) and command[0] == COMMAND_RASTER]
+                scanlines = {b'BT': 0, b'LR': 0}
+                for raster in rasters:
+                    self.assertEqual(raster.jumps, speed < SETTINGS['jog_rapid_speed'])
+                    axis = 0 if raster.traversal & Y_AXIS else 1
+                    scanlines[b'LR' if axis == 0 else b'BT'] += len(set(event[axis] for event in raster.plot())) - 1
+                connection = Connection()
+                LhymicroCompiler(connection).compile(1, operation, initial_state(), dict(SETTINGS))
+                code = b''.join(m[2] for m in connection.messages if m[0] == 'data')
+                for codes, lines in scanlines.items():
+                    # Every scanline of the rasters is stepped to once, the jumps keep the direction of the sweep.
+                    self.assertEqual(lateral_steps(code, codes), (lines, 0), (direction, speed, codes))
@@ -0,0 +1,76 @@
+from __future__ import print_function
+
+import random
+import unittest
+
+from LhystudiosDevice import LhymicroInterpreter
+from RasterPlotter import RasterPlotter, BOTTOM, RIGHT, Y_AXIS, UNIDIRECTIONAL
+from zinglplotter import ZinglPlotter
+
+
+def image(width, height, levels, seed):
+    random.seed(seed)
+    data = {}
+    for y in range(height):
+        for x in range(width):
+            if (x // 7 + y // 5) % 3 == 0:
+                data[x, y] = 0
+            elif x < width // 2:
+                data[x, y] = 255
+            else:
+                data[x, y] = random.choice(levels)
+    return data
+
+
+def image_filter(pixel):
+    return (255 - pixel) / 255.0
+
+
+class TestRasterRuns(unittest.TestCase):
+
+    def plots(self, data, traversal, step, power):
+        width, height = 40, 30
+        plots = []
+        for runs in (False, True):
+            interpreter = LhymicroInterpreter(None)
+            interpreter.power = power
+            raster = RasterPlotter(data, width, height, traversal, 0, 5, 100, 200, step, image_filter)
+            sx, sy = raster.initial_position_in_scene()
+            if runs:
+                generate = interpreter.convert_to_raster_runs(raster.plot(), sx, sy)
+            else:
+                generate = interpreter.convert_to_wrapped_plot(ZinglPlotter.singles(raster.plot()), True, sx, sy)
+            plots.append((list(generate), interpreter.pulse_total))
+        return plots
+
+    def test_runs_match_singles(self):
+        data = image(40, 30, (0, 255), 1)
+        for traversal in (0, BOTTOM, UNIDIRECTIONAL, Y_AXIS | RIGHT, Y_AXIS | BOTTOM | UNIDIRECTIONAL):
+            for step in (1, 2, 3):
+                singles, runs = self.plots(data, traversal, step, 1000.0)
+                self.assertEqual(singles, runs)
+
+    def test_runs_match_singles_ppi(self):
+        data = image(40, 30, (0, 100, 200, 255), 2)
+        for power in (1000.0, 650.0, 333.0):
+            for traversal in (0, Y_AXIS):
+                singles, runs = self.plots(data, traversal, 2, power)
+                self.assertEqual(singles, runs)
+
+    def test_fold_jump(self):
+        interpreter = LhymicroInterpreter(None)
+        interpreter.overscan = 20
+        # Back to the start of the next scanline, against the coming sweep, all made within the jump.
+        interpreter.plot = iter([(1280, 1170, 0), (1300, 1170, 0), (1361, 1170, 1)])
+        self.assertEqual(interpreter.fold_jump(2850, 1170, 0, 1), -1570)
+        self.assertEqual(list(interpreter.plot), [(1300, 1170, 0), (1361, 1170, 1)])
+        # Along the coming sweep, stopping short by the overscan.
+        interpreter.plot = iter([(1073, 1090, 0), (1056, 1090, 1)])
+        self.assertEqual(interpreter.fold_jump(1380, 1090, 0, -1), -287)
+        self.assertEqual(list(interpreter.plot), [(1073, 1090, 0), (1056, 1090, 1)])
+        interpreter.plot = iter([(510, 1065, 0), (510, 1090, 1)])
+        self.assertEqual(interpreter.fold_jump(510, 1050, 1, 1), 0)  # Within the overscan.
+        self.assertEqual(list(interpreter.plot), [(510, 1065, 0), (510, 1090, 1)])
+        interpreter.plot = iter([(510, 1090, 1)])
+        self.assertEqual(interpreter.fold_jump(510, 1050, 1, 1), 0)
+        self.assertEqual(list(interpreter.plot), [(510, 1090, 1)])
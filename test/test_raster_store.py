@@ -0,0 +1,77 @@
+from __future__ import print_function
+
+import random
+import unittest
+
+import RasterPlotter as raster_plotter
+from LaserOperation import LaserOperation
+from RasterPlotter import RasterPlotter, Y_AXIS, BOTTOM, RIGHT
+from RasterStore import TiledRaster
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+def image_filter(pixel):
+    return (255 - pixel) / 255.0
+
+
+def image(width, height, seed):
+    random.seed(seed)
+    im = Image.new('L', (width, height), 255)
+    for y in range(height):
+        for x in range(width):
+            if (x // 5 + y // 7) % 3:
+                im.putpixel((x, y), random.choice((0, 100, 255)))
+    return im
+
+
+@unittest.skipIf(Image is None, "Pillow is not installed")
+class TestRasterStore(unittest.TestCase):
+
+    def test_pixels(self):
+        for im in (image(37, 29, 1), image(37, 29, 1).convert('1')):
+            raster = TiledRaster.from_image(im, tile_height=4)
+            self.assertEqual(raster.mode, im.mode)
+            self.assertEqual(raster.image().tobytes(), im.tobytes())
+            pixels = im.load()
+            for y in range(29):
+                self.assertEqual(raster.row(y), [pixels[x, y] for x in range(37)])
+                for x in range(37):
+                    self.assertEqual(raster[x, y], pixels[x, y])
+            for x in range(37):
+                self.assertEqual(raster.column(x), [pixels[x, y] for y in range(29)])
+            if raster_plotter.np is not None:
+                self.assertEqual(raster.rows(3, 11).tolist(), [raster.row(y) for y in range(3, 11)])
+            box = im.getbbox()
+            self.assertEqual(raster.getbbox(), box)
+            self.assertEqual(raster.crop(box).image().tobytes(), im.crop(box).tobytes())
+            self.assertEqual(raster.thumbnail(10, 8).size, (10, 8))
+            raster.close()
+
+    def test_transformed(self):
+        for im in (image(60, 45, 2), image(60, 45, 2).convert('1')):
+            for coefficients in ((0.7371, 0, -3.3, 0, 1.1313, 5.7), (-1.01, 0, 60, 0, 0.5, 1.5)):
+                raster = TiledRaster.transformed(im, (70, 80), coefficients, Image.BICUBIC, tile_height=9)
+                expected = im.transform((70, 80), Image.AFFINE, coefficients, resample=Image.BICUBIC)
+                self.assertEqual(raster.image().tobytes(), expected.tobytes())
+
+    def test_plot(self):
+        im = image(40, 30, 3)
+        raster = TiledRaster.from_image(im, tile_height=7)
+        data, data_filter = LaserOperation.raster_data(raster.image(), raster)
+        self.assertIs(data, raster)
+        for traversal in (0, BOTTOM, RIGHT, Y_AXIS, Y_AXIS | RIGHT | BOTTOM):
+            expected = list(RasterPlotter(im.load(), 40, 30, traversal, 0, 5, 100, 200, 1, image_filter).plot())
+            self.assertGreater(len(expected), 100)
+            self.assertEqual(list(RasterPlotter(data, 40, 30, traversal, 0, 5, 100, 200, 1, data_filter).plot()),
+                             expected)
+            saved = raster_plotter.np
+            raster_plotter.np = None  # Index built by reading rows and columns.
+            try:
+                self.assertEqual(list(RasterPlotter(data, 40, 30, traversal, 0, 5, 100, 200, 1,
+                                                    data_filter).plot()), expected)
+            finally:
+                raster_plotter.np = saved
@@ -0,0 +1,57 @@
+from __future__ import print_function
+
+import time
+import unittest
+
+from LhystudiosCompiler import CompilerDevice
+from LhystudiosDevice import LhymicroInterpreter, SliceMetrics
+
+
+class TestSlices(unittest.TestCase):
+
+    def test_slice_budget(self):
+        interpreter = LhymicroInterpreter(None)
+        interpreter.device = CompilerDevice(dict(opt_peephole=False))
+        self.assertFalse(interpreter.slice_spent())  # No slice running.
+        interpreter.slice_end = time.perf_counter() + 10.0
+        interpreter.slice_limit = 100
+        self.assertFalse(interpreter.slice_spent())
+        interpreter.write(b'a' * 100)
+        self.assertTrue(interpreter.slice_spent())
+        interpreter.slice_limit = 1000
+        self.assertFalse(interpreter.slice_spent())
+        interpreter.slice_end = time.perf_counter()
+        self.assertTrue(interpreter.slice_spent())
+
+    def test_wake_on_drain(self):
+        interpreter = LhymicroInterpreter(None)
+        interpreter.device = CompilerDevice(dict())
+        interpreter.next_run = time.time() + 1.0
+        interpreter.pipe_drained(0)
+        self.assertNotEqual(interpreter.next_run, 0)  # Not held.
+        interpreter.held = True
+        interpreter.pipe_drained(0)
+        self.assertEqual(interpreter.next_run, 0)
+        self.assertFalse(interpreter.held)
+        interpreter.wait(1.0)  # A COMMAND_WAIT issued with the buffer full.
+        interpreter.held = True
+        interpreter.pipe_drained(0)
+        self.assertEqual(interpreter.next_run, 1.0)  # The wait survives the drain.
+        interpreter.wait_end = time.time()
+        interpreter.held = True
+        interpreter.pipe_drained(0)
+        self.assertEqual(interpreter.next_run, 0)  # Once it has passed, the drain wakes the interpreter.
+
+    def test_metrics(self):
+        metrics = SliceMetrics()
+        self.assertEqual(list(metrics.report(0.02)), ['No slices recorded.'])
+        metrics.record(0.0, 0.005, 900, 'hold', 0.01)
+        metrics.record(0.012, 0.022, 1800, 'budget', 0.01)
+        metrics.record(0.040, 0.041, 10, 'idle', 0.01)
+        self.assertEqual(metrics.ended, {'hold': 1, 'budget': 1, 'idle': 1})
+        self.assertEqual([round(s[3], 6) for s in metrics.slices], [0.0, -0.003, 0.008])
+        report = list(metrics.report(0.02))
+        self.assertEqual(report[0], 'Slices: 3 (held 1, budget 1, idle 1)')
+        self.assertEqual(report[-1], 'Bytes: 903.3 per slice')
+        metrics.reset()
+        self.assertEqual(len(metrics.slices), 0)
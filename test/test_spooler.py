@@ -0,0 +1,80 @@
+from __future__ import print_function
+
+import threading
+import time
+import unittest
+
+from Kernel import Interpreter, Spooler
+from LaserCommandConstants import *
+
+
+class Device:
+    def __init__(self):
+        self.jobs = []
+        self.quit = False
+        self.interpreter_thread = True
+
+    def signal(self, code, *message):
+        pass
+
+    def threaded(self, func, thread_name=None):
+        thread = threading.Thread(target=func, name=thread_name)
+        thread.start()
+        return thread
+
+
+def spooler():
+    spooler = Spooler()
+    spooler.device = Device()
+    return spooler
+
+
+class TestSpooler(unittest.TestCase):
+
+    def test_wait_timeout(self):
+        s = spooler()
+        start = time.time()
+        self.assertIsNone(s.wait(0.05))
+        self.assertGreaterEqual(time.time() - start, 0.04)
+        s.job(COMMAND_HOME)
+        self.assertEqual(s.wait(10.0), COMMAND_HOME)  # Returns at once with a job queued.
+
+    def test_wait_job(self):
+        s = spooler()
+        timer = threading.Timer(0.05, s.job, (COMMAND_MOVE, 10, 20))
+        timer.start()
+        start = time.time()
+        self.assertEqual(s.wait(10.0), (COMMAND_MOVE, 10, 20))
+        self.assertLess(time.time() - start, 5.0)
+        timer.join()
+
+    def test_wake(self):
+        s = spooler()
+        timer = threading.Timer(0.05, s.wake)
+        timer.start()
+        start = time.time()
+        self.assertIsNone(s.wait(10.0))
+        self.assertLess(time.time() - start, 5.0)
+        timer.join()
+
+    def test_feeder_wait(self):
+        device = Device()
+        device.spooler = spooler()
+        interpreter = Interpreter()
+        interpreter.device = device
+        ran = []
+        device.spooler.job(COMMAND_WAIT, 0.3)
+        device.spooler.job(COMMAND_FUNCTION, lambda: ran.append(time.time()))
+        start = time.time()
+        interpreter.start_feeder()
+        try:
+            while interpreter.wait_end is None and time.time() - start < 5.0:
+                time.sleep(0.005)
+            interpreter.wake()  # As the pipe does once its buffer drains.
+            interpreter.feeder_event.set()  # Even an event set outright does not end the wait.
+            while not ran and time.time() - start < 5.0:
+                time.sleep(0.005)
+        finally:
+            interpreter.stop()
+        self.assertEqual(len(ran), 1)
+        self.assertGreaterEqual(ran[0] - start, 0.29)